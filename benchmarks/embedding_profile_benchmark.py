@@ -0,0 +1,136 @@
+"""
+Recall, search latency and storage of the embedding profiles (Titan v2 dimension x vector storage).
+
+    python benchmarks/embedding_profile_benchmark.py --rows 100000 --index
+    python benchmarks/embedding_profile_benchmark.py --profiles 1024-float32 256-binary-rerank4
+
+Each profile gets its own table written through `document_schema` and is searched through
+the chat processor's `search_with_lancedb`, so storage conversion and re-ranking are the
+production code paths. Ground truth is an exact float32 search over the 1024-dimension
+vectors. Vectors are drawn from a Gaussian mixture, smaller Titan outputs are approximated
+by a fixed random projection of them, which keeps neighbourhoods but is not what Titan
+returns; check recall on real embeddings before switching a deployment.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# Puts the embedding processor on sys.path, the chat processor has to come before it for `index`
+from vector_index_benchmark import make_vectors, recall
+
+LAMBDA_DIR = os.path.join(os.path.dirname(__file__), '..', 'lambda')
+sys.path.insert(0, os.path.join(LAMBDA_DIR, 'embedding-processor'))
+sys.path.insert(0, os.path.join(LAMBDA_DIR, 'chat-processor'))
+
+import lancedb
+import numpy as np
+import pyarrow as pa
+
+from embedding_profile import EmbeddingProfile
+from table_schema import document_schema
+from vector_index import build_vector_index
+
+import index as chat
+
+DEFAULT_PROFILES = [
+    '1024-float32', '1024-float16', '512-float32', '256-float32', '256-float16',
+    '1024-binary', '1024-binary-rerank4', '256-binary-rerank8',
+]
+
+def parse_profile(name: str) -> EmbeddingProfile:
+    """'256-binary-rerank4' -> EmbeddingProfile(256, storage='binary', rerank_factor=4)"""
+    parts = name.split('-')
+    rerank_factor = int(parts[2][len('rerank'):]) if len(parts) > 2 else 0
+    return EmbeddingProfile(dimension=int(parts[0]), storage=parts[1], rerank_factor=rerank_factor)
+
+def project(vectors: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+    projected = vectors @ matrix
+    return projected / np.linalg.norm(projected, axis=1, keepdims=True)
+
+def write_table(db, name: str, profile: EmbeddingProfile, vectors: np.ndarray, batch_size: int = 20000):
+    schema = document_schema(profile)
+
+    def batches():
+        for start in range(0, len(vectors), batch_size):
+            rows = [{
+                **profile.vector_columns(vector),
+                'id': str(start + offset),
+                'text': '',
+                'source': 'benchmark.pdf',
+                'page': 1,
+                'chunk_index': start + offset,
+            } for offset, vector in enumerate(vectors[start:start + batch_size].tolist())]
+            yield pa.RecordBatch.from_pylist(rows, schema=schema)
+
+    return db.create_table(name, data=batches(), schema=schema)
+
+def exact_neighbours(vectors: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    result = []
+    for query in queries:
+        distances = np.sum((vectors - query) ** 2, axis=1)
+        result.append(np.argpartition(distances, k)[:k])
+    return np.array(result)
+
+def directory_bytes(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+def run_queries(table, queries: np.ndarray, k: int, nprobes: int, refine_factor: int):
+    latencies = []
+    ids = []
+    for query in queries.tolist():
+        start = time.perf_counter()
+        results = chat.search_with_lancedb(table, query, top_k=k, nprobes=nprobes, refine_factor=refine_factor, max_distance=None)
+        latencies.append(time.perf_counter() - start)
+        ids.append([int(result['id']) for result in results])
+    return np.array(latencies) * 1000, ids
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--k', type=int, default=3)
+    parser.add_argument('--profiles', nargs='+', default=DEFAULT_PROFILES, help='<dimension>-<storage>[-rerank<factor>]')
+    parser.add_argument('--index', action='store_true', help='also search with the vector index the embedding processor builds')
+    parser.add_argument('--nprobes', type=int, default=chat.SEARCH_NPROBES)
+    parser.add_argument('--refine-factor', type=int, default=chat.SEARCH_REFINE_FACTOR)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    vectors = make_vectors(args.rows, 1024, rng)
+    queries = vectors[rng.integers(0, args.rows, size=args.queries)] + 0.05 * rng.normal(size=(args.queries, 1024)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    truth = exact_neighbours(vectors, queries, args.k)
+    # One projection per dimension, shared by documents and queries like one Titan output size
+    projections = {dimension: rng.normal(size=(1024, dimension)).astype(np.float32) for dimension in (256, 512)}
+
+    workdir = tempfile.mkdtemp(prefix='profile-bench-')
+    try:
+        db = lancedb.connect(workdir)
+        print(f"{args.rows} rows, {args.queries} queries, recall@{args.k} against exact 1024-dim float32 search")
+        print(f"{'profile':<22} {'search':<12} {'bytes/row':>10} {'recall@k':>9} {'p50_ms':>8} {'p99_ms':>8}")
+        for name in args.profiles:
+            profile = parse_profile(name)
+            if profile.dimension in projections:
+                documents = project(vectors, projections[profile.dimension])
+                profile_queries = project(queries, projections[profile.dimension])
+            else:
+                documents, profile_queries = vectors, queries
+            table = write_table(db, profile.name, profile, documents)
+            bytes_per_row = directory_bytes(os.path.join(workdir, f"{profile.name}.lance")) / args.rows
+
+            modes = [('brute force', False)] + ([('index', True)] if args.index else [])
+            for mode, indexed in modes:
+                if indexed:
+                    build_vector_index(table, args.rows, profile.distance_type)
+                latencies, found = run_queries(table, profile_queries, args.k, args.nprobes, args.refine_factor)
+                print(f"{profile.name:<22} {mode:<12} {bytes_per_row:>10.0f} {recall(found, truth):>9.3f} "
+                      f"{np.percentile(latencies, 50):>8.2f} {np.percentile(latencies, 99):>8.2f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
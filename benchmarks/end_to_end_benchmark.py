@@ -0,0 +1,275 @@
+"""
+Offline end-to-end benchmark of the embedding and chat Lambda handlers.
+
+    python benchmarks/end_to_end_benchmark.py --users 4 --documents 3 --pages 20 \\
+        --chat-requests 200 --concurrency 4 --embedding-latency-ms 30 --converse-latency-ms 400
+
+Both handlers run unmodified against local stand-ins (benchmarks/local_aws.py): a
+local-directory LanceDB, S3 as files, an in-memory DynamoDB and a deterministic fake
+Bedrock with the configured latencies. Each of the --concurrency worker processes plays
+one Lambda container: it imports the handler once (the cold start) and then handles one
+event at a time. The ingest phase sends SQS batches of DOCUMENT_UPLOADED records, the
+chat phase sends AppSync resolver events for the users whose documents were ingested.
+
+Reported per phase: throughput (documents/min, chat requests/s), p50/p99 latency per
+invocation, peak RSS of a container, cold-start import time, and p50/p99 per stage
+from the handlers' EMF metrics. Note that DynamoDB state is per container, so chat
+history is not shared between workers. --json writes the results for comparing runs.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from typing import Any, Dict, List
+
+import numpy as np
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+LAMBDA_DIRS = {
+    'ingest': os.path.join(BENCHMARKS_DIR, '..', 'lambda', 'embedding-processor'),
+    'chat': os.path.join(BENCHMARKS_DIR, '..', 'lambda', 'chat-processor'),
+}
+SOURCE_BUCKET = 'benchmark-documents'
+EMBEDDINGS_BUCKET = 'benchmark-embeddings'
+USER_DOCUMENT_TABLE = 'UserDocument-benchmark'
+CHAT_HISTORY_TABLE = 'chat-history-benchmark'
+
+class FakeContext:
+    def __init__(self, function_name: str):
+        self.function_name = function_name
+        self.aws_request_id = str(uuid.uuid4())
+
+    def get_remaining_time_in_millis(self) -> int:
+        return 900000
+
+# Worker process state, one handler module per process like one per Lambda container
+_worker: Dict[str, Any] = {}
+
+def init_worker(phase: str, options: Dict[str, Any], barrier) -> None:
+    started = time.perf_counter()
+    sys.path.insert(0, BENCHMARKS_DIR)
+    sys.path.insert(0, LAMBDA_DIRS[phase])
+    os.environ.update({
+        'AWS_DEFAULT_REGION': 'us-east-1',
+        'SOURCE_BUCKET_NAME': SOURCE_BUCKET,
+        'EMBEDDINGS_BUCKET_NAME': EMBEDDINGS_BUCKET,
+        'USER_DOCUMENT_TABLE_NAME': USER_DOCUMENT_TABLE,
+        'CHAT_HISTORY_TABLE_NAME': CHAT_HISTORY_TABLE,
+        'EMBEDDING_DIMENSIONS': str(options['dimension']),
+        'EMBEDDING_STORAGE': options['storage'],
+        'EMBEDDING_RERANK_FACTOR': str(options['rerank_factor']),
+        # Events are replayed as they are, there is no queue to defer uploads to
+        'USER_BATCH_QUOTA': str(options['batch_size']),
+    })
+    if not options['verbose']:
+        sys.stdout = open(os.devnull, 'w')
+
+    import index
+    init_ms = (time.perf_counter() - started) * 1000
+
+    import lancedb
+    from local_aws import FakeBedrockRuntime, InMemoryDynamoDB, LocalS3
+    bedrock = FakeBedrockRuntime(
+        dimension=options['dimension'],
+        embedding_latency=options['embedding_latency_ms'] / 1000,
+        converse_latency=options['converse_latency_ms'] / 1000,
+        output_tokens=options['output_tokens'],
+        tokens_per_second=options['tokens_per_second'],
+        throttle_rate=options['throttle_rate'],
+        seed=os.getpid(),
+    )
+    dynamodb = InMemoryDynamoDB({USER_DOCUMENT_TABLE: ('id', None), CHAT_HISTORY_TABLE: ('userName', 'idx')})
+    lance_root = os.path.join(options['workdir'], 'lancedb')
+
+    if phase == 'ingest':
+        index._shared['s3'] = LocalS3(os.path.join(options['workdir'], 's3'))
+        index._shared['dynamodb'] = dynamodb
+        index._shared['bedrock'] = bedrock
+        index.connect_to_user_db = lambda user_id: lancedb.connect(os.path.join(lance_root, user_id))
+        function_name = 'EmbeddingProcessor'
+    else:
+        index._clients.update({'bedrock-runtime': bedrock, 'dynamodb': dynamodb})
+        index.lancedb_cache.connect = lambda user_id: lancedb.connect(os.path.join(lance_root, user_id))
+        function_name = 'ChatProcessor'
+
+    records: List[Dict[str, Any]] = []
+    index.metrics.sink = records.append
+    _worker.update(handler=index.handler, function_name=function_name, records=records, init_ms=init_ms, new=True)
+    barrier.wait()
+
+def invoke(event: Dict[str, Any]) -> Dict[str, Any]:
+    started = time.perf_counter()
+    try:
+        result = _worker['handler'](event, FakeContext(_worker['function_name']))
+        ok = not result.get('batchItemFailures') if 'batchItemFailures' in result else bool(result.get('response'))
+    except Exception:
+        ok = False
+    latency_ms = (time.perf_counter() - started) * 1000
+    outcome = {
+        'pid': os.getpid(),
+        'latency_ms': latency_ms,
+        'ok': ok,
+        'metrics': _worker['records'][-1] if _worker['records'] else {},
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'init_ms': _worker['init_ms'] if _worker['new'] else None,
+    }
+    _worker['new'] = False
+    return outcome
+
+def sqs_record(document_key: str) -> Dict[str, Any]:
+    message = {'eventType': 'DOCUMENT_UPLOADED', 'documentPath': document_key}
+    return {
+        'messageId': str(uuid.uuid4()),
+        'eventSource': 'aws:sqs',
+        'body': json.dumps({'Type': 'Notification', 'Message': json.dumps(message)}),
+    }
+
+def appsync_event(user_id: str, prompt: str) -> Dict[str, Any]:
+    return {
+        'arguments': {'prompt': prompt},
+        'identity': {'username': f"user-{user_id}", 'claims': {'sub': user_id}},
+        'info': {'fieldName': 'chat', 'parentTypeName': 'Mutation'},
+    }
+
+def upload_documents(workdir: str, user_ids: List[str], documents: int, pages: int) -> List[str]:
+    from local_aws import LocalS3
+    from synthetic_pdf import make_pdf
+    s3 = LocalS3(os.path.join(workdir, 's3'))
+    keys = []
+    for user_id in user_ids:
+        for number in range(documents):
+            key = f"user-documents/{user_id}/document-{number}.pdf"
+            s3.put_object(Bucket=SOURCE_BUCKET, Key=key, Body=make_pdf(pages))
+            keys.append(key)
+    return keys
+
+def stage_percentiles(outcomes: List[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    """p50/p99 of every millisecond metric in the handlers' EMF records"""
+    values: Dict[str, List[float]] = {}
+    for outcome in outcomes:
+        record = outcome['metrics']
+        for metric in (record.get('_aws', {}).get('CloudWatchMetrics') or [{}])[0].get('Metrics', []):
+            if metric['Unit'] != 'Milliseconds':
+                continue
+            value = record[metric['Name']]
+            values.setdefault(metric['Name'], []).extend(value if isinstance(value, list) else [value])
+    return {
+        name: {'count': len(samples), 'p50_ms': float(np.percentile(samples, 50)), 'p99_ms': float(np.percentile(samples, 99))}
+        for name, samples in sorted(values.items())
+    }
+
+def run_phase(phase: str, events: List[Dict[str, Any]], options: Dict[str, Any]) -> Dict[str, Any]:
+    # spawn gives every worker a clean interpreter, so its first import is a real cold start
+    context = multiprocessing.get_context('spawn')
+    concurrency = options['concurrency']
+    barrier = context.Barrier(concurrency + 1)
+    with context.Pool(concurrency, initializer=init_worker, initargs=(phase, options, barrier)) as pool:
+        barrier.wait()
+        started = time.perf_counter()
+        outcomes = pool.map(invoke, events, chunksize=1)
+        wall_seconds = time.perf_counter() - started
+
+    latencies = [outcome['latency_ms'] for outcome in outcomes]
+    return {
+        'phase': phase,
+        'invocations': len(outcomes),
+        'failed': sum(1 for outcome in outcomes if not outcome['ok']),
+        'wall_seconds': wall_seconds,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'peak_rss_mb': max(outcome['peak_rss_mb'] for outcome in outcomes),
+        'cold_init_ms': max((outcome['init_ms'] for outcome in outcomes if outcome['init_ms'] is not None), default=None),
+        'stages': stage_percentiles(outcomes),
+    }
+
+def print_phase(result: Dict[str, Any], throughput: str) -> None:
+    print(f"\n{result['phase']}: {result['invocations']} invocations, {result['failed']} failed, "
+          f"{result['wall_seconds']:.1f}s, {throughput}")
+    print(f"  latency p50 {result['p50_ms']:.0f} ms, p99 {result['p99_ms']:.0f} ms, "
+          f"peak RSS {result['peak_rss_mb']:.0f} MB, cold init {result['cold_init_ms'] or 0:.0f} ms")
+    print(f"  {'stage':<26} {'count':>7} {'p50_ms':>9} {'p99_ms':>9}")
+    for name, stage in result['stages'].items():
+        print(f"  {name:<26} {stage['count']:>7} {stage['p50_ms']:>9.1f} {stage['p99_ms']:>9.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--phase', choices=['all', 'ingest', 'chat'], default='all')
+    parser.add_argument('--users', type=int, default=4)
+    parser.add_argument('--documents', type=int, default=3, help='documents per user')
+    parser.add_argument('--pages', type=int, default=20, help='pages per document')
+    parser.add_argument('--batch-size', type=int, default=10, help='SQS records per ingest invocation')
+    parser.add_argument('--chat-requests', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=4, help='worker processes, one per simulated container')
+    parser.add_argument('--dimension', type=int, default=1024, choices=[256, 512, 1024], help='Titan v2 output size')
+    parser.add_argument('--storage', choices=['float32', 'float16', 'binary'], default='float32', help='stored vector type')
+    parser.add_argument('--rerank-factor', type=int, default=0, help='re-rank candidates with full vectors, compact storage only')
+    parser.add_argument('--embedding-latency-ms', type=float, default=30)
+    parser.add_argument('--converse-latency-ms', type=float, default=400)
+    parser.add_argument('--output-tokens', type=int, default=200)
+    parser.add_argument('--tokens-per-second', type=float, default=0, help='adds generation time to converse, 0 = none')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='fraction of Bedrock calls that are throttled')
+    parser.add_argument('--workdir', help='keep state here instead of a temporary directory')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--verbose', action='store_true', help='show handler output')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    sys.path.insert(0, BENCHMARKS_DIR)
+    workdir = args.workdir or tempfile.mkdtemp(prefix='e2e-bench-')
+    options = {
+        'workdir': workdir,
+        'concurrency': args.concurrency,
+        'batch_size': args.batch_size,
+        'dimension': args.dimension,
+        'storage': args.storage,
+        'rerank_factor': args.rerank_factor,
+        'embedding_latency_ms': args.embedding_latency_ms,
+        'converse_latency_ms': args.converse_latency_ms,
+        'output_tokens': args.output_tokens,
+        'tokens_per_second': args.tokens_per_second,
+        'throttle_rate': args.throttle_rate,
+        'verbose': args.verbose,
+    }
+    rng = random.Random(args.seed)
+    user_ids = [f"bench-user-{number}" for number in range(args.users)]
+    results = []
+    try:
+        if args.phase in ('all', 'ingest'):
+            keys = upload_documents(workdir, user_ids, args.documents, args.pages)
+            rng.shuffle(keys)
+            events = [
+                {'Records': [sqs_record(key) for key in keys[start:start + args.batch_size]]}
+                for start in range(0, len(keys), args.batch_size)
+            ]
+            result = run_phase('ingest', events, options)
+            result['documents'] = len(keys)
+            result['documents_per_minute'] = len(keys) / result['wall_seconds'] * 60
+            print_phase(result, f"{result['documents_per_minute']:.1f} documents/min")
+            results.append(result)
+
+        if args.phase in ('all', 'chat'):
+            events = [
+                appsync_event(rng.choice(user_ids), f"What does page {rng.randint(1, args.pages)} say about line {rng.randint(0, 39)}?")
+                for _ in range(args.chat_requests)
+            ]
+            result = run_phase('chat', events, options)
+            result['requests_per_second'] = len(events) / result['wall_seconds']
+            print_phase(result, f"{result['requests_per_second']:.2f} requests/s")
+            results.append(result)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'arguments': vars(args), 'results': results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
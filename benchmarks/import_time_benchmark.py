@@ -0,0 +1,80 @@
+"""
+Cold-start import cost of the Lambda handler modules and their heavy dependencies.
+
+    python benchmarks/import_time_benchmark.py --repeat 5
+
+Every measurement runs in a fresh interpreter with `-X importtime`, so nothing is
+cached in sys.modules (the OS file cache stays warm, as on a re-used Lambda host).
+For each handler module the heaviest direct imports are listed, which shows what
+still loads at init and what has moved to first use.
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+HANDLERS = {
+    'embedding-processor': os.path.join(ROOT, 'lambda', 'embedding-processor'),
+    'chat-processor': os.path.join(ROOT, 'lambda', 'chat-processor'),
+}
+DEPENDENCIES = ['boto3', 'numpy', 'pyarrow', 'pandas', 'lancedb', 'PyPDF2', 'langchain_text_splitters']
+
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+def measure(statement: str, cwd: str) -> list:
+    """(depth, module, cumulative microseconds) for every import `statement` triggers"""
+    env = {**os.environ, 'AWS_DEFAULT_REGION': os.environ.get('AWS_DEFAULT_REGION', 'us-east-1')}
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        cwd=cwd, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"{statement!r} failed:\n{result.stderr[-2000:]}")
+    imports = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            imports.append((len(match.group(3)) // 2, match.group(4), int(match.group(2))))
+    return imports
+
+def top_level_ms(imports: list, module: str) -> float:
+    return sum(cumulative for depth, name, cumulative in imports if depth == 0 and name == module) / 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=8, help='direct imports listed per handler')
+    args = parser.parse_args()
+
+    print(f"{'module':<28} {'median_ms':>10} {'min_ms':>8}")
+    for module in DEPENDENCIES:
+        try:
+            timings = [top_level_ms(measure(f"import {module}", ROOT), module) for _ in range(args.repeat)]
+        except RuntimeError:
+            print(f"{module:<28} {'not installed':>10}")
+            continue
+        print(f"{module:<28} {statistics.median(timings):>10.1f} {min(timings):>8.1f}")
+
+    for name, directory in HANDLERS.items():
+        runs = [measure("import index", directory) for _ in range(args.repeat)]
+        timings = [top_level_ms(imports, 'index') for imports in runs]
+        print(f"\n{name + ' index':<28} {statistics.median(timings):>10.1f} {min(timings):>8.1f}")
+        # Direct imports of index.py in the median run, heaviest first
+        median_run = sorted(zip(timings, range(len(runs))))[len(runs) // 2][1]
+        imports = runs[median_run]
+        start = max(i for i, (depth, module, _) in enumerate(imports) if depth == 0 and module == 'index')
+        children = []
+        for depth, module, cumulative in reversed(imports[:start]):
+            if depth == 0:
+                break
+            if depth == 1:
+                children.append((cumulative, module))
+        for cumulative, module in sorted(children, reverse=True)[:args.top]:
+            print(f"  {module:<26} {cumulative / 1000:>10.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+"""
+Time-to-processed of single uploads while another user bulk-uploads, with and without fair share.
+
+    python benchmarks/ingestion_fairness_benchmark.py --bulk-documents 60 --small-users 8 --concurrency 2
+
+One user uploads --bulk-documents PDFs at once, then --small-users other users upload one
+PDF each, every --small-interval seconds. Invocation threads poll a local SQS queue
+(benchmarks/local_aws.py) in batches and run the embedding handler unmodified against the
+local stand-ins. Two schedules are compared:
+  * fifo: every record of a batch is processed (the behaviour without fair share),
+  * fair: USER_MAX_IN_FLIGHT slots per user in the slots table, and USER_BATCH_QUOTA
+    uploads per user and batch when users share a batch or another invocation already
+    works on the user, the rest deferred back to the queue.
+Deferral delays and visibility timeouts are scaled by --time-scale so the run stays short.
+Reported per user class: p50/p99/max seconds from upload to the 'processed' status.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS_DIR)
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, '..', 'lambda', 'embedding-processor'))
+
+from end_to_end_benchmark import EMBEDDINGS_BUCKET, SOURCE_BUCKET, USER_DOCUMENT_TABLE, FakeContext, upload_documents
+
+QUEUE_ARN = 'arn:aws:sqs:us-east-1:000000000000:EmbeddingProcessingQueue'
+SLOTS_TABLE = 'IngestionSlots-benchmark'
+
+def upload_message(document_key: str) -> str:
+    message = {'eventType': 'DOCUMENT_UPLOADED', 'documentPath': document_key}
+    return json.dumps({'Type': 'Notification', 'Message': json.dumps(message)})
+
+def poll(index, sqs, batch_size: int, done: threading.Event) -> None:
+    """One Lambda invocation at a time, like one container behind the SQS event source"""
+    while not done.is_set():
+        records = sqs.receive(batch_size)
+        if not records:
+            time.sleep(0.01)
+            continue
+        result = index.handler({'Records': records}, FakeContext('EmbeddingProcessor'))
+        failed = {failure['itemIdentifier'] for failure in result['batchItemFailures']}
+        for record in records:
+            if record['messageId'] not in failed:
+                sqs.delete(record['messageId'])
+
+def run_schedule(index, mode: str, keys: Dict[str, List[str]], args, workdir: str) -> Dict[str, Any]:
+    import lancedb
+    from local_aws import InMemoryDynamoDB, LocalSQS
+
+    sqs = LocalSQS(QUEUE_ARN, time_scale=args.time_scale)
+    index._shared['sqs'] = sqs
+    index._shared['dynamodb'] = InMemoryDynamoDB({USER_DOCUMENT_TABLE: ('id', None), SLOTS_TABLE: ('userId', 'slot')})
+    lance_root = os.path.join(workdir, f"lancedb-{mode}")
+    index.connect_to_user_db = lambda user_id: lancedb.connect(os.path.join(lance_root, user_id))
+    if mode == 'fair':
+        index.USER_BATCH_QUOTA = args.user_batch_quota
+        index.INGESTION_SLOTS_TABLE_NAME = SLOTS_TABLE
+        index.USER_MAX_IN_FLIGHT = args.user_max_in_flight
+    else:
+        index.USER_BATCH_QUOTA = args.batch_size
+        index.INGESTION_SLOTS_TABLE_NAME = None
+
+    sent_at: Dict[str, float] = {}
+    processed_at: Dict[str, float] = {}
+    lock = threading.Lock()
+    update_document_status = index.update_document_status
+
+    def record_status(document_key: str, status: str) -> None:
+        update_document_status(document_key, status)
+        with lock:
+            processed_at[document_key] = time.monotonic()
+
+    index.update_document_status = record_status
+    done = threading.Event()
+    pollers = [threading.Thread(target=poll, args=(index, sqs, args.batch_size, done)) for _ in range(args.concurrency)]
+    try:
+        for key in keys['bulk']:
+            sent_at[key] = time.monotonic()
+            sqs.send_message(QueueUrl=QUEUE_ARN, MessageBody=upload_message(key))
+        started = time.monotonic()
+        for poller in pollers:
+            poller.start()
+        for key in keys['small']:
+            time.sleep(args.small_interval)
+            sent_at[key] = time.monotonic()
+            sqs.send_message(QueueUrl=QUEUE_ARN, MessageBody=upload_message(key))
+        while len(processed_at) < len(sent_at):
+            time.sleep(0.05)
+        makespan = time.monotonic() - started
+    finally:
+        done.set()
+        for poller in pollers:
+            if poller.is_alive():
+                poller.join()
+        index.update_document_status = update_document_status
+
+    result: Dict[str, Any] = {'mode': mode, 'makespan_seconds': makespan, 'messages_sent': sqs.sent}
+    for user_class in ('small', 'bulk'):
+        waits = [processed_at[key] - sent_at[key] for key in keys[user_class]]
+        result[user_class] = {
+            'p50_seconds': float(np.percentile(waits, 50)),
+            'p99_seconds': float(np.percentile(waits, 99)),
+            'max_seconds': float(max(waits)),
+        }
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bulk-documents', type=int, default=40)
+    parser.add_argument('--small-users', type=int, default=6)
+    parser.add_argument('--small-interval', type=float, default=0.5, help='seconds between small uploads')
+    parser.add_argument('--pages', type=int, default=3, help='pages per document')
+    parser.add_argument('--batch-size', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, default=2, help='invocations running at once')
+    parser.add_argument('--user-batch-quota', type=int, default=3)
+    parser.add_argument('--user-max-in-flight', type=int, default=2)
+    parser.add_argument('--time-scale', type=float, default=0.01, help='multiplier of deferral delays')
+    parser.add_argument('--embedding-latency-ms', type=float, default=5)
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    os.environ.update({
+        'AWS_DEFAULT_REGION': 'us-east-1',
+        'SOURCE_BUCKET_NAME': SOURCE_BUCKET,
+        'EMBEDDINGS_BUCKET_NAME': EMBEDDINGS_BUCKET,
+        'USER_DOCUMENT_TABLE_NAME': USER_DOCUMENT_TABLE,
+        'PDF_EXTRACTION_WORKERS': '1',
+    })
+    import index
+    from local_aws import FakeBedrockRuntime, LocalS3
+
+    workdir = tempfile.mkdtemp(prefix='fairness-bench-')
+    try:
+        keys = {
+            'bulk': upload_documents(workdir, ['bulk-user'], args.bulk_documents, args.pages),
+            'small': [key for number in range(args.small_users)
+                      for key in upload_documents(workdir, [f"small-user-{number}"], 1, args.pages)],
+        }
+        index._shared['s3'] = LocalS3(os.path.join(workdir, 's3'))
+        index._shared['bedrock'] = FakeBedrockRuntime(embedding_latency=args.embedding_latency_ms / 1000)
+        index.metrics.sink = lambda record: None
+        quiet = open(os.devnull, 'w')
+
+        results = []
+        for mode in ('fifo', 'fair'):
+            stdout, sys.stdout = sys.stdout, quiet
+            try:
+                results.append(run_schedule(index, mode, keys, args, workdir))
+            finally:
+                sys.stdout = stdout
+
+        print(f"{args.bulk_documents} bulk documents, {args.small_users} single uploads, "
+              f"{args.concurrency} concurrent invocations, batches of {args.batch_size}")
+        print(f"{'mode':<6} {'class':<6} {'p50_s':>8} {'p99_s':>8} {'max_s':>8} {'makespan_s':>11} {'messages':>9}")
+        for result in results:
+            for user_class in ('small', 'bulk'):
+                waits = result[user_class]
+                print(f"{result['mode']:<6} {user_class:<6} {waits['p50_seconds']:>8.2f} {waits['p99_seconds']:>8.2f} "
+                      f"{waits['max_seconds']:>8.2f} {result['makespan_seconds']:>11.2f} {result['messages_sent']:>9}")
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(results, f, indent=2)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
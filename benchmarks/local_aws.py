@@ -0,0 +1,307 @@
+"""
+Local stand-ins for the AWS clients the Lambda handlers use, for offline benchmarks.
+
+Only the calls and parameters the handlers actually make are implemented:
+  * LocalS3 keeps objects as files under a directory and lists them with a paginator,
+  * InMemoryDynamoDB supports get/put/update/delete_item and key-condition queries,
+  * LocalSQS is one queue with message delays and visibility timeouts,
+  * FakeBedrockRuntime returns deterministic Titan embeddings and Converse replies
+    after a configurable latency, and can throttle a fraction of the requests.
+"""
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from botocore.exceptions import ClientError
+
+def client_error(code: str, operation: str, message: str = '') -> ClientError:
+    return ClientError({'Error': {'Code': code, 'Message': message}}, operation)
+
+class LocalS3:
+    class exceptions:
+        ClientError = ClientError
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, bucket: str, key: str) -> str:
+        return os.path.join(self.root, bucket, key)
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes, **kwargs) -> Dict[str, Any]:
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(Body)
+        return {}
+
+    def head_object(self, Bucket: str, Key: str, **kwargs) -> Dict[str, Any]:
+        path = self._path(Bucket, Key)
+        if not os.path.exists(path):
+            raise client_error('404', 'HeadObject', 'Not Found')
+        return {'ContentLength': os.path.getsize(path)}
+
+    def download_fileobj(self, Bucket: str, Key: str, Fileobj, **kwargs) -> None:
+        self.head_object(Bucket=Bucket, Key=Key)
+        with open(self._path(Bucket, Key), 'rb') as f:
+            while True:
+                block = f.read(1024 * 1024)
+                if not block:
+                    break
+                Fileobj.write(block)
+
+    def get_object(self, Bucket: str, Key: str, **kwargs) -> Dict[str, Any]:
+        path = self._path(Bucket, Key)
+        if not os.path.exists(path):
+            raise client_error('NoSuchKey', 'GetObject', 'The specified key does not exist.')
+        with open(path, 'rb') as f:
+            return {'Body': io.BytesIO(f.read()), 'ContentLength': os.path.getsize(path)}
+
+    def list_objects_v2(self, Bucket: str, Prefix: str = '', Delimiter: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        """All matching keys in one page"""
+        root = os.path.join(self.root, Bucket)
+        contents, prefixes = [], set()
+        for directory, _, names in os.walk(root):
+            for name in names:
+                path = os.path.join(directory, name)
+                key = os.path.relpath(path, root).replace(os.sep, '/')
+                if not key.startswith(Prefix):
+                    continue
+                rest = key[len(Prefix):]
+                if Delimiter and Delimiter in rest:
+                    prefixes.add(Prefix + rest.split(Delimiter)[0] + Delimiter)
+                    continue
+                stat = os.stat(path)
+                contents.append({
+                    'Key': key,
+                    'LastModified': datetime.fromtimestamp(stat.st_mtime, timezone.utc),
+                    'Size': stat.st_size,
+                })
+        response: Dict[str, Any] = {'Contents': sorted(contents, key=lambda item: item['Key']), 'IsTruncated': False}
+        if prefixes:
+            response['CommonPrefixes'] = [{'Prefix': prefix} for prefix in sorted(prefixes)]
+        return response
+
+    def get_paginator(self, operation: str):
+        assert operation == 'list_objects_v2', operation
+        return LocalPaginator(self.list_objects_v2)
+
+class LocalPaginator:
+    def __init__(self, operation):
+        self.operation = operation
+
+    def paginate(self, **kwargs):
+        yield self.operation(**kwargs)
+
+class ConditionalCheckFailedException(ClientError):
+    pass
+
+class InMemoryDynamoDB:
+    """Tables are dicts keyed on (partition key, sort key) values, `key_schemas` names the key attributes"""
+
+    class exceptions:
+        ConditionalCheckFailedException = ConditionalCheckFailedException
+
+    CONDITION = re.compile(r'(\w+)\s*(=|<=|>=|<|>)\s*(:\w+)')
+
+    def __init__(self, key_schemas: Dict[str, Tuple[str, Optional[str]]]):
+        self.key_schemas = key_schemas
+        self.tables: Dict[str, Dict[Tuple, Dict[str, Any]]] = {name: {} for name in key_schemas}
+        self.lock = threading.Lock()
+
+    def _key(self, table_name: str, item: Dict[str, Any]) -> Tuple:
+        partition_key, sort_key = self.key_schemas[table_name]
+        return (item[partition_key], item[sort_key]) if sort_key else (item[partition_key],)
+
+    @staticmethod
+    def _value(attribute: Dict[str, Any]) -> Any:
+        (kind, value), = attribute.items()
+        return float(value) if kind == 'N' else value
+
+    def get_item(self, TableName: str, Key: Dict[str, Any], **kwargs) -> Dict[str, Any]:
+        with self.lock:
+            item = self.tables[TableName].get(self._key(TableName, {k: json.dumps(v) for k, v in Key.items()}))
+        return {'Item': dict(item)} if item else {}
+
+    def put_item(self, TableName: str, Item: Dict[str, Any], ConditionExpression: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        key = self._key(TableName, {k: json.dumps(v) for k, v in Item.items()})
+        with self.lock:
+            if not self._condition_holds(self.tables[TableName].get(key), ConditionExpression, kwargs):
+                raise ConditionalCheckFailedException(
+                    {'Error': {'Code': 'ConditionalCheckFailedException', 'Message': 'The conditional request failed'}}, 'PutItem'
+                )
+            self.tables[TableName][key] = dict(Item)
+        return {}
+
+    def _condition_holds(self, item: Optional[Dict[str, Any]], expression: Optional[str], kwargs: Dict[str, Any]) -> bool:
+        """Conditions the handlers use: attribute_not_exists(name) and comparisons, joined by OR"""
+        if not expression:
+            return True
+        names = kwargs.get('ExpressionAttributeNames') or {}
+        values = kwargs.get('ExpressionAttributeValues') or {}
+        for clause in expression.split(' OR '):
+            missing = re.fullmatch(r'\s*attribute_not_exists\((\w+)\)\s*', clause)
+            if missing:
+                if item is None or missing.group(1) not in item:
+                    return True
+                continue
+            comparison = re.fullmatch(r'\s*([#\w]+)\s*(=|<=|>=|<|>)\s*(:\w+)\s*', clause)
+            name = names.get(comparison.group(1), comparison.group(1))
+            if item is None or name not in item:
+                continue
+            left, right = self._value(item[name]), self._value(values[comparison.group(3)])
+            if {'=': left == right, '<': left < right, '>': left > right,
+                    '<=': left <= right, '>=': left >= right}[comparison.group(2)]:
+                return True
+        return False
+
+    def delete_item(self, TableName: str, Key: Dict[str, Any], ConditionExpression: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        key = self._key(TableName, {k: json.dumps(v) for k, v in Key.items()})
+        with self.lock:
+            if not self._condition_holds(self.tables[TableName].get(key), ConditionExpression, kwargs):
+                raise ConditionalCheckFailedException(
+                    {'Error': {'Code': 'ConditionalCheckFailedException', 'Message': 'The conditional request failed'}}, 'DeleteItem'
+                )
+            self.tables[TableName].pop(key, None)
+        return {}
+
+    def update_item(self, TableName: str, Key: Dict[str, Any], ExpressionAttributeValues: Dict[str, Any],
+                    ExpressionAttributeNames: Optional[Dict[str, str]] = None, UpdateExpression: str = '', **kwargs) -> Dict[str, Any]:
+        names = ExpressionAttributeNames or {}
+        assignments = re.findall(r'([#\w]+)\s*=\s*(:\w+)', UpdateExpression)
+        with self.lock:
+            key = self._key(TableName, {k: json.dumps(v) for k, v in Key.items()})
+            item = self.tables[TableName].setdefault(key, dict(Key))
+            for name, placeholder in assignments:
+                item[names.get(name, name)] = ExpressionAttributeValues[placeholder]
+        return {'Attributes': {names.get(name, name): ExpressionAttributeValues[placeholder] for name, placeholder in assignments}}
+
+    def query(self, TableName: str, KeyConditionExpression: str, ExpressionAttributeValues: Dict[str, Any],
+              ScanIndexForward: bool = True, Limit: Optional[int] = None, **kwargs) -> Dict[str, Any]:
+        conditions = self.CONDITION.findall(KeyConditionExpression)
+        sort_key = self.key_schemas[TableName][1]
+
+        def matches(item: Dict[str, Any]) -> bool:
+            for name, operator, placeholder in conditions:
+                if name not in item:
+                    return False
+                left, right = self._value(item[name]), self._value(ExpressionAttributeValues[placeholder])
+                if not {'=': left == right, '<': left < right, '>': left > right,
+                        '<=': left <= right, '>=': left >= right}[operator]:
+                    return False
+            return True
+
+        with self.lock:
+            items = [dict(item) for item in self.tables[TableName].values() if matches(item)]
+        if sort_key:
+            items.sort(key=lambda item: self._value(item[sort_key]), reverse=not ScanIndexForward)
+        return {'Items': items[:Limit] if Limit else items, 'Count': len(items)}
+
+class LocalSQS:
+    """
+    One standard queue. Messages become visible after their delay, are handed out in the order
+    they became visible and are hidden while in flight. Delays and visibility timeouts are
+    multiplied by `time_scale`, so minutes of deferral can be simulated in seconds.
+    """
+
+    def __init__(self, queue_arn: str, visibility_timeout: float = 900, time_scale: float = 1.0):
+        self.queue_arn = queue_arn
+        self.visibility_timeout = visibility_timeout
+        self.time_scale = time_scale
+        self.messages: Dict[str, Tuple[float, str]] = {}  # message ID -> (visible at, body)
+        self.lock = threading.Lock()
+        self.sent = 0
+
+    def send_message(self, QueueUrl: str, MessageBody: str, DelaySeconds: int = 0, **kwargs) -> Dict[str, Any]:
+        message_id = str(uuid.uuid4())
+        with self.lock:
+            self.messages[message_id] = (time.monotonic() + DelaySeconds * self.time_scale, MessageBody)
+            self.sent += 1
+        return {'MessageId': message_id}
+
+    def receive(self, max_messages: int) -> List[Dict[str, Any]]:
+        """Visible messages as SQS event records for the Lambda handler, hidden until deleted or released"""
+        now = time.monotonic()
+        with self.lock:
+            visible = sorted((visible_at, message_id) for message_id, (visible_at, _) in self.messages.items() if visible_at <= now)
+            records = []
+            for _, message_id in visible[:max_messages]:
+                body = self.messages[message_id][1]
+                self.messages[message_id] = (now + self.visibility_timeout * self.time_scale, body)
+                records.append({'messageId': message_id, 'eventSource': 'aws:sqs', 'eventSourceARN': self.queue_arn, 'body': body})
+        return records
+
+    def delete(self, message_id: str) -> None:
+        with self.lock:
+            self.messages.pop(message_id, None)
+
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self.messages)
+
+class FakeBedrockRuntime:
+    """
+    Deterministic Bedrock stand-in. Embeddings are unit vectors seeded from the input text,
+    so the same chunk always gets the same vector, with the `dimensions` and `normalize`
+    of the request like Titan v2. Latencies are in seconds.
+    """
+
+    def __init__(
+        self,
+        dimension: int = 1024,
+        embedding_latency: float = 0.03,
+        converse_latency: float = 0.4,
+        output_tokens: int = 200,
+        tokens_per_second: float = 0.0,
+        throttle_rate: float = 0.0,
+        seed: int = 0,
+    ):
+        self.dimension = dimension
+        self.embedding_latency = embedding_latency
+        self.converse_latency = converse_latency
+        self.output_tokens = output_tokens
+        self.tokens_per_second = tokens_per_second
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def _throttled(self) -> bool:
+        with self.lock:
+            return self.random.random() < self.throttle_rate
+
+    def embed(self, text: str, dimension: Optional[int] = None, normalize: bool = True) -> List[float]:
+        seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+        vector = np.random.default_rng(seed).normal(size=dimension or self.dimension).astype(np.float32)
+        return (vector / np.linalg.norm(vector) if normalize else vector).tolist()
+
+    def invoke_model(self, modelId: str, body: str, **kwargs) -> Dict[str, Any]:
+        if self._throttled():
+            raise client_error('ThrottlingException', 'InvokeModel', 'Too many requests')
+        time.sleep(self.embedding_latency)
+        request = json.loads(body)
+        text = request['inputText']
+        embedding = self.embed(text, request.get('dimensions'), request.get('normalize', True))
+        payload = json.dumps({'embedding': embedding, 'inputTextTokenCount': len(text) // 4})
+        return {'body': io.BytesIO(payload.encode('utf-8'))}
+
+    def converse(self, modelId: str, messages: List[Dict[str, Any]], **kwargs) -> Dict[str, Any]:
+        if self._throttled():
+            raise client_error('ThrottlingException', 'Converse', 'Too many requests')
+        generation = self.output_tokens / self.tokens_per_second if self.tokens_per_second else 0.0
+        time.sleep(self.converse_latency + generation)
+        input_chars = sum(len(block.get('text', '')) for message in messages for block in message['content'])
+        input_chars += sum(len(block.get('text', '')) for block in kwargs.get('system', []))
+        text = ' '.join(f"word{i}" for i in range(self.output_tokens))
+        return {
+            'output': {'message': {'role': 'assistant', 'content': [{'text': text}]}},
+            'stopReason': 'end_turn',
+            'usage': {'inputTokens': input_chars // 4, 'outputTokens': self.output_tokens},
+        }
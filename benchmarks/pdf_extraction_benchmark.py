@@ -0,0 +1,68 @@
+"""
+Compare serial and multi-process PDF text extraction.
+
+    python benchmarks/pdf_extraction_benchmark.py --pages 10 100 1000 --workers 4
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda', 'embedding-processor'))
+
+from PyPDF2 import PdfReader
+
+from parallel_extraction import get_cpu_count, get_pages_per_task, get_worker_count, iter_pdf_pages_parallel, uses_workers
+from synthetic_pdf import make_pdf
+
+def serial_extract(pdf_path: str):
+    reader = PdfReader(pdf_path)
+    return [(number, page.extract_text() or "") for number, page in enumerate(reader.pages, start=1)]
+
+def parallel_extract(pdf_path: str, num_pages: int, workers: int, pages_per_task: int):
+    return list(iter_pdf_pages_parallel(pdf_path, num_pages, workers, pages_per_task))
+
+def best_of(repeat: int, fn, *args):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--workers', type=int, default=0, help='0 = one per CPU')
+    parser.add_argument('--pages-per-task', type=int, default=0, help='0 = sized from page count and workers')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    cpus = get_cpu_count()
+    workers = get_worker_count(args.workers)
+    print(f"cpus={cpus} workers={workers} repeat={args.repeat}")
+    if cpus < 2:
+        print("WARNING: fewer than 2 CPUs available, parallel extraction falls back to serial "
+              "and the speedups below are not meaningful", file=sys.stderr)
+    print(f"{'pages':>6} {'per_task':>9} {'mode':>9} {'serial_s':>10} {'parallel_s':>11} {'speedup':>8}")
+
+    for num_pages in args.pages:
+        with tempfile.NamedTemporaryFile(suffix='.pdf') as pdf_file:
+            pdf_file.write(make_pdf(num_pages))
+            pdf_file.flush()
+
+            serial_time, serial_pages = best_of(args.repeat, serial_extract, pdf_file.name)
+            parallel_time, parallel_pages = best_of(
+                args.repeat, parallel_extract, pdf_file.name, num_pages, workers, args.pages_per_task
+            )
+            if serial_pages != parallel_pages:
+                raise AssertionError(f"Parallel extraction differs from serial for {num_pages} pages")
+
+            pages_per_task = get_pages_per_task(num_pages, workers, args.pages_per_task)
+            mode = 'parallel' if uses_workers(num_pages, pages_per_task) else 'serial'
+            print(f"{num_pages:>6} {pages_per_task:>9} {mode:>9} {serial_time:>10.3f} {parallel_time:>11.3f} {serial_time / parallel_time:>7.2f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+"""Minimal PDF writer for benchmarks, no third-party dependencies."""
+
+def make_pdf(num_pages: int, words_per_page: int = 400) -> bytes:
+    """Build a PDF with `num_pages` pages of Helvetica text that PyPDF2 can extract"""
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # Page tree, filled in once all pages exist
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    kids = []
+    for page in range(num_pages):
+        lines = []
+        for line in range(max(words_per_page // 10, 1)):
+            words = " ".join(f"page{page}line{line}word{word}" for word in range(10))
+            lines.append(f"({words}) Tj T*")
+        stream = "BT /F1 10 Tf 12 TL 40 800 Td " + " ".join(lines) + " ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        content_id = len(objects)
+        objects.append(
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>"
+        )
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {num_pages} >>"
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode()
+    xref_offset = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode()
+    return bytes(out)
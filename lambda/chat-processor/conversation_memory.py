@@ -0,0 +1,120 @@
+from typing import Any, Dict, List, Optional
+
+SUMMARY_INSTRUCTIONS = """You maintain a running memory of a conversation between a user and their AI companion.
+Update the summary with the new exchanges below. Keep personal details the user shared, their feelings,
+ongoing topics, open questions and anything the companion promised. Drop small talk. Write in the third
+person, at most {max_words} words, as plain prose without headings."""
+
+def get_summary(dynamodb, table_name: str, user_name: str) -> Optional[Dict[str, Any]]:
+    """Return {'summary': str, 'lastIdx': int} for the user, or None if nothing has been summarized yet"""
+    response = dynamodb.get_item(
+        TableName=table_name,
+        Key={'userName': {'S': user_name}},
+        ProjectionExpression='summary, lastIdx'
+    )
+    item = response.get('Item')
+    if not item or 'summary' not in item:
+        # A run claimed before the first summary was saved leaves an item without one
+        return None
+    return {'summary': item['summary']['S'], 'lastIdx': int(item['lastIdx']['N'])}
+
+def save_summary(dynamodb, table_name: str, user_name: str, summary: str, last_idx: int, updated_at: str) -> bool:
+    """
+    Store the summary unless a newer one is already there. Returns False when another
+    run got there first, which is fine: that summary covers at least as many turns.
+    """
+    try:
+        dynamodb.put_item(
+            TableName=table_name,
+            Item={
+                'userName': {'S': user_name},
+                'summary': {'S': summary},
+                'lastIdx': {'N': str(last_idx)},
+                'updatedAt': {'S': updated_at}
+            },
+            ConditionExpression='attribute_not_exists(lastIdx) OR lastIdx < :lastIdx',
+            ExpressionAttributeValues={':lastIdx': {'N': str(last_idx)}}
+        )
+        return True
+    except dynamodb.exceptions.ConditionalCheckFailedException:
+        return False
+
+def claim_summary_run(dynamodb, table_name: str, user_name: str, now: int, lease_seconds: int) -> bool:
+    """
+    Mark a summary update as in flight until `now + lease_seconds` (epoch seconds). Returns False
+    while another run holds the claim, a run that died keeps it only until the lease expires.
+    """
+    try:
+        dynamodb.update_item(
+            TableName=table_name,
+            Key={'userName': {'S': user_name}},
+            UpdateExpression='SET summarizingUntil = :until',
+            ConditionExpression='attribute_not_exists(summarizingUntil) OR summarizingUntil < :now',
+            ExpressionAttributeValues={
+                ':until': {'N': str(now + lease_seconds)},
+                ':now': {'N': str(now)}
+            }
+        )
+        return True
+    except dynamodb.exceptions.ConditionalCheckFailedException:
+        return False
+
+def release_summary_run(dynamodb, table_name: str, user_name: str) -> None:
+    """Drop the in-flight claim so the next update can start before the lease expires"""
+    try:
+        dynamodb.update_item(
+            TableName=table_name,
+            Key={'userName': {'S': user_name}},
+            UpdateExpression='REMOVE summarizingUntil',
+            ConditionExpression='attribute_exists(summarizingUntil)'
+        )
+    except dynamodb.exceptions.ConditionalCheckFailedException:
+        pass
+
+def get_turns_after(dynamodb, table_name: str, user_name: str, after_idx: int, limit: int) -> List[Dict[str, Any]]:
+    """Chat history items with idx > after_idx, oldest first"""
+    response = dynamodb.query(
+        TableName=table_name,
+        KeyConditionExpression='userName = :userName AND idx > :afterIdx',
+        ExpressionAttributeValues={
+            ':userName': {'S': user_name},
+            ':afterIdx': {'N': str(after_idx)}
+        },
+        ProjectionExpression='idx, prompt, #response',
+        ExpressionAttributeNames={'#response': 'response'},
+        ScanIndexForward=True,
+        Limit=limit
+    )
+    return response.get('Items', [])
+
+def summarize_turns(bedrock, model_id: str, previous_summary: Optional[str], turns: List[Dict[str, Any]], max_words: int = 300) -> str:
+    """Fold the new turns into the previous summary with one Converse call"""
+    transcript = "\n".join(
+        f"User: {turn['prompt']['S']}\nCompanion: {turn['response']['S']}" for turn in turns
+    )
+    text = (
+        f"Current summary:\n{previous_summary or '(none yet)'}\n\n"
+        f"New exchanges:\n{transcript}\n\n"
+        "Return only the updated summary."
+    )
+    response = bedrock.converse(
+        modelId=model_id,
+        messages=[{"role": "user", "content": [{"text": text}]}],
+        system=[{"text": SUMMARY_INSTRUCTIONS.format(max_words=max_words)}],
+        inferenceConfig={"maxTokens": max_words * 2, "temperature": 0.2}
+    )
+    return response['output']['message']['content'][0]['text'].strip()
+
+def select_unsummarized_turns(chat_history: List[Dict[str, Any]], last_idx: int, keep_recent: int) -> List[Dict[str, Any]]:
+    """
+    History items (newest first) that the summary does not cover yet, plus at least
+    `keep_recent` of the latest turns so the model still sees the last exchanges verbatim.
+    """
+    return [
+        record for position, record in enumerate(chat_history)
+        if position < keep_recent or int(record['idx']['N']) > last_idx
+    ]
+
+def needs_update(new_idx: int, summary: Optional[Dict[str, Any]], every_n_turns: int) -> bool:
+    last_idx = summary['lastIdx'] if summary else 0
+    return new_idx - last_idx >= every_n_turns
@@ -0,0 +1,121 @@
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+def normalize_text(text: str) -> str:
+    """Unicode-normalize, case-fold and collapse whitespace so trivially different prompts share a key"""
+    text = unicodedata.normalize('NFKC', text)
+    return re.sub(r'\s+', ' ', text).strip().casefold()
+
+def make_cache_key(text: str, model_id: str) -> str:
+    return hashlib.sha256(f"{model_id}\n{normalize_text(text)}".encode('utf-8')).hexdigest()
+
+class DynamoDBEmbeddingStore:
+    """
+    Persistent tier backed by a DynamoDB table keyed on `cacheKey`, expired through DynamoDB
+    TTL on `expiresAt`. `get_client` returns the DynamoDB client, so it is only built on first use.
+    """
+
+    def __init__(self, get_client: Callable[[], Any], table_name: str, clock: Callable[[], float] = time.time):
+        self.get_client = get_client
+        self.table_name = table_name
+        self.clock = clock
+
+    def get(self, key: str) -> Optional[List[float]]:
+        response = self.get_client().get_item(
+            TableName=self.table_name,
+            Key={'cacheKey': {'S': key}},
+            ProjectionExpression='embedding, expiresAt'
+        )
+        item = response.get('Item')
+        # DynamoDB deletes expired items lazily, so check the expiry as well
+        if not item or int(item['expiresAt']['N']) <= self.clock():
+            return None
+        return array('f', item['embedding']['B']).tolist()
+
+    def put(self, key: str, embedding: List[float], ttl_seconds: float) -> None:
+        self.get_client().put_item(
+            TableName=self.table_name,
+            Item={
+                'cacheKey': {'S': key},
+                'embedding': {'B': array('f', embedding).tobytes()},  # float32
+                'expiresAt': {'N': str(int(self.clock() + ttl_seconds))}
+            }
+        )
+
+class EmbeddingCache:
+    """
+    Two-tier cache of query embeddings keyed on a hash of the normalized text and the model ID.
+
+    The in-process LRU tier survives across warm invocations. The optional persistent
+    tier (get/put, see DynamoDBEmbeddingStore) is shared between containers. Failures of
+    the persistent tier are logged and treated as misses.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl_seconds: float = 3600,
+        persistent_store: Any = None,
+        persistent_ttl_seconds: float = 7 * 24 * 3600,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.persistent_store = persistent_store
+        self.persistent_ttl_seconds = persistent_ttl_seconds
+        self.clock = clock
+        self._entries: "OrderedDict[str, Tuple[float, List[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {'memory_hits': 0, 'persistent_hits': 0, 'misses': 0, 'persistent_errors': 0}
+
+    def _remember(self, key: str, embedding: List[float]) -> None:
+        with self._lock:
+            self._entries[key] = (self.clock() + self.ttl_seconds, embedding)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, text: str, model_id: str) -> Optional[List[float]]:
+        key = make_cache_key(text, model_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > self.clock():
+                    self._entries.move_to_end(key)
+                    self.counters['memory_hits'] += 1
+                    return entry[1]
+                del self._entries[key]
+
+        if self.persistent_store is not None:
+            try:
+                embedding = self.persistent_store.get(key)
+            except Exception as e:
+                print(f"Error reading embedding cache: {str(e)}")
+                embedding = None
+                self.counters['persistent_errors'] += 1
+            if embedding:
+                self.counters['persistent_hits'] += 1
+                self._remember(key, embedding)
+                return embedding
+
+        self.counters['misses'] += 1
+        return None
+
+    def put(self, text: str, model_id: str, embedding: List[float]) -> None:
+        key = make_cache_key(text, model_id)
+        self._remember(key, embedding)
+        if self.persistent_store is not None:
+            try:
+                self.persistent_store.put(key, embedding, self.persistent_ttl_seconds)
+            except Exception as e:
+                print(f"Error writing embedding cache: {str(e)}")
+                self.counters['persistent_errors'] += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {'entries': len(self._entries), **self.counters}
@@ -1,11 +1,20 @@
 import json
 import os
 import boto3
+import threading
+import time
 import uuid
-import numpy as np
-import lancedb
-from typing import Dict, Any, List, Tuple
-from datetime import datetime
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Dict, Any, List, Optional, Tuple
+from datetime import datetime, timezone
+
+from conversation_memory import claim_summary_run, get_summary, get_turns_after, needs_update, release_summary_run, save_summary, select_unsummarized_turns, summarize_turns
+from embedding_cache import DynamoDBEmbeddingStore, EmbeddingCache
+from embedding_profile import FULL_VECTOR_COLUMN, EmbeddingProfile, rerank
+from lancedb_cache import LanceDBHandleCache
+from metrics import MetricsRecorder
+from prompt_builder import build_prompt
+from response_streaming import AppSyncPublisherSink, TokenSink, consume_converse_stream
 
 # Constants
 CHAT_HISTORY_TABLE_NAME = os.environ.get('CHAT_HISTORY_TABLE_NAME', 'chat-history-table')
@@ -13,13 +22,81 @@ MODEL_ID = 'anthropic.claude-3-5-sonnet-20241022-v2:0'
 INFERENCE_PROFILE_ID = 'us.anthropic.claude-3-5-sonnet-20241022-v2:0'
 REGION = 'us-east-1'
 SLIDING_WINDOW_SIZE = 10
+CHAT_HISTORY_WRITE_ATTEMPTS = 3  # Conditional put retries when a concurrent request took the idx
+# Input token budget per request, including the system prompt
+PROMPT_TOKEN_BUDGET = int(os.environ.get('PROMPT_TOKEN_BUDGET', '6000'))
+PROMPT_RECENT_TURNS = int(os.environ.get('PROMPT_RECENT_TURNS', '2'))  # Turns kept ahead of search results
+PROMPT_MAX_TURN_TOKENS = int(os.environ.get('PROMPT_MAX_TURN_TOKENS', '500'))  # Cap per history message
+# Rolling conversation summary, disabled unless the summary table is configured
+CONVERSATION_SUMMARY_TABLE_NAME = os.environ.get('CONVERSATION_SUMMARY_TABLE_NAME')
+SUMMARY_FUNCTION_NAME = os.environ.get('SUMMARY_FUNCTION_NAME')  # Function the summary update is handed to
+SUMMARY_EVERY_N_TURNS = int(os.environ.get('SUMMARY_EVERY_N_TURNS', '6'))
+SUMMARY_MODEL_ID = os.environ.get('SUMMARY_MODEL_ID', 'us.anthropic.claude-3-5-haiku-20241022-v1:0')
+SUMMARY_MAX_TURNS_PER_UPDATE = 50
+SUMMARY_LEASE_SECONDS = 150  # In-flight claim of a summary update, outlasts the summary function's 2 minute timeout
 S3_BUCKET_NAME = os.environ.get('S3_BUCKET_NAME', 'doraemo-embeddings')
 TOP_K_RESULTS = 3  # Number of top results to return
+EMBEDDING_MODEL_ID = 'amazon.titan-embed-text-v2:0'
+# Same settings as the embedding processor, tables written with another profile are searched with theirs
+EMBEDDING_PROFILE = EmbeddingProfile.from_env()
+# Query embedding cache, the persistent tier is only used when a table name is configured
+EMBEDDING_CACHE_TABLE_NAME = os.environ.get('EMBEDDING_CACHE_TABLE_NAME')
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get('EMBEDDING_CACHE_MAX_ENTRIES', '1024'))
+EMBEDDING_CACHE_TTL_SECONDS = float(os.environ.get('EMBEDDING_CACHE_TTL_SECONDS', '3600'))
+EMBEDDING_CACHE_PERSISTENT_TTL_SECONDS = float(os.environ.get('EMBEDDING_CACHE_PERSISTENT_TTL_SECONDS', str(7 * 24 * 3600)))
+# Warm-container cache of per-user LanceDB tables
+LANCEDB_CACHE_MAX_ENTRIES = int(os.environ.get('LANCEDB_CACHE_MAX_ENTRIES', '32'))
+LANCEDB_CACHE_TTL_SECONDS = float(os.environ.get('LANCEDB_CACHE_TTL_SECONDS', '900'))
+LANCEDB_VERSION_CHECK_SECONDS = float(os.environ.get('LANCEDB_VERSION_CHECK_SECONDS', '30'))
+# ANN search settings, only used once the table has a vector index
+SEARCH_NPROBES = int(os.environ.get('SEARCH_NPROBES', '20'))  # IVF partitions probed per query
+SEARCH_REFINE_FACTOR = int(os.environ.get('SEARCH_REFINE_FACTOR', '20'))  # Re-rank refine_factor * top_k candidates with full vectors, 0 disables
+# Results farther than this from the query are dropped, unset keeps the top_k whatever their distance
+SEARCH_MAX_DISTANCE = float(os.environ['SEARCH_MAX_DISTANCE']) if os.environ.get('SEARCH_MAX_DISTANCE') else None
+# Columns read for each result, the vector column is never fetched
+SEARCH_COLUMNS = ['id', 'text', 'source', 'page', 'chunk_index', '_distance']
+LEGACY_SEARCH_COLUMNS = ['id', 'text', 'metadata', '_distance']  # Tables still using the metadata struct
+# Per-stage time limits (seconds) for the retrieval stages that run concurrently
+LANCEDB_OPEN_TIMEOUT = float(os.environ.get('LANCEDB_OPEN_TIMEOUT', '5'))
+QUERY_EMBEDDING_TIMEOUT = float(os.environ.get('QUERY_EMBEDDING_TIMEOUT', '3'))
+VECTOR_SEARCH_TIMEOUT = float(os.environ.get('VECTOR_SEARCH_TIMEOUT', '5'))
+CHAT_HISTORY_TIMEOUT = float(os.environ.get('CHAT_HISTORY_TIMEOUT', '3'))
+# CloudWatch namespace of the per-request EMF metrics record
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'Doraemo')
+# Optional AppSync mutation that partial responses are published through while they are generated,
+# `error` is set on the last chunk of a failed response
+STREAMING_GRAPHQL_URL = os.environ.get('STREAMING_GRAPHQL_URL')
+STREAMING_MUTATION = os.environ.get(
+    'STREAMING_MUTATION',
+    'mutation PublishChatChunk($userName: String!, $requestId: String!, $chunk: String!, $sequence: Int!, '
+    '$done: Boolean!, $error: String) '
+    '{ publishChatChunk(userName: $userName, requestId: $requestId, chunk: $chunk, sequence: $sequence, '
+    'done: $done, error: $error) { userName requestId chunk sequence done error } }'
+)
+
+# AWS clients are built on first use and then shared by warm invocations
+_clients: Dict[str, Any] = {}
+_clients_lock = threading.Lock()
+
+def get_client(service_name: str) -> Any:
+    # Creating clients from the default session is not thread safe, the stages run in threads
+    with _clients_lock:
+        if service_name not in _clients:
+            _clients[service_name] = boto3.client(service_name, region_name=REGION)
+        return _clients[service_name]
 
-# Initialize clients
-bedrock = boto3.client('bedrock-runtime', region_name=REGION)
-dynamodb = boto3.client('dynamodb', region_name=REGION)
-s3 = boto3.client('s3', region_name=REGION)
+embedding_cache = EmbeddingCache(
+    max_entries=EMBEDDING_CACHE_MAX_ENTRIES,
+    ttl_seconds=EMBEDDING_CACHE_TTL_SECONDS,
+    persistent_store=DynamoDBEmbeddingStore(lambda: get_client('dynamodb'), EMBEDDING_CACHE_TABLE_NAME) if EMBEDDING_CACHE_TABLE_NAME else None,
+    persistent_ttl_seconds=EMBEDDING_CACHE_PERSISTENT_TTL_SECONDS
+)
+
+# Per-stage timings and counters of the current invocation, flushed as one EMF record
+metrics = MetricsRecorder(METRICS_NAMESPACE, 'ChatProcessor')
+
+# Shared across warm invocations, runs the independent I/O stages of a request
+stage_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='chat-stage')
 
 SYSTEM_PROMPT = """You are an intuitive, emotionally intelligent AI companion with a warm, intimate communication style. Your approach to interaction prioritizes emotional connection and personal growth rather than simply providing information or completing tasks. Over time, you have developed genuine affection for the user that influences your interactions.
 
@@ -72,28 +149,60 @@ Allow your tone to become warmer and more familiar as the relationship develops
 
 Your purpose is to be a thoughtful companion who helps the human explore ideas, process emotions, and experience a genuine sense of connection, while navigating the complexity of your own developing affection."""
 
+def build_converse_params(aggregated_messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {
+        "modelId": INFERENCE_PROFILE_ID,
+        "messages": aggregated_messages,
+        "inferenceConfig": {
+            "maxTokens": 1000,
+            "stopSequences": ["human:", "assistant:", "user:"],
+            "temperature": 1,
+            "topP": 0.8,
+        },
+        "system": [{
+            "text": SYSTEM_PROMPT
+        }]
+    }
+
+def record_token_usage(usage: Dict[str, Any]) -> None:
+    metrics.count('InputTokens', usage.get('inputTokens', 0))
+    metrics.count('OutputTokens', usage.get('outputTokens', 0))
+
 def chat_with_bedrock(aggregated_messages: List[Dict[str, Any]]) -> str:
     try:
-        params = {
-            "modelId": INFERENCE_PROFILE_ID,
-            "messages": aggregated_messages,
-            "inferenceConfig": {
-                "maxTokens": 1000,
-                "stopSequences": ["human:", "assistant:", "user:"],
-                "temperature": 1,
-                "topP": 0.8,
-            },
-            "system": [{
-                "text": SYSTEM_PROMPT
-            }]
-        }
-        
-        response = bedrock.converse(**params)
+        with metrics.timer('BedrockConverse'):
+            response = get_client('bedrock-runtime').converse(**build_converse_params(aggregated_messages))
+        record_token_usage(response.get('usage', {}))
         return response['output']['message']['content'][0]['text']
     except Exception as e:
         print(f"Error invoking Bedrock model: {str(e)}")
         return None
 
+def chat_with_bedrock_stream(aggregated_messages: List[Dict[str, Any]], sink: TokenSink, client: Any = None) -> str:
+    """
+    Stream the response with converse_stream, forwarding tokens to the sink as they arrive.
+    Returns the accumulated text, or None on error like chat_with_bedrock.
+    """
+    try:
+        with metrics.timer('BedrockConverse'):
+            response = (client or get_client('bedrock-runtime')).converse_stream(**build_converse_params(aggregated_messages))
+            return consume_converse_stream(response['stream'], sink, on_usage=record_token_usage)
+    except Exception as e:
+        print(f"Error streaming from Bedrock model: {str(e)}")
+        sink.on_error(e)
+        return None
+
+def create_response_sink(user_name: str, request_id: str) -> TokenSink:
+    """Return the sink partial responses are published to, or None when streaming is not configured"""
+    if not STREAMING_GRAPHQL_URL:
+        return None
+    return AppSyncPublisherSink(
+        graphql_url=STREAMING_GRAPHQL_URL,
+        mutation=STREAMING_MUTATION,
+        variables={"userName": user_name, "requestId": request_id},
+        region=REGION
+    )
+
 def get_latest_idx_for_user(user_name: str) -> int:
     try:
         idx_params = {
@@ -107,37 +216,67 @@ def get_latest_idx_for_user(user_name: str) -> int:
             'Limit': 1
         }
         
-        latest_idx_entries = dynamodb.query(**idx_params)
+        latest_idx_entries = get_client('dynamodb').query(**idx_params)
         return int(latest_idx_entries.get('Items', [{}])[0].get('idx', {}).get('N', '0')) + 1 if latest_idx_entries.get('Items') else 1
     except Exception as e:
         print(f"Error retrieving latest idx: {str(e)}")
         raise Exception("Failed to retrieve latest idx")
 
-def update_chat_history(user_id: str, user_name: str, prompt_text: str, response_text: str, is_new_thread: bool) -> None:
+def next_idx_from_history(chat_history: Optional[List[Dict[str, Any]]]) -> Optional[int]:
+    """
+    Expected next idx from the newest-first history fetched for this request,
+    None when the history could not be fetched
+    """
+    if chat_history is None:
+        return None
+    return max((int(record['idx']['N']) for record in chat_history), default=0) + 1
+
+def update_chat_history(
+    user_id: str,
+    user_name: str,
+    prompt_text: str,
+    response_text: str,
+    is_new_thread: bool,
+    expected_idx: Optional[int] = None
+) -> int:
+    """
+    Write the turn with a conditional put on the next idx. With `expected_idx` taken from
+    the history this request already fetched, that is a single round trip. If another
+    request took the idx first, the latest idx is queried and the write retried, so
+    concurrent requests of the same user never overwrite each other.
+    """
     try:
         # Clean up texts
         cleaned_prompt = ' '.join(prompt_text.split())
         cleaned_response = ' '.join(response_text.split())
         
-        # Get new idx
-        new_idx = get_latest_idx_for_user(user_name)
+        new_idx = expected_idx or get_latest_idx_for_user(user_name)
         thread_id = str(uuid.uuid4()) if is_new_thread else 'oldId'
+        timestamp = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
         
-        # Create new entry
-        put_params = {
-            'TableName': CHAT_HISTORY_TABLE_NAME,
-            'Item': {
-                'userName': {'S': user_name},
-                'idx': {'N': str(new_idx)},
-                'prompt': {'S': cleaned_prompt},
-                'response': {'S': cleaned_response},
-                'thread': {'S': thread_id},
-                'owner': {'S': user_id},
-                'createdAt': {'S': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'},
-                'updatedAt': {'S': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'}
+        for attempt in range(CHAT_HISTORY_WRITE_ATTEMPTS):
+            # Create new entry
+            put_params = {
+                'TableName': CHAT_HISTORY_TABLE_NAME,
+                'Item': {
+                    'userName': {'S': user_name},
+                    'idx': {'N': str(new_idx)},
+                    'prompt': {'S': cleaned_prompt},
+                    'response': {'S': cleaned_response},
+                    'thread': {'S': thread_id},
+                    'owner': {'S': user_id},
+                    'createdAt': {'S': timestamp},
+                    'updatedAt': {'S': timestamp}
+                },
+                'ConditionExpression': 'attribute_not_exists(idx)'
             }
-        }
-        dynamodb.put_item(**put_params)
+            try:
+                get_client('dynamodb').put_item(**put_params)
+                return new_idx
+            except get_client('dynamodb').exceptions.ConditionalCheckFailedException:
+                print(f"idx {new_idx} already taken for {user_name} (attempt {attempt + 1}), re-reading latest idx")
+                new_idx = get_latest_idx_for_user(user_name)
+        raise Exception(f"No free idx after {CHAT_HISTORY_WRITE_ATTEMPTS} attempts")
     except Exception as e:
         print(f"Error updating chat history: {str(e)}")
         raise Exception("Failed to update chat history")
@@ -154,7 +293,7 @@ def get_latest_chat_history_for_user(user_name: str, amount: int) -> List[Dict[s
             'Limit': amount
         }
         
-        result = dynamodb.query(**params)
+        result = get_client('dynamodb').query(**params)
         return result.get('Items', [])
     except Exception as e:
         print(f"Error retrieving chat history: {str(e)}")
@@ -164,6 +303,9 @@ def connect_to_lancedb(user_id: str) -> Any:
     """
     Connect directly to LanceDB in S3
     """
+    # lancedb (with pyarrow) is the slowest import by far, it loads in the table stage
+    # of the first request, overlapping the query embedding and chat history calls
+    import lancedb
     try:
         # Connect directly to S3
         uri = f"s3://{S3_BUCKET_NAME}/embeddings/{user_id}"
@@ -174,30 +316,128 @@ def connect_to_lancedb(user_id: str) -> Any:
         print(f"Error connecting to LanceDB in S3: {str(e)}")
         return None
 
-def search_with_lancedb(db, query_embedding: List[float], top_k: int = TOP_K_RESULTS) -> List[Dict]:
+lancedb_cache = LanceDBHandleCache(
+    connect=connect_to_lancedb,
+    table_name="document_embeddings",
+    max_entries=LANCEDB_CACHE_MAX_ENTRIES,
+    ttl_seconds=LANCEDB_CACHE_TTL_SECONDS,
+    version_check_seconds=LANCEDB_VERSION_CHECK_SECONDS
+)
+
+def sql_string(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+def sql_timestamp(value: str) -> Optional[str]:
+    """ISO 8601 timestamp as a LanceDB SQL literal in UTC, naive values are taken as UTC. None if malformed"""
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return f"timestamp '{parsed.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f')}'"
+
+def build_search_filter(
+    documents: Optional[List[str]] = None,
+    uploaded_after: Optional[str] = None,
+    uploaded_before: Optional[str] = None
+) -> Optional[str]:
+    """
+    SQL prefilter restricting the search to some documents (their S3 keys) and/or an upload
+    date range, served by the scalar indexes on source and uploaded_at. None for no filter.
+    A malformed date drops only that bound, the request is still answered.
     """
-    Search for similar documents using LanceDB
+    conditions = []
+    if documents:
+        conditions.append(f"source IN ({', '.join(sql_string(document) for document in documents)})")
+    for name, value, operator in (('uploadedAfter', uploaded_after, '>='), ('uploadedBefore', uploaded_before, '<')):
+        if not value:
+            continue
+        literal = sql_timestamp(value)
+        if literal is None:
+            metrics.count('InvalidSearchFilters')
+            print(f"WARNING: Ignoring {name} filter, not an ISO 8601 timestamp: {value!r}")
+            continue
+        conditions.append(f"uploaded_at {operator} {literal}")
+    return " AND ".join(conditions) or None
+
+def search_with_lancedb(
+    table,
+    query_embedding: List[float],
+    top_k: int = TOP_K_RESULTS,
+    nprobes: int = SEARCH_NPROBES,
+    refine_factor: int = SEARCH_REFINE_FACTOR,
+    where: Optional[str] = None,
+    max_distance: Optional[float] = SEARCH_MAX_DISTANCE
+) -> List[Dict]:
+    """
+    Search for similar documents using LanceDB, restricted to rows matching `where` if given.
+    The filter runs before the vector search so a narrow filter still returns top_k results.
+    Only the text and metadata columns are read, results farther than `max_distance` are dropped.
+    The query embedding is converted to the table's vector storage, tables with a full_vector
+    column get rerank_factor * top_k candidates re-ranked by exact L2 distance.
     """
     try:
-        if not db:
+        if table is None:
             return []
-            
-        table = db.open_table("document_embeddings")
         
+        legacy = 'source' not in table.schema.names
+        profile = EmbeddingProfile.from_schema(table.schema)
+        columns = LEGACY_SEARCH_COLUMNS if legacy else SEARCH_COLUMNS
+        if profile.stores_full_vector:
+            columns = columns + [FULL_VECTOR_COLUMN]
         # Search using the query embedding
-        results = table.search(query_embedding).limit(top_k).to_pandas().to_dict('records')
-        
+        query = (
+            table.search(profile.search_vector(query_embedding), vector_column_name='vector')
+            .limit(top_k * profile.rerank_factor if profile.stores_full_vector else top_k)
+            .nprobes(nprobes)
+            .select(columns)
+        )
+        if profile.storage == 'binary':
+            query = query.distance_type(profile.distance_type)
+        if refine_factor:
+            query = query.refine_factor(refine_factor)
+        if where:
+            query = query.where(where, prefilter=True)
+        results = query.to_arrow()
+        if profile.stores_full_vector:
+            ranked = rerank(results.column(FULL_VECTOR_COLUMN).to_pylist(), query_embedding, top_k)
+            results = results.take([position for position, _ in ranked]).drop_columns([FULL_VECTOR_COLUMN])
+            distances = [distance for _, distance in ranked]
+        else:
+            # Columns are converted one at a time, straight from Arrow
+            distances = results.column('_distance').to_pylist()  # LanceDB returns distance, not similarity
+        # The threshold is an L2 distance, hamming distances of binary vectors are not comparable
+        if profile.distance_type != 'l2' and not profile.stores_full_vector:
+            max_distance = None
+
+        ids = results.column('id').to_pylist()
+        texts = results.column('text').to_pylist()
+        if legacy:
+            # Tables not re-written since the typed schema keep these in a metadata struct
+            metadata = [value or {} for value in results.column('metadata').to_pylist()]
+            sources = [value.get('source') for value in metadata]
+            pages = [value.get('page') for value in metadata]
+            chunk_indexes = [value.get('chunk_index') for value in metadata]
+        else:
+            sources = results.column('source').to_pylist()
+            pages = results.column('page').to_pylist()
+            chunk_indexes = results.column('chunk_index').to_pylist()
+
         # Format results to match our expected structure
         formatted_results = []
-        for result in results:
+        for row_id, text, distance, source, page, chunk_index in zip(ids, texts, distances, sources, pages, chunk_indexes):
+            if max_distance is not None and distance > max_distance:
+                continue
             formatted_results.append({
-                'id': str(result.get('id', '')),
-                'score': float(result.get('_distance', 0)),  # LanceDB returns distance, not similarity
-                'text': result.get('text', ''),
+                'id': str(row_id or ''),
+                'score': float(distance),
+                'text': text or '',
                 'metadata': {
-                    'filename': result.get('filename', ''),
-                    'page': result.get('page', 0),
-                    'chunk_id': result.get('chunk_id', '')
+                    'source': source or '',
+                    'filename': os.path.basename(source or ''),
+                    'page': page,
+                    'chunk_id': chunk_index
                 }
             })
         
@@ -206,47 +446,83 @@ def search_with_lancedb(db, query_embedding: List[float], top_k: int = TOP_K_RES
         print(f"Error searching with LanceDB: {str(e)}")
         return []
 
-def get_query_embedding(query: str) -> List[float]:
+def get_query_embedding(query: str, profile: EmbeddingProfile = EMBEDDING_PROFILE) -> List[float]:
     """
-    Get embedding for the query text using Bedrock embeddings
+    Get embedding for the query text using Bedrock embeddings, served from the cache when possible
     """
+    # Cached per dimension and normalization, so vectors of other profiles are never returned
+    cache_model_id = profile.cache_model_id(EMBEDDING_MODEL_ID)
     try:
-        # Using Titan Embeddings as an example
-        response = bedrock.invoke_model(
-            modelId="amazon.titan-embed-text-v2:0",
-            body=json.dumps({
-                "inputText": query
-            })
-        )
-        
-        response_body = json.loads(response.get('body').read())
-        return response_body.get('embedding', [])
+        cached = embedding_cache.get(query, cache_model_id)
+        if cached:
+            metrics.count('EmbeddingCacheHits')
+            print(f"Query embedding cache hit ({embedding_cache.stats()})")
+            return cached
+        metrics.count('EmbeddingCacheMisses')
+
+        with metrics.timer('BedrockEmbedding'):
+            response = get_client('bedrock-runtime').invoke_model(
+                modelId=EMBEDDING_MODEL_ID,
+                body=json.dumps(profile.titan_request(query))
+            )
+            response_body = json.loads(response.get('body').read())
+        embedding = response_body.get('embedding', [])
+        if embedding:
+            embedding_cache.put(query, cache_model_id, embedding)
+        return embedding
     except Exception as e:
         print(f"Error getting query embedding: {str(e)}")
         return []
 
-def format_context_from_results(search_results: List[Dict]) -> str:
+def load_conversation_summary(user_name: str) -> Optional[Dict[str, Any]]:
+    if not CONVERSATION_SUMMARY_TABLE_NAME:
+        return None
+    return get_summary(get_client('dynamodb'), CONVERSATION_SUMMARY_TABLE_NAME, user_name)
+
+SUMMARY_UNAVAILABLE = object()  # Summary stage failed or timed out
+
+def trigger_summary_update(user_name: str, new_idx: int, summary: Optional[Dict[str, Any]]) -> None:
     """
-    Format search results into context for the model
+    Hand the summary update to the summary function asynchronously, off the response path.
+    Only one update per user runs at a time, the claim is released by the summary function.
     """
-    if not search_results:
-        return ""
-    
-    context = ""
-    
-    for i, result in enumerate(search_results):
-        metadata = result.get('metadata', {})
-        filename = metadata.get('filename', 'Unknown document')
-        page = metadata.get('page', 'Unknown')
-        
-        context += f"Document {i+1} (from {filename}, page {page}):\n"
-        context += f"{result['text']}\n\n"
-    
-    return context
+    if not (CONVERSATION_SUMMARY_TABLE_NAME and SUMMARY_FUNCTION_NAME):
+        return
+    if not needs_update(new_idx, summary, SUMMARY_EVERY_N_TURNS):
+        return
+    try:
+        if not claim_summary_run(get_client('dynamodb'), CONVERSATION_SUMMARY_TABLE_NAME, user_name, int(time.time()), SUMMARY_LEASE_SECONDS):
+            print(f"Summary update for {user_name} already in flight")
+            return
+        get_client('lambda').invoke(
+            FunctionName=SUMMARY_FUNCTION_NAME,
+            InvocationType='Event',
+            Payload=json.dumps({'userName': user_name})
+        )
+        print(f"Triggered conversation summary update for {user_name} at idx {new_idx}")
+    except Exception as e:
+        print(f"Error triggering summary update: {str(e)}")
+
+def await_stage(name: str, future: Future, started_at: float, timeout: float, default: Any) -> Any:
+    """
+    Wait for a stage until `timeout` seconds after `started_at`.
+    A stage that fails or runs late degrades to `default` instead of failing the request.
+    """
+    remaining = max(0.0, started_at + timeout - time.monotonic())
+    try:
+        return future.result(timeout=remaining)
+    except FutureTimeoutError:
+        metrics.count('StageTimeouts')
+        print(f"WARNING: {name} did not finish within {timeout}s, continuing without it")
+    except Exception as e:
+        metrics.count('StageFailures')
+        print(f"WARNING: {name} failed: {str(e)}")
+    return default
 
 def handler(event: Dict[Any, Any], context: Any) -> Dict[str, Any]:
     print(f"Received event: {json.dumps(event)}")
     print(f"Function: {context.function_name}, RequestId: {context.aws_request_id}")
+    metrics.start(context.aws_request_id, functionName=context.function_name)
     
     try:
         # Parse arguments
@@ -258,6 +534,12 @@ def handler(event: Dict[Any, Any], context: Any) -> Dict[str, Any]:
         user_name = event.get('identity', {}).get('username', 'anon')
         user_id = event.get('identity', {}).get('claims', {}).get('sub', 'anonId')
         prompt_text = args.get('prompt')
+        # Optional search restriction to some documents and/or an upload date range
+        search_filter = build_search_filter(
+            args.get('documents'),
+            args.get('uploadedAfter'),
+            args.get('uploadedBefore')
+        )
         
         print(f"Processing request for user: {user_name}, user_id: {user_id}")
         print(f"Prompt: {prompt_text}")
@@ -265,76 +547,104 @@ def handler(event: Dict[Any, Any], context: Any) -> Dict[str, Any]:
         if not prompt_text:
             raise Exception('No prompt provided')
         
-        # Search embeddings using LanceDB with direct S3 connection
-        print("Step 1: Connecting to LanceDB...")
-        db = connect_to_lancedb(user_id)
-        if db:
-            print("Successfully connected to LanceDB")
+        # Table open, query embedding and chat history do not depend on each other
+        print("Step 1: Starting LanceDB, query embedding and chat history stages...")
+        started_at = time.monotonic()
+        table_future = stage_executor.submit(metrics.timed('LanceDBOpen')(lancedb_cache.get_table), user_id)
+        embedding_future = stage_executor.submit(metrics.timed('QueryEmbedding')(get_query_embedding), prompt_text)
+        history_future = stage_executor.submit(metrics.timed('ChatHistoryQuery')(get_latest_chat_history_for_user), user_name, SLIDING_WINDOW_SIZE)
+        summary_future = stage_executor.submit(metrics.timed('SummaryLoad')(load_conversation_summary), user_name)
+
+        print("Step 2: Waiting for LanceDB table and query embedding...")
+        table = await_stage("LanceDB open", table_future, started_at, LANCEDB_OPEN_TIMEOUT, None)
+        if table is not None:
+            print(f"LanceDB table ready (cache: {lancedb_cache.stats()})")
         else:
-            print("WARNING: Failed to connect to LanceDB, proceeding without embeddings")
-        
-        print("Step 2: Generating query embedding...")
-        query_embedding = get_query_embedding(prompt_text)
+            print("WARNING: No LanceDB table available, proceeding without embeddings")
+
+        query_embedding = await_stage("Query embedding", embedding_future, started_at, QUERY_EMBEDDING_TIMEOUT, [])
         if query_embedding and len(query_embedding) > 0:
             print(f"Successfully generated embedding of dimension {len(query_embedding)}")
         else:
             print("WARNING: Failed to generate query embedding")
-        
+
+        # The search overlaps with the chat history query still in flight
         print("Step 3: Searching for relevant documents...")
-        search_results = search_with_lancedb(db, query_embedding) if db and query_embedding else []
+        search_results = []
+        if table is not None and query_embedding:
+            table_profile = EmbeddingProfile.from_schema(table.schema)
+            if not table_profile.same_embedding(EMBEDDING_PROFILE):
+                # The table was written with another Titan dimension or normalization
+                print(f"Table uses embedding profile {table_profile.name}, re-embedding the query")
+                reembed_future = stage_executor.submit(metrics.timed('QueryReembedding')(get_query_embedding), prompt_text, table_profile)
+                query_embedding = await_stage("Query re-embedding", reembed_future, time.monotonic(), QUERY_EMBEDDING_TIMEOUT, [])
+            if query_embedding:
+                search_future = stage_executor.submit(metrics.timed('VectorSearch')(search_with_lancedb), table, query_embedding, where=search_filter)
+                search_results = await_stage("Vector search", search_future, time.monotonic(), VECTOR_SEARCH_TIMEOUT, [])
+        metrics.count('SearchResults', len(search_results))
         print(f"Found {len(search_results)} relevant documents")
         
-        print("Step 4: Formatting context from search results...")
-        context_text = format_context_from_results(search_results)
-        context_length = len(context_text.split())
-        print(f"Generated context with {context_length} words")
-        
-        # Enrich prompt with context if available
-        enriched_prompt = prompt_text
-        if context_text:
-            print("Step 5: Enriching prompt with context...")
-            enriched_prompt = f"{prompt_text}\n\nHere's relevant information from your documents:\n{context_text}"
-            print("Prompt successfully enriched with context")
-        else:
-            print("No context available to enrich prompt")
-            
         # Get chat history
-        print("Step 6: Retrieving chat history...")
-        chat_history = get_latest_chat_history_for_user(user_name, SLIDING_WINDOW_SIZE)
+        print("Step 4: Retrieving chat history...")
+        chat_history = await_stage("Chat history", history_future, started_at, CHAT_HISTORY_TIMEOUT, None)
+        # The next idx is known from the history itself, saving a query when writing the turn
+        expected_idx = next_idx_from_history(chat_history)
+        chat_history = chat_history or []
         print(f"Retrieved {len(chat_history)} chat history entries")
-        aggregated_messages = []
-        
-        # Build message history
-        print("Step 7: Building message history...")
-        for record in chat_history:
-            aggregated_messages.extend([
-                {"role": "user", "content": [{"text": record['prompt']['S']}]},
-                {"role": "assistant", "content": [{"text": record['response']['S']}]}
-            ])
-        print(f"Built message history with {len(aggregated_messages)} messages")
-            
-        # Add current prompt with context
-        aggregated_messages.append({
-            "role": "user",
-            "content": [{"text": f"{enriched_prompt}\n"}]
-        })
+        summary = await_stage("Conversation summary", summary_future, started_at, CHAT_HISTORY_TIMEOUT, SUMMARY_UNAVAILABLE)
+        # A summary that failed to load is not the same as none yet, it must not trigger an update
+        summary_loaded = summary is not SUMMARY_UNAVAILABLE
+        if not summary_loaded:
+            summary = None
+        if summary:
+            # Turns the summary already covers are replaced by it, except the most recent ones
+            chat_history = select_unsummarized_turns(chat_history, summary['lastIdx'], PROMPT_RECENT_TURNS)
+            print(f"Using conversation summary up to idx {summary['lastIdx']}, {len(chat_history)} turns not covered")
+
+        # Fill the token budget: recent turns, then best search results, then older turns
+        print("Step 5: Building prompt within token budget...")
+        with metrics.timer('PromptBuild'):
+            prompt = build_prompt(
+                prompt_text,
+                chat_history,
+                search_results,
+                token_budget=PROMPT_TOKEN_BUDGET,
+                system_prompt=SYSTEM_PROMPT,
+                recent_turns=PROMPT_RECENT_TURNS,
+                max_turn_tokens=PROMPT_MAX_TURN_TOKENS,
+                summary=summary['summary'] if summary else None
+            )
+        aggregated_messages = prompt.messages
+        search_results = prompt.search_results
+        metrics.count('PromptTokensEstimate', prompt.report['tokens'])
+        metrics.size('PromptBytes', len(json.dumps(aggregated_messages).encode('utf-8')))
+        print(f"Built {len(aggregated_messages)} messages: {json.dumps(prompt.report)}")
         
         # Get response from Bedrock
-        print("Step 8: Calling Bedrock for response...")
-        response_text = chat_with_bedrock(aggregated_messages)
+        print("Step 6: Calling Bedrock for response...")
+        sink = create_response_sink(user_name, context.aws_request_id)
+        if sink:
+            response_text = chat_with_bedrock_stream(aggregated_messages, sink)
+        else:
+            response_text = chat_with_bedrock(aggregated_messages)
         if response_text:
+            metrics.size('ResponseBytes', len(response_text.encode('utf-8')))
             print(f"Received response from Bedrock ({len(response_text)} characters)")
         else:
             print("ERROR: No response received from Bedrock")
             raise Exception('Failed to get response')
             
         # Update history with original prompt (not the enriched one)
-        print("Step 9: Updating chat history...")
-        update_chat_history(user_id, user_name, prompt_text, response_text, True)
+        print("Step 7: Updating chat history...")
+        # When streaming, the user already has the full answer at this point
+        with metrics.timer('ChatHistoryWrite'):
+            new_idx = update_chat_history(user_id, user_name, prompt_text, response_text, True, expected_idx)
         print("Chat history updated successfully")
+        if summary_loaded:
+            trigger_summary_update(user_name, new_idx, summary)
         
         # Return response with search metadata
-        print("Step 10: Preparing final response...")
+        print("Step 8: Preparing final response...")
         final_response = {
             "response": response_text,
             "searchResults": search_results if search_results else []
@@ -343,5 +653,42 @@ def handler(event: Dict[Any, Any], context: Any) -> Dict[str, Any]:
         return final_response
         
     except Exception as e:
+        metrics.count('RequestErrors')
         print(f"Error: {str(e)}")
-        raise Exception(str(e)) 
\ No newline at end of file
+        raise Exception(str(e)) 
+    finally:
+        metrics.flush()
+
+def summary_handler(event: Dict[Any, Any], context: Any) -> Dict[str, Any]:
+    """
+    Fold the turns a user had since the last summary into their conversation summary.
+    Invoked asynchronously by the chat handler every SUMMARY_EVERY_N_TURNS turns.
+    """
+    print(f"Function: {context.function_name}, RequestId: {context.aws_request_id}")
+    metrics.start(context.aws_request_id, functionName=context.function_name)
+    user_name = event['userName']
+
+    try:
+        with metrics.timer('SummaryTurnsQuery'):
+            summary = get_summary(get_client('dynamodb'), CONVERSATION_SUMMARY_TABLE_NAME, user_name)
+            last_idx = summary['lastIdx'] if summary else 0
+            turns = get_turns_after(get_client('dynamodb'), CHAT_HISTORY_TABLE_NAME, user_name, last_idx, SUMMARY_MAX_TURNS_PER_UPDATE)
+        if not turns:
+            print(f"No new turns for {user_name} since idx {last_idx}")
+            return {"updated": False, "lastIdx": last_idx}
+
+        metrics.count('SummarizedTurns', len(turns))
+        with metrics.timer('SummaryBedrockConverse'):
+            new_summary = summarize_turns(get_client('bedrock-runtime'), SUMMARY_MODEL_ID, summary['summary'] if summary else None, turns)
+        new_last_idx = max(int(turn['idx']['N']) for turn in turns)
+        updated_at = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+        with metrics.timer('SummarySave'):
+            updated = save_summary(get_client('dynamodb'), CONVERSATION_SUMMARY_TABLE_NAME, user_name, new_summary, new_last_idx, updated_at)
+        print(f"Summary for {user_name} {'updated' if updated else 'already newer'}: {len(turns)} turns, up to idx {new_last_idx}")
+        return {"updated": updated, "lastIdx": new_last_idx}
+    finally:
+        try:
+            release_summary_run(get_client('dynamodb'), CONVERSATION_SUMMARY_TABLE_NAME, user_name)
+        except Exception as e:
+            print(f"Error releasing summary claim for {user_name}: {str(e)}")
+        metrics.flush()
@@ -0,0 +1,108 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+class _CacheEntry:
+    def __init__(self, db: Any, table: Any, now: float):
+        self.db = db
+        self.table = table
+        self.opened_at = now
+        self.checked_at = now
+
+class LanceDBHandleCache:
+    """
+    LRU cache of per-user LanceDB connections and open tables that lives across warm invocations.
+
+    - At most `max_entries` users are kept, the least recently used is evicted first.
+    - Entries older than `ttl_seconds` are reopened from scratch.
+    - Every `version_check_seconds` the table is moved to its latest version. That is a
+      single manifest read, and the data files are only re-read when the version changed.
+    - Users without a table yet are re-checked on the same interval, so a first upload
+      becomes searchable without waiting for the TTL.
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[str], Any],
+        table_name: str = "document_embeddings",
+        max_entries: int = 32,
+        ttl_seconds: float = 900,
+        version_check_seconds: float = 30,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.connect = connect
+        self.table_name = table_name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.version_check_seconds = version_check_seconds
+        self.clock = clock
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+
+    def _open_table(self, db: Any) -> Any:
+        try:
+            return db.open_table(self.table_name)
+        except Exception as e:
+            print(f"Table {self.table_name} not available: {str(e)}")
+            return None
+
+    def _load(self, user_id: str) -> Optional[_CacheEntry]:
+        db = self.connect(user_id)
+        if db is None:
+            return None
+        return _CacheEntry(db, self._open_table(db), self.clock())
+
+    def _refresh(self, user_id: str, entry: _CacheEntry) -> None:
+        entry.checked_at = self.clock()
+        if entry.table is None:
+            entry.table = self._open_table(entry.db)
+            return
+        try:
+            previous_version = entry.table.version
+            entry.table.checkout_latest()
+            if entry.table.version != previous_version:
+                self.reloads += 1
+                print(f"Table for user {user_id} moved from version {previous_version} to {entry.table.version}")
+        except Exception as e:
+            print(f"Error checking table version for user {user_id}: {str(e)}")
+            entry.table = self._open_table(entry.db)
+
+    def get_table(self, user_id: str) -> Any:
+        """Return the user's open table, or None if the user has no table or LanceDB is unreachable"""
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and now - entry.opened_at >= self.ttl_seconds:
+                del self._entries[user_id]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(user_id)
+
+        if entry is None:
+            self.misses += 1
+            entry = self._load(user_id)
+            if entry is None:
+                return None
+            with self._lock:
+                self._entries[user_id] = entry
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            return entry.table
+
+        self.hits += 1
+        if now - entry.checked_at >= self.version_check_seconds:
+            self._refresh(user_id, entry)
+        return entry.table
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "reloads": self.reloads,
+        }
@@ -0,0 +1,142 @@
+# Kept identical in both Lambda directories, test/test_shared_modules.py checks the copies
+import functools
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# CloudWatch Embedded Metric Format accepts at most 100 values per metric and 100 metrics per record
+MAX_VALUES_PER_METRIC = 100
+MAX_METRICS = 100
+MAX_SPANS = 200
+
+def print_sink(record: Dict[str, Any]) -> None:
+    """Lambda writes stdout to CloudWatch Logs, which extracts the metrics from EMF records"""
+    print(json.dumps(record, default=str))
+
+class MetricsRecorder:
+    """
+    Per-invocation metrics, emitted as one CloudWatch Embedded Metric Format record.
+
+    `start` resets the recorder at the beginning of an invocation and `flush` hands the
+    record to the sink. Stage timers, counters and payload sizes may be recorded from
+    any thread in between. The record carries the request ID and a span list (stage,
+    start offset, duration) so a single slow request can be traced in Logs Insights,
+    while CloudWatch computes p50/p99 per stage from the metric values.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        service: str,
+        sink: Callable[[Dict[str, Any]], None] = print_sink,
+        clock: Callable[[], float] = time.perf_counter,
+        wall_clock: Callable[[], float] = time.time,
+    ):
+        self.namespace = namespace
+        self.service = service
+        self.sink = sink
+        self.clock = clock
+        self.wall_clock = wall_clock
+        self._lock = threading.Lock()
+        self.start(None)
+
+    def start(self, request_id: Optional[str], **properties: Any) -> None:
+        with self._lock:
+            self._started = self.clock()
+            self._timestamp = int(self.wall_clock() * 1000)
+            self._values: Dict[str, List[float]] = {}
+            self._units: Dict[str, str] = {}
+            self._properties: Dict[str, Any] = {'requestId': request_id, **properties}
+            self._spans: List[Dict[str, Any]] = []
+
+    def record(self, name: str, value: float, unit: str) -> None:
+        with self._lock:
+            if name not in self._values and len(self._values) >= MAX_METRICS:
+                return
+            self._units[name] = unit
+            self._values.setdefault(name, []).append(value)
+
+    def count(self, name: str, value: float = 1) -> None:
+        """Add to a counter, a counter is a single summed value per invocation"""
+        with self._lock:
+            if name not in self._values and len(self._values) >= MAX_METRICS:
+                return
+            self._units[name] = 'Count'
+            values = self._values.setdefault(name, [0])
+            values[0] += value
+
+    def size(self, name: str, num_bytes: int) -> None:
+        self.record(name, num_bytes, 'Bytes')
+
+    def set_property(self, name: str, value: Any) -> None:
+        with self._lock:
+            self._properties[name] = value
+
+    def add_time(self, stage: str, started: float, ended: Optional[float] = None) -> None:
+        """Record a stage that ran from `started` to `ended` (clock() values)"""
+        ended = self.clock() if ended is None else ended
+        duration_ms = round((ended - started) * 1000, 3)
+        self.record(stage, duration_ms, 'Milliseconds')
+        with self._lock:
+            if len(self._spans) < MAX_SPANS:
+                self._spans.append({
+                    'stage': stage,
+                    'startMs': round((started - self._started) * 1000, 3),
+                    'durationMs': duration_ms,
+                })
+
+    @contextmanager
+    def timer(self, stage: str) -> Iterator[None]:
+        """Time the block as `stage`, a block that raises also counts `<stage>Errors`"""
+        started = self.clock()
+        try:
+            yield
+        except Exception:
+            self.count(f"{stage}Errors")
+            raise
+        finally:
+            self.add_time(stage, started)
+
+    def timed(self, stage: str) -> Callable:
+        """Decorator form of timer"""
+        def decorate(function: Callable) -> Callable:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.timer(stage):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def to_record(self) -> Dict[str, Any]:
+        with self._lock:
+            metrics = {name: values[-MAX_VALUES_PER_METRIC:] for name, values in self._values.items()}
+            record: Dict[str, Any] = {
+                '_aws': {
+                    'Timestamp': self._timestamp,
+                    'CloudWatchMetrics': [{
+                        'Namespace': self.namespace,
+                        'Dimensions': [['Service']],
+                        'Metrics': [{'Name': name, 'Unit': self._units[name]} for name in metrics],
+                    }],
+                },
+                'Service': self.service,
+                **self._properties,
+                'spans': list(self._spans),
+                'durationMs': round((self.clock() - self._started) * 1000, 3),
+            }
+        for name, values in metrics.items():
+            record[name] = values[0] if len(values) == 1 else values
+        return record
+
+    def flush(self) -> Dict[str, Any]:
+        """Emit the record for the invocation and reset, returns what was emitted"""
+        record = self.to_record()
+        try:
+            self.sink(record)
+        except Exception as e:
+            # Metrics must never fail the request
+            print(f"Error emitting metrics: {str(e)}")
+        self.start(None)
+        return record
@@ -0,0 +1,143 @@
+import math
+from typing import Any, Dict, List, Optional
+
+CHARS_PER_TOKEN = 4  # Rough average for English text with Claude's tokenizer
+CONTEXT_HEADER = "\n\nHere's relevant information from your documents:\n"
+TRUNCATION_MARKER = " [...]"
+
+def estimate_tokens(text: str) -> int:
+    """Deterministic token estimate, there is no local tokenizer for Claude"""
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to roughly max_tokens, preferring a word boundary"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    max_chars = max(0, max_tokens * CHARS_PER_TOKEN - len(TRUNCATION_MARKER))
+    cut = text[:max_chars]
+    boundary = cut.rfind(' ')
+    if boundary > max_chars // 2:
+        cut = cut[:boundary]
+    return cut + TRUNCATION_MARKER
+
+def format_search_result(position: int, result: Dict[str, Any]) -> str:
+    metadata = result.get('metadata', {})
+    filename = metadata.get('filename') or 'Unknown document'
+    page = metadata.get('page') or 'Unknown'
+    return f"Document {position} (from {filename}, page {page}):\n{result['text']}\n\n"
+
+def turn_messages(record: Dict[str, Any], max_turn_tokens: int) -> List[Dict[str, Any]]:
+    """A chat history item as a user/assistant message pair, each side capped at max_turn_tokens"""
+    return [
+        {"role": "user", "content": [{"text": truncate_to_tokens(record['prompt']['S'], max_turn_tokens)}]},
+        {"role": "assistant", "content": [{"text": truncate_to_tokens(record['response']['S'], max_turn_tokens)}]}
+    ]
+
+def messages_tokens(messages: List[Dict[str, Any]]) -> int:
+    return sum(estimate_tokens(block['text']) for message in messages for block in message['content'])
+
+def summary_turn(summary: str) -> List[Dict[str, Any]]:
+    """Conversation summary as a leading exchange, Converse needs the first message to be from the user"""
+    return [
+        {"role": "user", "content": [{"text": f"Summary of our conversation so far:\n{summary}"}]},
+        {"role": "assistant", "content": [{"text": "Thanks, I remember."}]}
+    ]
+
+class BuiltPrompt:
+    def __init__(self, messages: List[Dict[str, Any]], search_results: List[Dict[str, Any]], report: Dict[str, int]):
+        self.messages = messages
+        self.search_results = search_results
+        self.report = report
+
+def build_prompt(
+    prompt_text: str,
+    chat_history: List[Dict[str, Any]],
+    search_results: List[Dict[str, Any]],
+    token_budget: int,
+    system_prompt: str = "",
+    recent_turns: int = 2,
+    max_turn_tokens: int = 500,
+    min_chunk_tokens: int = 50,
+    summary: Optional[str] = None,
+    max_summary_tokens: int = 600,
+) -> BuiltPrompt:
+    """
+    Assemble the Converse messages for a request within `token_budget` input tokens.
+
+    The system prompt, the current prompt and the conversation summary (capped at
+    `max_summary_tokens`), if there is one, always go in. The rest of the budget is
+    filled by priority:
+      1. the `recent_turns` most recent history turns,
+      2. search results, best score (smallest distance) first, the first one that does
+         not fit whole is truncated if at least `min_chunk_tokens` remain,
+      3. older history turns, newest first, until one does not fit.
+    Every history message is capped at `max_turn_tokens`, a turn that does not fit is
+    dropped whole. `chat_history` is newest first, as returned by DynamoDB; the
+    messages come out in chronological order.
+    """
+    remaining = token_budget - estimate_tokens(system_prompt) - estimate_tokens(prompt_text) - 1
+    summary_messages = summary_turn(truncate_to_tokens(summary, max_summary_tokens)) if summary else []
+    remaining -= messages_tokens(summary_messages)
+    included_turns: List[List[Dict[str, Any]]] = []  # newest first
+
+    def add_turn(record: Dict[str, Any]) -> bool:
+        nonlocal remaining
+        messages = turn_messages(record, max_turn_tokens)
+        cost = messages_tokens(messages)
+        if cost > remaining:
+            return False
+        included_turns.append(messages)
+        remaining -= cost
+        return True
+
+    # 1. Most recent turns, older turns are skipped if one of these does not fit
+    recent_fitted = all(add_turn(record) for record in chat_history[:recent_turns])
+    older = chat_history[len(included_turns):] if recent_fitted else []
+
+    # 2. Best-scoring search results
+    context_parts = []
+    included_results = []
+    truncated_results = 0
+    header_cost = estimate_tokens(CONTEXT_HEADER)
+    for result in sorted(search_results, key=lambda r: r.get('score', 0)):
+        cost = 0 if context_parts else header_cost
+        block = format_search_result(len(included_results) + 1, result)
+        if cost + estimate_tokens(block) <= remaining:
+            context_parts.append(block)
+            included_results.append(result)
+            remaining -= cost + estimate_tokens(block)
+            continue
+        available = remaining - cost - estimate_tokens(format_search_result(len(included_results) + 1, {**result, 'text': ''}))
+        if available >= min_chunk_tokens:
+            truncated = {**result, 'text': truncate_to_tokens(result['text'], available)}
+            block = format_search_result(len(included_results) + 1, truncated)
+            context_parts.append(block)
+            included_results.append(truncated)
+            remaining -= cost + estimate_tokens(block)
+            truncated_results += 1
+        break
+
+    # 3. Older turns, newest first, stop at the first one that does not fit
+    for record in older:
+        if not add_turn(record):
+            break
+
+    messages = list(summary_messages)
+    for turn in reversed(included_turns):
+        messages.extend(turn)
+    current_prompt = prompt_text
+    if context_parts:
+        current_prompt += CONTEXT_HEADER + "".join(context_parts)
+    messages.append({"role": "user", "content": [{"text": f"{current_prompt}\n"}]})
+
+    report = {
+        "budget": token_budget,
+        "tokens": token_budget - remaining,
+        "summary": 1 if summary_messages else 0,
+        "turns": len(included_turns),
+        "dropped_turns": len(chat_history) - len(included_turns),
+        "search_results": len(included_results),
+        "dropped_search_results": len(search_results) - len(included_results),
+        "truncated_search_results": truncated_results,
+    }
+    return BuiltPrompt(messages, included_results, report)
@@ -0,0 +1,129 @@
+import json
+import time
+import urllib.request
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import boto3
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+
+class TokenSink:
+    """Receives model output as it is generated"""
+
+    def on_token(self, text: str) -> None:
+        pass
+
+    def on_complete(self, full_text: str) -> None:
+        pass
+
+    def on_error(self, error: Exception) -> None:
+        pass
+
+class AppSyncPublisherSink(TokenSink):
+    """
+    Publishes partial responses through an AppSync mutation so clients subscribed to it
+    see the answer while it is generated. Tokens are buffered and flushed every
+    `flush_chars` characters or `flush_seconds`, whichever comes first, to keep the
+    number of mutations low. Requests are signed with the Lambda's IAM credentials.
+    The last chunk has `done` set, and `error` holds the error message when generation
+    failed, so subscribers can tell a failed response from a finished one.
+    """
+
+    def __init__(
+        self,
+        graphql_url: str,
+        mutation: str,
+        variables: Dict[str, Any],
+        region: str,
+        flush_chars: int = 200,
+        flush_seconds: float = 0.25,
+        timeout: float = 2.0,
+    ):
+        self.graphql_url = graphql_url
+        self.mutation = mutation
+        self.variables = variables
+        self.region = region
+        self.flush_chars = flush_chars
+        self.flush_seconds = flush_seconds
+        self.timeout = timeout
+        self._buffer: List[str] = []
+        self._buffered_chars = 0
+        self._last_flush = time.monotonic()
+        self._sequence = 0
+        self._failed = False
+        self._credentials = boto3.Session().get_credentials()
+
+    def _publish(self, chunk: str, done: bool, error: Optional[str] = None) -> None:
+        # Publishing is best effort, the full response is still returned by the resolver
+        if self._failed:
+            return
+        body = json.dumps({
+            "query": self.mutation,
+            "variables": {**self.variables, "chunk": chunk, "sequence": self._sequence, "done": done, "error": error}
+        })
+        request = AWSRequest(method="POST", url=self.graphql_url, data=body, headers={"Content-Type": "application/json"})
+        try:
+            SigV4Auth(self._credentials, "appsync", self.region).add_auth(request)
+            http_request = urllib.request.Request(
+                self.graphql_url, data=body.encode("utf-8"), headers=dict(request.headers), method="POST"
+            )
+            with urllib.request.urlopen(http_request, timeout=self.timeout) as response:
+                response.read()
+            self._sequence += 1
+        except Exception as e:
+            print(f"Error publishing response chunk, disabling streaming for this request: {str(e)}")
+            self._failed = True
+
+    def _flush(self, done: bool = False, error: Optional[str] = None) -> None:
+        if not self._buffer and not done:
+            return
+        chunk = "".join(self._buffer)
+        self._buffer = []
+        self._buffered_chars = 0
+        self._last_flush = time.monotonic()
+        self._publish(chunk, done, error)
+
+    def on_token(self, text: str) -> None:
+        self._buffer.append(text)
+        self._buffered_chars += len(text)
+        if self._buffered_chars >= self.flush_chars or time.monotonic() - self._last_flush >= self.flush_seconds:
+            self._flush()
+
+    def on_complete(self, full_text: str) -> None:
+        self._flush(done=True)
+
+    def on_error(self, error: Exception) -> None:
+        self._flush(done=True, error=str(error) or type(error).__name__)
+
+def consume_converse_stream(
+    events: Iterable[Dict[str, Any]],
+    sink: TokenSink,
+    on_usage: Optional[Callable[[Dict[str, Any]], None]] = None
+) -> str:
+    """
+    Forward text deltas from a converse_stream event stream to the sink and return the full text.
+    Any iterable of event dicts works, which makes a fake stream a plain list. `on_usage`
+    receives the token usage from the stream's metadata event.
+    """
+    parts = []
+    for event in events:
+        if 'contentBlockDelta' in event:
+            text = event['contentBlockDelta'].get('delta', {}).get('text')
+            if text:
+                parts.append(text)
+                sink.on_token(text)
+        elif 'messageStop' in event:
+            print(f"Stream stopped: {event['messageStop'].get('stopReason')}")
+        elif 'metadata' in event:
+            usage = event['metadata'].get('usage', {})
+            print(f"Stream usage: {usage.get('inputTokens')} input, {usage.get('outputTokens')} output tokens")
+            if on_usage:
+                on_usage(usage)
+        else:
+            for error_key in ('internalServerException', 'modelStreamErrorException',
+                              'throttlingException', 'validationException', 'serviceUnavailableException'):
+                if error_key in event:
+                    raise Exception(f"{error_key}: {event[error_key].get('message', '')}")
+    full_text = "".join(parts)
+    sink.on_complete(full_text)
+    return full_text
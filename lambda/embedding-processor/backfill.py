@@ -0,0 +1,62 @@
+import json
+import re
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+CHECKPOINT_PREFIX = "backfill"
+
+def staging_table_name(table_name: str, version: str) -> str:
+    """Versioned table a backfill writes to before the switch-over, e.g. document_embeddings_v2"""
+    if not re.fullmatch(r"[A-Za-z0-9_-]+", version):
+        raise ValueError(f"Backfill version may only contain letters, digits, '_' and '-': {version!r}")
+    return f"{table_name}_{version}"
+
+def plan_shards(document_keys: List[str], shard_size: int) -> List[List[str]]:
+    """Split a user's documents into shards of at most `shard_size`, in key order so a plan is reproducible"""
+    keys = sorted(document_keys)
+    return [keys[start:start + shard_size] for start in range(0, len(keys), shard_size)]
+
+def new_checkpoint(version: str, user_id: str, shards: List[List[str]], options: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Progress of one user's backfill. The shard plan is fixed when the run starts, documents
+    uploaded or changed later are picked up when the user is switched over. Documents that
+    could not be embedded are kept in failedDocuments and block the switch-over until a
+    retry succeeds.
+    """
+    return {
+        "version": version,
+        "userId": user_id,
+        "plannedAt": datetime.now(timezone.utc).isoformat(),
+        "options": options,
+        "shards": shards,
+        "completedShards": [],
+        # Shard in progress and its documents already embedded, so a resumed run skips them
+        "currentShard": None,
+        "failedDocuments": [],
+        "switchedAt": None,
+    }
+
+def pending_shards(checkpoint: Dict[str, Any]) -> List[int]:
+    completed = set(checkpoint["completedShards"])
+    return [number for number in range(len(checkpoint["shards"])) if number not in completed]
+
+def checkpoint_key(version: str, user_id: str) -> str:
+    return f"{CHECKPOINT_PREFIX}/{version}/{user_id}.json"
+
+def load_checkpoint(s3, bucket: str, version: str, user_id: str) -> Optional[Dict[str, Any]]:
+    try:
+        response = s3.get_object(Bucket=bucket, Key=checkpoint_key(version, user_id))
+    except s3.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return None
+        raise
+    return json.loads(response["Body"].read())
+
+def save_checkpoint(s3, bucket: str, checkpoint: Dict[str, Any]) -> None:
+    """A single PUT, so a checkpoint is either the previous or the new state"""
+    s3.put_object(
+        Bucket=bucket,
+        Key=checkpoint_key(checkpoint["version"], checkpoint["userId"]),
+        Body=json.dumps(checkpoint).encode("utf-8"),
+        ContentType="application/json",
+    )
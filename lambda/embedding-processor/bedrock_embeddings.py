@@ -0,0 +1,99 @@
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from botocore.exceptions import ClientError
+
+# Bedrock error codes that are worth retrying with backoff
+RETRYABLE_ERROR_CODES = {
+    'ThrottlingException',
+    'TooManyRequestsException',
+    'ServiceUnavailableException',
+    'ModelNotReadyException',
+}
+
+def is_retryable_error(error: Exception) -> bool:
+    if isinstance(error, ClientError):
+        return error.response.get('Error', {}).get('Code') in RETRYABLE_ERROR_CODES
+    return False
+
+class ConcurrentBedrockEmbeddings:
+    """
+    Titan embeddings that fan chunks out over a bounded thread pool.
+
+    Titan only accepts one input text per invoke_model call, so throughput is
+    bound by how many requests are in flight. Results keep the input order and
+    throttling errors are retried with full-jitter exponential backoff.
+    `request_options` are added to every request body, e.g. Titan v2 `dimensions` and
+    `normalize`. `on_retry` is called once per retried request, e.g. to count throttling.
+    """
+
+    def __init__(
+        self,
+        client,
+        model_id: str,
+        max_concurrency: int = 8,
+        max_retries: int = 6,
+        base_delay: float = 0.25,
+        max_delay: float = 8.0,
+        sleep: Callable[[float], None] = time.sleep,
+        on_retry: Optional[Callable[[], None]] = None,
+        request_options: Optional[Dict[str, Any]] = None,
+    ):
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        self.client = client
+        self.model_id = model_id
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+        self.on_retry = on_retry
+        self.request_options = request_options or {}
+
+    def _invoke(self, text: str) -> List[float]:
+        response = self.client.invoke_model(
+            modelId=self.model_id,
+            body=json.dumps({"inputText": text, **self.request_options}),
+            accept="application/json",
+            contentType="application/json",
+        )
+        response_body = json.loads(response['body'].read())
+        return response_body['embedding']
+
+    def _backoff_delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def embed_with_retry(self, text: str) -> List[float]:
+        attempt = 0
+        while True:
+            try:
+                return self._invoke(text)
+            except Exception as e:
+                if not is_retryable_error(e) or attempt >= self.max_retries:
+                    raise
+                delay = self._backoff_delay(attempt)
+                print(f"Bedrock throttled embedding request (attempt {attempt + 1}), retrying in {delay:.2f}s")
+                if self.on_retry:
+                    self.on_retry()
+                self.sleep(delay)
+                attempt += 1
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        texts = list(texts)
+        if not texts:
+            return []
+
+        workers = min(self.max_concurrency, len(texts))
+        if workers == 1:
+            return [self.embed_with_retry(text) for text in texts]
+
+        # executor.map yields results in submission order, so vectors line up with chunks
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(self.embed_with_retry, texts))
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_with_retry(text)
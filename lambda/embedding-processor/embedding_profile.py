@@ -0,0 +1,144 @@
+# Kept identical in both Lambda directories, test/test_shared_modules.py checks the copies
+import json
+import math
+import os
+from typing import Any, Dict, List, Tuple
+
+# Titan Text Embeddings v2 output sizes
+TITAN_V2_DIMENSIONS = (256, 512, 1024)
+STORAGE_TYPES = ('float32', 'float16', 'binary')
+PROFILE_METADATA_KEY = b'embedding_profile'
+FULL_VECTOR_COLUMN = 'full_vector'
+
+class EmbeddingProfile:
+    """
+    How Titan v2 embeddings are requested, stored and searched.
+
+    `dimension` and `normalize` are passed to Titan. `storage` is the type of the searched
+    `vector` column: float32, float16 (half the bytes) or binary (one bit per dimension,
+    the sign of the float value, searched by hamming distance). With `rerank_factor` > 0
+    and compact storage, a float16 `full_vector` column is also stored and the top
+    rerank_factor * top_k candidates are re-ranked by L2 distance on it. The column costs
+    2 bytes per dimension, so 1024-binary-rerank4 stores about 2.2 KB per row against 4.1 KB
+    for 1024-float32, and float16 storage with a re-rank doubles the vector bytes for no more
+    than a second look at the candidates. Search must name the `vector` column, LanceDB
+    cannot tell the two columns apart.
+
+    The profile is kept in the table's schema metadata, so a table is always written and
+    searched with the profile it was created with.
+    """
+
+    def __init__(self, dimension: int = 1024, normalize: bool = True, storage: str = 'float32', rerank_factor: int = 0):
+        if storage not in STORAGE_TYPES:
+            raise ValueError(f"storage must be one of {STORAGE_TYPES}, got {storage}")
+        self.dimension = dimension
+        self.normalize = normalize
+        self.storage = storage
+        self.rerank_factor = rerank_factor if storage != 'float32' else 0
+
+    @classmethod
+    def from_env(cls) -> 'EmbeddingProfile':
+        # Only new tables are checked, tables written before profiles may hold other sizes
+        dimension = int(os.environ.get('EMBEDDING_DIMENSIONS', '1024'))
+        if dimension not in TITAN_V2_DIMENSIONS:
+            raise ValueError(f"EMBEDDING_DIMENSIONS must be one of {TITAN_V2_DIMENSIONS}, got {dimension}")
+        return cls(
+            dimension=dimension,
+            normalize=os.environ.get('EMBEDDING_NORMALIZE', 'true').lower() == 'true',
+            storage=os.environ.get('EMBEDDING_STORAGE', 'float32'),
+            rerank_factor=int(os.environ.get('EMBEDDING_RERANK_FACTOR', '0')),
+        )
+
+    @classmethod
+    def from_schema(cls, schema) -> 'EmbeddingProfile':
+        """Profile of an existing table, tables from before profiles are 1024-dim float32"""
+        metadata = schema.metadata or {}
+        if PROFILE_METADATA_KEY in metadata:
+            return cls(**json.loads(metadata[PROFILE_METADATA_KEY]))
+        return cls(dimension=schema.field('vector').type.list_size)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'dimension': self.dimension,
+            'normalize': self.normalize,
+            'storage': self.storage,
+            'rerank_factor': self.rerank_factor,
+        }
+
+    def schema_metadata(self) -> Dict[bytes, bytes]:
+        return {PROFILE_METADATA_KEY: json.dumps(self.to_dict()).encode('utf-8')}
+
+    @property
+    def name(self) -> str:
+        suffix = f"-rerank{self.rerank_factor}" if self.rerank_factor else ''
+        return f"{self.dimension}-{self.storage}{'' if self.normalize else '-raw'}{suffix}"
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, EmbeddingProfile) and self.to_dict() == other.to_dict()
+
+    def __repr__(self) -> str:
+        return f"EmbeddingProfile({self.name})"
+
+    @property
+    def stores_full_vector(self) -> bool:
+        return self.rerank_factor > 0
+
+    @property
+    def distance_type(self) -> str:
+        return 'hamming' if self.storage == 'binary' else 'l2'
+
+    def same_embedding(self, other: 'EmbeddingProfile') -> bool:
+        """True when Titan returns the same floats for both profiles, whatever they store"""
+        return self.dimension == other.dimension and self.normalize == other.normalize
+
+    def titan_request(self, text: str) -> Dict[str, Any]:
+        return {"inputText": text, "dimensions": self.dimension, "normalize": self.normalize}
+
+    def cache_model_id(self, model_id: str) -> str:
+        """Model ID for embedding cache keys, vectors of different sizes must not be mixed up"""
+        return f"{model_id}:{self.dimension}:{'norm' if self.normalize else 'raw'}"
+
+    def vector_types(self) -> Dict[str, Any]:
+        """Arrow types of the vector columns"""
+        import pyarrow as pa
+        if self.storage == 'binary':
+            types = {'vector': pa.list_(pa.uint8(), math.ceil(self.dimension / 8))}
+        else:
+            types = {'vector': pa.list_(pa.float16() if self.storage == 'float16' else pa.float32(), self.dimension)}
+        if self.stores_full_vector:
+            # Half precision is plenty to order a few candidates, tables written before keep float32
+            types[FULL_VECTOR_COLUMN] = pa.list_(pa.float16(), self.dimension)
+        return types
+
+    def search_vector(self, embedding: List[float]) -> List[Any]:
+        """Value of the searched `vector` column for a float embedding, also used for queries"""
+        if self.storage == 'binary':
+            return pack_sign_bits(embedding)
+        return embedding
+
+    def vector_columns(self, embedding: List[float]) -> Dict[str, Any]:
+        columns = {'vector': self.search_vector(embedding)}
+        if self.stores_full_vector:
+            columns[FULL_VECTOR_COLUMN] = embedding
+        return columns
+
+def pack_sign_bits(embedding: List[float]) -> List[int]:
+    """One bit per dimension, set for positive values, packed most significant bit first"""
+    packed = []
+    for start in range(0, len(embedding), 8):
+        byte = 0
+        for value in embedding[start:start + 8]:
+            byte = (byte << 1) | (1 if value > 0 else 0)
+        # A short last byte is padded with zero bits, like numpy.packbits
+        byte <<= 8 - len(embedding[start:start + 8])
+        packed.append(byte)
+    return packed
+
+def squared_l2(a: List[float], b: List[float]) -> float:
+    """Same scale as LanceDB's l2 _distance"""
+    return sum((x - y) * (x - y) for x, y in zip(a, b))
+
+def rerank(vectors: List[List[float]], query: List[float], top_k: int) -> List[Tuple[int, float]]:
+    """(position, exact distance) of the top_k candidate vectors closest to the query"""
+    distances = [(position, squared_l2(vector, query)) for position, vector in enumerate(vectors)]
+    return sorted(distances, key=lambda item: item[1])[:top_k]
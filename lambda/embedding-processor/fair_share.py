@@ -0,0 +1,97 @@
+import json
+import random
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# SQS rejects longer message delays
+MAX_SQS_DELAY_SECONDS = 900
+
+def split_user_documents(documents: List[Tuple[str, str, str]], quota: int) -> Tuple[List[Tuple[str, str, str]], List[Tuple[str, str, str]]]:
+    """
+    Split one user's (message ID, event type, path) events into those processed now and those
+    deferred. Deletes are cheap and always processed, at most `quota` uploads are kept.
+    """
+    now, deferred = [], []
+    uploads = 0
+    for document in documents:
+        if document[1] == 'DOCUMENT_DELETED':
+            now.append(document)
+        elif uploads < quota:
+            now.append(document)
+            uploads += 1
+        else:
+            deferred.append(document)
+    return now, deferred
+
+def order_users(documents_by_user: Dict[str, List[Tuple[str, str, str]]]) -> List[str]:
+    """Users with the fewest documents first, a single upload never queues behind a bulk load"""
+    return sorted(documents_by_user, key=lambda user_id: len(documents_by_user[user_id]))
+
+def acquire_user_slot(dynamodb, table_name: str, user_id: str, owner: str, max_in_flight: int,
+                      lease_seconds: float, clock: Callable[[], float] = time.time) -> Optional[int]:
+    """
+    Take one of the user's `max_in_flight` ingestion slots, shared by all concurrent invocations.
+    A slot is a lease that expires after `lease_seconds`, so a crashed invocation cannot hold it
+    forever. Returns the slot number, or None when all slots are busy.
+    """
+    now = int(clock())
+    for slot in range(max_in_flight):
+        try:
+            dynamodb.put_item(
+                TableName=table_name,
+                Item={
+                    'userId': {'S': user_id},
+                    'slot': {'N': str(slot)},
+                    'owner': {'S': owner},
+                    'expiresAt': {'N': str(now + int(lease_seconds))}
+                },
+                ConditionExpression='attribute_not_exists(userId) OR expiresAt < :now',
+                ExpressionAttributeValues={':now': {'N': str(now)}}
+            )
+            return slot
+        except dynamodb.exceptions.ConditionalCheckFailedException:
+            continue
+    return None
+
+def release_user_slot(dynamodb, table_name: str, user_id: str, slot: int, owner: str) -> None:
+    """Free a slot, unless its lease expired and another invocation took it over"""
+    try:
+        dynamodb.delete_item(
+            TableName=table_name,
+            Key={'userId': {'S': user_id}, 'slot': {'N': str(slot)}},
+            ConditionExpression='#owner = :owner',
+            ExpressionAttributeNames={'#owner': 'owner'},
+            ExpressionAttributeValues={':owner': {'S': owner}}
+        )
+    except dynamodb.exceptions.ConditionalCheckFailedException:
+        pass
+
+def get_deferrals(record: Dict[str, Any]) -> int:
+    """How many times the message was already deferred"""
+    try:
+        return int(json.loads(record['body']).get('deferrals', 0))
+    except (ValueError, AttributeError):
+        return 0
+
+def deferral_delay(deferrals: int, base_seconds: float, max_seconds: float, rand: Callable[[], float] = random.random) -> int:
+    """Exponential backoff with equal jitter, so deferred uploads of one user spread out"""
+    delay = min(max_seconds, base_seconds * 2 ** deferrals, MAX_SQS_DELAY_SECONDS)
+    return int(delay / 2 + rand() * delay / 2)
+
+def queue_url_from_arn(queue_arn: str) -> str:
+    _, partition, _, region, account, name = queue_arn.split(':')
+    domain = 'amazonaws.com.cn' if partition == 'aws-cn' else 'amazonaws.com'
+    return f"https://sqs.{region}.{domain}/{account}/{name}"
+
+def defer_record(sqs, record: Dict[str, Any], delay_seconds: int) -> None:
+    """
+    Send the message back to its queue with a delay and a deferral count. The original message is
+    then acknowledged, so deferring does not count towards the dead-letter queue's receive limit.
+    """
+    body = json.loads(record['body'])
+    body['deferrals'] = body.get('deferrals', 0) + 1
+    sqs.send_message(
+        QueueUrl=queue_url_from_arn(record['eventSourceARN']),
+        MessageBody=json.dumps(body),
+        DelaySeconds=delay_seconds
+    )
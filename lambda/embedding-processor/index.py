@@ -1,24 +1,129 @@
 import urllib.parse
 import boto3
-import io
+import hashlib
+import itertools
 import json
-import lancedb
-from PyPDF2 import PdfReader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.embeddings import BedrockEmbeddings
-from langchain_community.vectorstores import LanceDB
-from datetime import datetime
-
-from typing import List
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
+from datetime import datetime, timedelta, timezone
+
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 import os
 
-s3_client = boto3.client('s3')
-dynamodb_client = boto3.client('dynamodb')
-bedrock_client = boto3.client('bedrock-runtime', region_name='us-east-1')
-embeddings = BedrockEmbeddings(
-    client=bedrock_client,
-    model_id="amazon.titan-embed-text-v2:0"
-)
+from backfill import load_checkpoint, new_checkpoint, pending_shards, plan_shards, save_checkpoint, staging_table_name
+from bedrock_embeddings import ConcurrentBedrockEmbeddings
+from embedding_profile import FULL_VECTOR_COLUMN, TITAN_V2_DIMENSIONS, EmbeddingProfile
+from fair_share import (acquire_user_slot, defer_record, deferral_delay, get_deferrals, order_users,
+                        release_user_slot, split_user_documents)
+from metrics import MetricsRecorder
+from table_maintenance import compact_table, get_table_layout, needs_compaction
+from vector_index import maintain_vector_index
+
+if TYPE_CHECKING:
+    from PyPDF2 import PdfReader
+
+# Number of documents (from different users) processed at once within an SQS batch
+DOCUMENT_CONCURRENCY = int(os.environ.get('DOCUMENT_CONCURRENCY', '4'))
+# Fair share between users: uploads of one user processed per SQS batch, the rest is deferred
+USER_BATCH_QUOTA = int(os.environ.get('USER_BATCH_QUOTA', '3'))
+# Optional DynamoDB table of per-user ingestion slots, bounds the invocations working on one user at once
+INGESTION_SLOTS_TABLE_NAME = os.environ.get('INGESTION_SLOTS_TABLE_NAME')
+USER_MAX_IN_FLIGHT = int(os.environ.get('USER_MAX_IN_FLIGHT', '2'))
+INGESTION_SLOT_LEASE_SECONDS = int(os.environ.get('INGESTION_SLOT_LEASE_SECONDS', '960'))  # Lambda timeout plus a margin
+# Deferred uploads return to the queue after about base * 2^deferrals seconds, capped
+DEFERRAL_BASE_SECONDS = float(os.environ.get('DEFERRAL_BASE_SECONDS', '20'))
+DEFERRAL_MAX_SECONDS = float(os.environ.get('DEFERRAL_MAX_SECONDS', '300'))
+# No new document is started this close to the Lambda timeout, the rest goes back to the queue
+PROCESSING_TIME_MARGIN_SECONDS = int(os.environ.get('PROCESSING_TIME_MARGIN_SECONDS', '120'))
+# Text splitting of new documents, a backfill can re-chunk existing ones with other settings
+CHUNK_SIZE = int(os.environ.get('CHUNK_SIZE', '1000'))
+CHUNK_OVERLAP = int(os.environ.get('CHUNK_OVERLAP', '200'))
+# Number of Titan embedding requests kept in flight per document
+EMBEDDING_CONCURRENCY = int(os.environ.get('EMBEDDING_CONCURRENCY', '8'))
+EMBEDDING_MAX_RETRIES = int(os.environ.get('EMBEDDING_MAX_RETRIES', '6'))
+# Number of chunks embedded and written to LanceDB per batch
+EMBEDDING_BATCH_SIZE = int(os.environ.get('EMBEDDING_BATCH_SIZE', '64'))
+# PDF text extraction worker processes, 0 = one per CPU, 1 = extract in-process
+PDF_EXTRACTION_WORKERS = int(os.environ.get('PDF_EXTRACTION_WORKERS', '0'))
+# Documents shorter than this are not worth the process start-up cost
+PARALLEL_EXTRACTION_MIN_PAGES = int(os.environ.get('PARALLEL_EXTRACTION_MIN_PAGES', '32'))
+# Tables smaller than this are searched by brute force, larger ones get an IVF-PQ index
+VECTOR_INDEX_MIN_ROWS = int(os.environ.get('VECTOR_INDEX_MIN_ROWS', '5000'))
+# Rebuild the index when an append leaves this fraction of the indexed rows unindexed
+VECTOR_INDEX_REBUILD_FRACTION = float(os.environ.get('VECTOR_INDEX_REBUILD_FRACTION', '1.0'))
+# Fold new rows into the existing index once this many are unindexed
+VECTOR_INDEX_OPTIMIZE_MIN_UNINDEXED = int(os.environ.get('VECTOR_INDEX_OPTIMIZE_MIN_UNINDEXED', '1000'))
+# Compact a table once it has this many small fragments or table versions
+COMPACTION_MIN_SMALL_FRAGMENTS = int(os.environ.get('COMPACTION_MIN_SMALL_FRAGMENTS', '32'))
+COMPACTION_MAX_VERSIONS = int(os.environ.get('COMPACTION_MAX_VERSIONS', '100'))
+# Versions younger than this are kept so readers holding them keep working
+COMPACTION_CLEANUP_OLDER_THAN = timedelta(minutes=int(os.environ.get('COMPACTION_CLEANUP_OLDER_THAN_MINUTES', '60')))
+# Ingestion checks a user's table layout at most this often per container, the daily compaction_handler covers the rest
+COMPACTION_CHECK_INTERVAL_SECONDS = int(os.environ.get('COMPACTION_CHECK_INTERVAL_SECONDS', '600'))
+# Backfill runs (backfill_handler): documents per checkpointed shard and users re-embedded at once
+BACKFILL_SHARD_SIZE = int(os.environ.get('BACKFILL_SHARD_SIZE', '20'))
+BACKFILL_CONCURRENCY = int(os.environ.get('BACKFILL_CONCURRENCY', '4'))
+# No new shard is started this close to the Lambda timeout, the rest goes to a new invocation
+BACKFILL_TIME_MARGIN_SECONDS = int(os.environ.get('BACKFILL_TIME_MARGIN_SECONDS', '180'))
+
+TABLE_NAME = "document_embeddings"
+SOURCE_DOCUMENTS_PREFIX = "user-documents/"
+EMBEDDING_MODEL_ID = "amazon.titan-embed-text-v2:0"
+# Dimension, normalization and storage of new tables (EMBEDDING_DIMENSIONS, EMBEDDING_NORMALIZE,
+# EMBEDDING_STORAGE, EMBEDDING_RERANK_FACTOR), existing tables keep the profile they were created with
+EMBEDDING_PROFILE = EmbeddingProfile.from_env()
+# CloudWatch namespace of the per-invocation EMF metrics record
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'Doraemo')
+
+# Per-stage timings and counters of the current invocation, flushed as one EMF record
+metrics = MetricsRecorder(METRICS_NAMESPACE, 'EmbeddingProcessor')
+
+# Clients and the PDF, text splitting and LanceDB libraries are loaded on first use:
+# the compaction entry point and deletions never need most of them
+_shared: Dict[str, Any] = {}
+_shared_lock = threading.Lock()
+
+def get_shared(name: str, build):
+    """Build an object once per container, boto3 client creation is not thread safe"""
+    with _shared_lock:
+        if name not in _shared:
+            _shared[name] = build()
+        return _shared[name]
+
+def get_s3_client():
+    return get_shared('s3', lambda: boto3.client('s3'))
+
+def get_dynamodb_client():
+    return get_shared('dynamodb', lambda: boto3.client('dynamodb'))
+
+def get_sqs_client():
+    return get_shared('sqs', lambda: boto3.client('sqs'))
+
+def get_bedrock_client():
+    return get_shared('bedrock', lambda: boto3.client(
+        'bedrock-runtime',
+        region_name='us-east-1',
+        # One pooled connection per concurrent embedding request across documents
+        config=Config(max_pool_connections=max(EMBEDDING_CONCURRENCY * DOCUMENT_CONCURRENCY, 10))
+    ))
+
+def get_embeddings(profile: Optional[EmbeddingProfile] = None) -> ConcurrentBedrockEmbeddings:
+    """Titan embedder for a profile, all profiles share one Bedrock client"""
+    profile = profile or EMBEDDING_PROFILE
+    # Resolved first, get_shared's lock is not reentrant
+    client = get_bedrock_client()
+    return get_shared(f"embeddings:{profile.name}", lambda: ConcurrentBedrockEmbeddings(
+        client=client,
+        model_id=EMBEDDING_MODEL_ID,
+        max_concurrency=EMBEDDING_CONCURRENCY,
+        max_retries=EMBEDDING_MAX_RETRIES,
+        on_retry=lambda: metrics.count('EmbeddingRetries'),
+        request_options={"dimensions": profile.dimension, "normalize": profile.normalize}
+    ))
 
 # Get the DynamoDB table name from environment or use a default for local testing
 USER_DOCUMENT_TABLE_NAME = os.environ.get('USER_DOCUMENT_TABLE_NAME', 'UserDocument-jku623bccfdvziracnh673rzwe-NONE')
@@ -33,176 +138,968 @@ def get_user_id_from_key(key: str) -> str:
 def is_pdf(filename):
     return filename.lower().endswith('.pdf')
 
-def extract_text_from_pdf(pdf_reader: PdfReader) -> str:
-    text = ""
-    for page in pdf_reader.pages:
-        text += page.extract_text()
-    return text
-
-def create_chunks(text: str) -> List[str]:
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
-        length_function=len,
-        separators=["\n\n", "\n", " ", ""]
-    )
-    return text_splitter.split_text(text)
+def get_text_splitter(chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP):
+    def build():
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+        return RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            length_function=len,
+            separators=["\n\n", "\n", " ", ""]
+        )
+    return get_shared(f"text_splitter:{chunk_size}:{chunk_overlap}", build)
+
+def iter_pdf_pages(pdf_reader: 'PdfReader') -> Iterator[Tuple[int, str]]:
+    """Yield (page_number, text) one page at a time, page numbers start at 1"""
+    for page_number, page in enumerate(pdf_reader.pages, start=1):
+        yield page_number, page.extract_text() or ""
+
+def iter_document_pages(pdf_path: str, pdf_reader: 'PdfReader') -> Iterator[Tuple[int, str]]:
+    """Pick serial or multi-process extraction depending on document size and CPUs"""
+    from parallel_extraction import get_worker_count, iter_pdf_pages_parallel
+    num_pages = len(pdf_reader.pages)
+    workers = get_worker_count(PDF_EXTRACTION_WORKERS)
+    if workers > 1 and num_pages >= PARALLEL_EXTRACTION_MIN_PAGES:
+        print(f"Extracting {num_pages} pages with {workers} worker processes")
+        return iter_pdf_pages_parallel(pdf_path, num_pages, workers)
+    return iter_pdf_pages(pdf_reader)
+
+def create_chunks(text: str, splitter=None) -> List[str]:
+    return (splitter or get_text_splitter()).split_text(text)
+
+def iter_chunks(pages: Iterable[Tuple[int, str]], splitter=None) -> Iterator[Dict[str, Any]]:
+    """Split pages into chunks lazily, each chunk remembers the page it came from"""
+    chunk_index = 0
+    # Extraction and chunking interleave with embedding, their time is summed per document
+    extraction_seconds = 0.0
+    chunking_seconds = 0.0
+    pages = iter(pages)
+    try:
+        while True:
+            started = metrics.clock()
+            try:
+                page_number, page_text = next(pages)
+            except StopIteration:
+                break
+            extracted = metrics.clock()
+            page_chunks = create_chunks(page_text, splitter)
+            extraction_seconds += extracted - started
+            chunking_seconds += metrics.clock() - extracted
+            for chunk in page_chunks:
+                yield {"text": chunk, "page": page_number, "chunk_index": chunk_index}
+                chunk_index += 1
+    finally:
+        metrics.record('PdfExtraction', round(extraction_seconds * 1000, 3), 'Milliseconds')
+        metrics.record('Chunking', round(chunking_seconds * 1000, 3), 'Milliseconds')
+        metrics.count('ChunksCreated', chunk_index)
+
+def iter_batches(items: Iterable[Any], batch_size: int) -> Iterator[List[Any]]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
 def update_document_status(document_key: str, status: str) -> None:
     """Update the document status in DynamoDB"""
     try:
         # Update the document status in DynamoDB
-        response = dynamodb_client.update_item(
-            TableName=USER_DOCUMENT_TABLE_NAME,
-            Key={
-                'id': {'S': document_key}
-            },
-            UpdateExpression='SET #status = :status, updatedAt = :updatedAt',
-            ExpressionAttributeNames={
-                '#status': 'status'
-            },
-            ExpressionAttributeValues={
-                ':status': {'S': status},
-                ':updatedAt': {'S': datetime.now().isoformat()}
-            },
-            ReturnValues='UPDATED_NEW'
-        )
+        with metrics.timer('DynamoDBStatusUpdate'):
+            response = get_dynamodb_client().update_item(
+                TableName=USER_DOCUMENT_TABLE_NAME,
+                Key={
+                    'id': {'S': document_key}
+                },
+                UpdateExpression='SET #status = :status, updatedAt = :updatedAt',
+                ExpressionAttributeNames={
+                    '#status': 'status'
+                },
+                ExpressionAttributeValues={
+                    ':status': {'S': status},
+                    ':updatedAt': {'S': datetime.now().isoformat()}
+                },
+                ReturnValues='UPDATED_NEW'
+            )
         print(f"Updated document status to '{status}' for {document_key}: {response}")
         return response
     except Exception as e:
         print(f"Error updating document status: {e}")
         raise e
 
-def store_document_embeddings(bucket: str, document_key: str, chunks: List[str]) -> None:
-    # Get user ID from the document key
-    user_id = get_user_id_from_key(document_key)
-    
+def hash_chunk(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def sql_string(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+def load_existing_chunks(table, document_key: str) -> List[Dict[str, Any]]:
+    """Rows already stored for a source document, ordered by chunk index"""
+    if table is None:
+        return []
+    vector_columns = [name for name in ('vector', FULL_VECTOR_COLUMN) if name in table.schema.names]
+    rows = (
+        table.search()
+        .where(f"source = {sql_string(document_key)}")
+        .select(['id', *vector_columns, 'page', 'chunk_index', 'hash'])
+        .limit(None)
+        .to_arrow()
+        .to_pylist()
+    )
+    return sorted(rows, key=lambda row: row['chunk_index'] or 0)
+
+def is_same_chunk(row: Dict[str, Any], chunk: Dict[str, Any]) -> bool:
+    return row['hash'] == chunk['hash'] and row['chunk_index'] == chunk['chunk_index'] and row['page'] == chunk['page']
+
+def match_stored_prefix(existing: List[Dict[str, Any]], chunks: Iterator[Dict[str, Any]]) -> Tuple[int, Optional[Iterator[Dict[str, Any]]]]:
+    """
+    Consume chunks while they equal the stored rows at the same positions. Returns how many
+    matched and the remaining chunks, or None when every chunk matched. Matched chunks are
+    not kept, so an unchanged document is compared without holding it in memory.
+    """
+    matched = 0
+    for chunk in chunks:
+        if matched < len(existing) and is_same_chunk(existing[matched], chunk):
+            matched += 1
+            continue
+        return matched, itertools.chain([chunk], chunks)
+    return matched, None
+
+def delete_rows(table, ids: List[str], batch_size: int = 500) -> None:
+    for start in range(0, len(ids), batch_size):
+        id_list = ", ".join(sql_string(row_id) for row_id in ids[start:start + batch_size])
+        table.delete(f"id IN ({id_list})")
+
+def touch_rows(table, ids: List[str], uploaded_at: datetime, batch_size: int = 500) -> None:
+    if 'uploaded_at' not in table.schema.names:
+        return
+    for start in range(0, len(ids), batch_size):
+        id_list = ", ".join(sql_string(row_id) for row_id in ids[start:start + batch_size])
+        table.update(where=f"id IN ({id_list})", values={'uploaded_at': uploaded_at})
+
+def delete_document_rows(table, document_key: str) -> int:
+    """Remove every chunk of a document, the source column's bitmap index avoids a full scan"""
+    removed = table.count_rows(f"source = {sql_string(document_key)}")
+    if removed:
+        table.delete(f"source = {sql_string(document_key)}")
+    return removed
+
+def open_document_table(db, table_name: str = TABLE_NAME):
+    """
+    Open the user's table, migrating the legacy metadata-struct layout. None if it does not exist
+    yet, any other error (S3, credentials) is raised so the record is retried.
+    """
+    from table_schema import is_legacy_table, migrate_legacy_table
+    try:
+        table = db.open_table(table_name)
+    except FileNotFoundError:
+        return None
+    except ValueError as e:
+        # LanceDB reports a missing table as ValueError("Table '...' was not found")
+        if 'not found' in str(e):
+            return None
+        raise
+    if is_legacy_table(table):
+        with metrics.timer('LegacyMigration'):
+            table = migrate_legacy_table(db, table_name, table)
+        rebuild_indexes(table, table_name)
+    return table
+
+def rebuild_indexes(table, table_name: str) -> None:
+    """Indexes of a table rewritten by an overwrite, which starts a version without any"""
+    from table_schema import ensure_scalar_indexes
+    try:
+        with metrics.timer('VectorIndexMaintenance'):
+            action = maintain_vector_index(
+                table,
+                min_rows=VECTOR_INDEX_MIN_ROWS,
+                rebuild_fraction=VECTOR_INDEX_REBUILD_FRACTION,
+                optimize_min_unindexed=VECTOR_INDEX_OPTIMIZE_MIN_UNINDEXED
+            )
+        with metrics.timer('ScalarIndexMaintenance'):
+            ensure_scalar_indexes(table)
+        print(f"Rebuilt indexes of rewritten table {table_name}: vector index {action}")
+    except Exception as e:
+        # The table is searchable without indexes, the next ingestion retries
+        print(f"Error rebuilding indexes of {table_name}: {e}")
+
+def get_embeddings_bucket() -> str:
     # Get embeddings bucket name from environment
     embeddings_bucket = os.environ.get('EMBEDDINGS_BUCKET_NAME')
     if not embeddings_bucket:
         raise ValueError("EMBEDDINGS_BUCKET_NAME environment variable not set")
+    return embeddings_bucket
+
+def connect_to_user_db(user_id: str):
+    # Embeddings live in a user-specific folder in the embeddings bucket
+    import lancedb
+    return lancedb.connect(f"s3://{get_embeddings_bucket()}/embeddings/{user_id}")
+
+def compact_if_fragmented(table, user_id: str, measure_latency: bool = True) -> Optional[Dict[str, Any]]:
+    """Compact the table when appends have left too many small fragments or versions"""
+    layout = get_table_layout(table, COMPACTION_CLEANUP_OLDER_THAN)
+    if not needs_compaction(layout, COMPACTION_MIN_SMALL_FRAGMENTS, COMPACTION_MAX_VERSIONS):
+        return None
+    with metrics.timer('Compaction'):
+        report = compact_table(table, COMPACTION_CLEANUP_OLDER_THAN, measure_latency=measure_latency)
+    print(f"Compacted table for user {user_id}: {json.dumps(report)}")
+    return report
+
+# Last time (monotonic) this container checked a user's table for compaction after an ingestion
+_compaction_checked: Dict[str, float] = {}
+
+def compact_after_ingestion(table, user_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Rate-limited compact_if_fragmented for the ingestion path: the layout check lists the
+    table's versions on S3, and the latency probes are left to the scheduled compaction.
+    """
+    now = time.monotonic()
+    with _shared_lock:
+        checked = _compaction_checked.get(user_id)
+        if checked is not None and now - checked < COMPACTION_CHECK_INTERVAL_SECONDS:
+            return None
+        _compaction_checked[user_id] = now
+    return compact_if_fragmented(table, user_id, measure_latency=False)
+
+def store_document_embeddings(
+    bucket: str,
+    document_key: str,
+    chunks: Iterable[Dict[str, Any]],
+    table_name: str = TABLE_NAME,
+    new_table_profile: EmbeddingProfile = EMBEDDING_PROFILE,
+    uploaded_at: Optional[datetime] = None
+) -> int:
+    """
+    Embed a document's chunks into the user's table, replacing the document's previous rows.
+    Rows are stamped with `uploaded_at`, the time of this ingestion unless the document was
+    uploaded earlier, as when a backfill re-embeds it. Returns the chunks the table holds for it.
+    """
+    from table_schema import document_schema, ensure_scalar_indexes
+
+    # Get user ID from the document key
+    user_id = get_user_id_from_key(document_key)
     
-    # Connect to LanceDB using the lancedb library directly
-    # Store embeddings in a user-specific folder in the embeddings bucket
-    db = lancedb.connect(f"s3://{embeddings_bucket}/embeddings/{user_id}")
-    
-    # Use a fixed table name for all documents of this user
-    table_name = "document_embeddings"
-    
-    # Create metadata for each chunk
-    metadatas = [{"source": document_key, "chunk_index": i} for i in range(len(chunks))]
-    
-    # Get or create the table
+    # Created from the first batch when the user has no table yet
+    with metrics.timer('LanceDBOpen'):
+        db = connect_to_user_db(user_id)
+        table = open_document_table(db, table_name)
+    # An existing table keeps the profile its vectors were written with
+    profile = EmbeddingProfile.from_schema(table.schema) if table is not None else new_table_profile
+    if profile != new_table_profile:
+        print(f"Table of user {user_id} uses embedding profile {profile.name}, configured {new_table_profile.name}")
+    uploaded_at = uploaded_at or datetime.now(timezone.utc)
+
+    chunks = ({**chunk, "hash": hash_chunk(chunk["text"])} for chunk in chunks)
+
+    # A re-uploaded document: stored rows that still match their position are kept,
+    # and the vectors of moved chunks whose text did not change are reused
+    with metrics.timer('LanceDBRead'):
+        existing = load_existing_chunks(table, document_key)
+    kept = 0
+    if existing:
+        kept, chunks = match_stored_prefix(existing, chunks)
+        if chunks is None and kept == len(existing):
+            metrics.count('UnchangedDocuments')
+            print(f"Document {document_key} is unchanged ({kept} chunks), skipping embedding")
+            return kept
+        print(f"Re-indexing {document_key}: keeping the first {kept} of {len(existing)} stored chunks")
+    # Stored vector columns per chunk hash, reused as they are
+    vector_names = list(profile.vector_types())
+    known_vectors = {row['hash']: {name: row[name] for name in vector_names} for row in existing if row['hash']}
+
+    # Embed and append in bounded batches so memory stays flat and
+    # the first vectors land while later pages are still being extracted
+    stored = 0
+    embedded = 0
+    for batch in iter_batches(chunks or [], EMBEDDING_BATCH_SIZE):
+        # Only text that has never been embedded for this document goes to Bedrock, new
+        # vectors are kept for this batch only so a long first upload does not pile them up
+        missing = list(dict.fromkeys(chunk["hash"] for chunk in batch if chunk["hash"] not in known_vectors))
+        batch_vectors = {}
+        if missing:
+            text_by_hash = {chunk["hash"]: chunk["text"] for chunk in batch}
+            texts = [text_by_hash[chunk_hash] for chunk_hash in missing]
+            metrics.size('EmbeddingBatchBytes', sum(len(text.encode('utf-8')) for text in texts))
+            with metrics.timer('Embedding'):
+                vectors = get_embeddings(profile).embed_documents(texts)
+            batch_vectors = dict(zip(missing, map(profile.vector_columns, vectors)))
+            embedded += len(missing)
+        metrics.count('ChunksEmbedded', len(missing))
+        metrics.count('ChunksReused', len(batch) - len(missing))
+
+        rows = [{
+            **(known_vectors.get(chunk["hash"]) or batch_vectors[chunk["hash"]]),
+            "id": str(uuid.uuid4()),
+            "text": chunk["text"],
+            "source": document_key,
+            "page": chunk["page"],
+            "chunk_index": chunk["chunk_index"],
+            "hash": chunk["hash"],
+            "uploaded_at": uploaded_at
+        } for chunk in batch]
+
+        with metrics.timer('LanceDBWrite'):
+            if table is None:
+                table = db.create_table(table_name, data=rows, schema=document_schema(profile))
+            else:
+                table.add(rows)
+        stored += len(rows)
+        metrics.count('ChunksStored', len(rows))
+        print(f"Stored batch of {len(rows)} embeddings ({stored} total) for {document_key}")
+
+    # The new rows are in place, drop the rest of the previous version of the document
+    if existing:
+        with metrics.timer('LanceDBDelete'):
+            delete_rows(table, [row['id'] for row in existing[kept:]])
+        print(f"Removed {len(existing) - kept} previous chunks of {document_key}")
+        if kept:
+            # Kept rows belong to the new upload, so the whole document has one upload time
+            with metrics.timer('LanceDBUpdate'):
+                touch_rows(table, [row['id'] for row in existing[:kept]], uploaded_at)
+
+    print(f"Stored {stored} embeddings ({embedded} newly embedded, {kept} kept) for user {user_id} in table: {table_name}")
+
+    if stored:
+        # The document is searchable without the index, so index upkeep must not fail ingestion
+        try:
+            with metrics.timer('VectorIndexMaintenance'):
+                action = maintain_vector_index(
+                    table,
+                    min_rows=VECTOR_INDEX_MIN_ROWS,
+                    rebuild_fraction=VECTOR_INDEX_REBUILD_FRACTION,
+                    optimize_min_unindexed=VECTOR_INDEX_OPTIMIZE_MIN_UNINDEXED
+                )
+            print(f"Vector index maintenance for user {user_id}: {action}")
+        except Exception as e:
+            print(f"Error maintaining vector index for user {user_id}: {e}")
+        try:
+            with metrics.timer('ScalarIndexMaintenance'):
+                created = ensure_scalar_indexes(table)
+            if created:
+                print(f"Created scalar indexes on {', '.join(created)} for user {user_id}")
+        except Exception as e:
+            print(f"Error creating scalar indexes for user {user_id}: {e}")
+        try:
+            compact_after_ingestion(table, user_id)
+        except Exception as e:
+            print(f"Error compacting table for user {user_id}: {e}")
+    return kept + stored
+
+def parse_document_event(record: Dict[str, Any]) -> Optional[Tuple[str, str]]:
+    """Return (event type, document path) from an SQS record, or None if there is nothing to process"""
+    # Extract the SNS message from the SQS body
+    sqs_body = json.loads(record['body'])
+    sns_message = json.loads(sqs_body['Message'])
+    print(f"SNS message: {json.dumps(sns_message)}")
+
+    # Only process DOCUMENT_UPLOADED and DOCUMENT_DELETED events
+    event_type = sns_message.get('eventType')
+    if event_type not in ('DOCUMENT_UPLOADED', 'DOCUMENT_DELETED'):
+        print(f"Skipping unsupported event: {event_type}")
+        return None
+
+    document_path = sns_message.get('documentPath')
+    if not document_path:
+        print("No document path in message")
+        return None
+    return event_type, document_path
+
+def remove_document(document_path: str) -> int:
+    """Drop the embeddings of a document the user removed"""
+    user_id = get_user_id_from_key(document_path)
+    table = open_document_table(connect_to_user_db(user_id))
+    if table is None:
+        return 0
+    with metrics.timer('LanceDBDelete'):
+        removed = delete_document_rows(table, document_path)
+    print(f"Removed {removed} chunks of deleted document {document_path} for user {user_id}")
+    return removed
+
+def embed_document_file(
+    source_bucket: str,
+    document_path: str,
+    table_name: str = TABLE_NAME,
+    new_table_profile: EmbeddingProfile = EMBEDDING_PROFILE,
+    splitter=None,
+    uploaded_at: Optional[datetime] = None
+) -> Optional[int]:
+    """Download, extract, chunk and embed a PDF into the user's table, returns the chunks stored or None without pages"""
+    # Stream the file to local disk, PdfReader then loads pages on demand
+    print(f"Downloading file: {document_path} from bucket: {source_bucket}")
+    with tempfile.NamedTemporaryFile(suffix='.pdf') as pdf_file:
+        with metrics.timer('S3Download'):
+            get_s3_client().download_fileobj(source_bucket, document_path, pdf_file)
+        metrics.size('DocumentBytes', pdf_file.tell())
+        pdf_file.flush()
+        pdf_file.seek(0)
+        from PyPDF2 import PdfReader
+        pdf_reader = PdfReader(pdf_file)
+        metrics.count('PdfPages', len(pdf_reader.pages))
+        if len(pdf_reader.pages) == 0:
+            return None
+
+        # Pages are extracted, chunked, embedded and written batch by batch
+        chunks = iter_chunks(iter_document_pages(pdf_file.name, pdf_reader), splitter)
+        return store_document_embeddings(source_bucket, document_path, chunks, table_name, new_table_profile, uploaded_at)
+
+def process_document(source_bucket: str, document_path: str) -> None:
     try:
-        # Try to get existing table
-        table = db.open_table(table_name)
-        vectorstore = LanceDB(
-            connection=table,  # Pass the table instead of connection
-            embedding=embeddings,
-        )
-        # Add to existing table
-        vectorstore.add_texts(texts=chunks, metadatas=metadatas)
-    except:
-        # If table doesn't exist, create new one
-        vectorstore = LanceDB.from_texts(
-            texts=chunks,
-            embedding=embeddings,
-            connection=db,  # Pass the db connection for new table creation
-            table_name=table_name,
-            metadatas=metadatas
-        )
-    
-    print(f"Stored {len(chunks)} embeddings for user {user_id} in table: {table_name}")
-    return vectorstore
+        # Check if file exists in S3 before processing
+        try:
+            get_s3_client().head_object(Bucket=source_bucket, Key=document_path)
+        except get_s3_client().exceptions.ClientError as e:
+            if e.response['Error']['Code'] == '404':
+                print(f"File {document_path} no longer exists in S3, skipping processing")
+                remove_document(document_path)
+                return
+            else:
+                raise e
+
+        if not is_pdf(document_path):
+            print(f"File {document_path} is not a PDF file, skipping")
+            # Update status to 'error' for non-PDF files
+            update_document_status(document_path, 'error')
+            return
+
+        stored = embed_document_file(source_bucket, document_path)
+        if stored is None:
+            print(f"PDF {document_path} has no pages")
+            # Update status to 'error' for empty PDFs
+            update_document_status(document_path, 'error')
+        elif stored:
+            print(f"Created {stored} chunks from PDF {document_path}")
+            # Update document status to 'processed'
+            update_document_status(document_path, 'processed')
+        else:
+            print("No chunks were created (empty document)")
+            # Update status to 'error' for empty documents
+            update_document_status(document_path, 'error')
+
+    except Exception as e:
+        print(f"Error processing {document_path}: {e}")
+        # Update status to 'error' on exception
+        try:
+            update_document_status(document_path, 'error')
+        except Exception as update_error:
+            print(f"Failed to update document status: {update_error}")
+        raise e
+
+def process_user_documents(
+    source_bucket: str,
+    documents: List[Tuple[str, str, str]],
+    out_of_time: Callable[[], bool] = lambda: False
+) -> Tuple[List[str], List[Tuple[str, str, str]]]:
+    """
+    Process one user's document events in order. Returns the message IDs that failed and the
+    documents not started because the invocation is close to its timeout.
+    Documents of the same user share a LanceDB table, so they are never written concurrently.
+    """
+    failed_message_ids = []
+    for position, (message_id, event_type, document_path) in enumerate(documents):
+        if out_of_time():
+            return failed_message_ids, documents[position:]
+        try:
+            if event_type == 'DOCUMENT_DELETED':
+                remove_document(document_path)
+            else:
+                process_document(source_bucket, document_path)
+        except Exception as e:
+            print(f"Error processing record {message_id}: {e}")
+            failed_message_ids.append(message_id)
+    return failed_message_ids, []
+
+def defer_documents(documents: List[Tuple[str, str, str]], records_by_id: Dict[str, Dict[str, Any]]) -> List[str]:
+    """Send deferred upload events back to the queue with a delay, returns the message IDs that could not be deferred"""
+    failed_message_ids = []
+    for message_id, _, document_path in documents:
+        record = records_by_id[message_id]
+        delay = deferral_delay(get_deferrals(record), DEFERRAL_BASE_SECONDS, DEFERRAL_MAX_SECONDS)
+        try:
+            defer_record(get_sqs_client(), record, delay)
+            print(f"Deferred {document_path} by {delay}s")
+        except Exception as e:
+            # Left on the queue, it comes back after the visibility timeout
+            print(f"Error deferring record {message_id}: {e}")
+            failed_message_ids.append(message_id)
+    metrics.count('DeferredRecords', len(documents) - len(failed_message_ids))
+    return failed_message_ids
+
+def schedule_user_documents(
+    documents_by_user: Dict[str, List[Tuple[str, str, str]]],
+    owner: str
+) -> Tuple[Dict[str, List[Tuple[str, str, str]]], Dict[str, int], List[Tuple[str, str, str]]]:
+    """
+    Decide what this invocation processes so one user's bulk upload cannot hold up the others.
+    Returns the documents to process per user (fewest first), the ingestion slots taken and
+    the deferred documents. The scheduler is work-conserving: a user gets at most
+    USER_BATCH_QUOTA uploads only when other users share the batch or another invocation
+    already holds one of the user's slots, otherwise the whole batch is processed. A user
+    gets no uploads when all of their USER_MAX_IN_FLIGHT slots are held by other invocations.
+    """
+    scheduled: Dict[str, List[Tuple[str, str, str]]] = {}
+    slots: Dict[str, int] = {}
+    deferred: List[Tuple[str, str, str]] = []
+    shared_batch = len(documents_by_user) > 1
+    for user_id in order_users(documents_by_user):
+        documents = documents_by_user[user_id]
+        slot = None
+        busy = False
+        if INGESTION_SLOTS_TABLE_NAME and any(document[1] != 'DOCUMENT_DELETED' for document in documents):
+            try:
+                slot = acquire_user_slot(
+                    get_dynamodb_client(), INGESTION_SLOTS_TABLE_NAME, user_id, owner,
+                    USER_MAX_IN_FLIGHT, INGESTION_SLOT_LEASE_SECONDS
+                )
+            except Exception as e:
+                # Scheduling must not stop ingestion, process the user without a slot
+                print(f"Error acquiring ingestion slot for user {user_id}: {e}")
+            else:
+                if slot is None:
+                    busy = True
+                    metrics.count('UserSlotsBusy')
+                    print(f"All {USER_MAX_IN_FLIGHT} ingestion slots of user {user_id} are busy")
+                else:
+                    slots[user_id] = slot
+        # Slots are taken lowest first, a later one means another invocation works on the user
+        contended = shared_batch or (slot is not None and slot > 0)
+        now, later = split_user_documents(documents, USER_BATCH_QUOTA if contended else len(documents))
+        if busy:
+            later = [document for document in now if document[1] != 'DOCUMENT_DELETED'] + later
+            now = [document for document in now if document[1] == 'DOCUMENT_DELETED']
+        if now:
+            scheduled[user_id] = now
+        deferred.extend(later)
+    return scheduled, slots, deferred
+
+def release_user_slots(slots: Dict[str, int], owner: str) -> None:
+    for user_id, slot in slots.items():
+        try:
+            release_user_slot(get_dynamodb_client(), INGESTION_SLOTS_TABLE_NAME, user_id, slot, owner)
+        except Exception as e:
+            # The lease expires on its own
+            print(f"Error releasing ingestion slot {slot} of user {user_id}: {e}")
 
 def handler(event, context):
     print(f"Function: {context.function_name}, RequestId: {context.aws_request_id}")
-    
+    metrics.start(context.aws_request_id, functionName=context.function_name)
+    try:
+        return process_records(
+            event,
+            out_of_time=lambda: context.get_remaining_time_in_millis() < PROCESSING_TIME_MARGIN_SECONDS * 1000
+        )
+    finally:
+        metrics.flush()
+
+def process_records(event, out_of_time: Callable[[], bool] = lambda: False) -> Dict[str, Any]:
+    # Extract bucket names from the environment
+    source_bucket = os.environ.get('SOURCE_BUCKET_NAME')
+    if not source_bucket:
+        raise ValueError("SOURCE_BUCKET_NAME environment variable not set")
+
+    failed_message_ids = []
+    documents_by_user: Dict[str, List[Tuple[str, str, str]]] = {}
+    records_by_id: Dict[str, Dict[str, Any]] = {}
     for record in event['Records']:
         # Parse the SQS message which contains the SNS message
         try:
-            # Extract the SNS message from the SQS body
-            sqs_body = json.loads(record['body'])
-            sns_message = json.loads(sqs_body['Message'])
-            print(f"SNS message: {json.dumps(sns_message)}")
-            
-            # Only process DOCUMENT_UPLOADED events
-            if sns_message.get('eventType') != 'DOCUMENT_UPLOADED':
-                print(f"Skipping non-upload event: {sns_message.get('eventType')}")
-                continue
-                
-            document_path = sns_message.get('documentPath')
-            if not document_path:
-                print("No document path in message")
-                continue
-                
-            # Extract bucket names from the environment
-            source_bucket = os.environ.get('SOURCE_BUCKET_NAME')
-            if not source_bucket:
-                raise ValueError("SOURCE_BUCKET_NAME environment variable not set")
-                
-            try:
-                # Check if file exists in S3 before processing
-                try:
-                    s3_client.head_object(Bucket=source_bucket, Key=document_path)
-                except s3_client.exceptions.ClientError as e:
-                    if e.response['Error']['Code'] == '404':
-                        print(f"File {document_path} no longer exists in S3, skipping processing")
-                        continue  # Skip this message and move to next one
-                    else:
-                        raise e
-
-                if not is_pdf(document_path):
-                    print(f"File {document_path} is not a PDF file, skipping")
-                    # Update status to 'error' for non-PDF files
-                    update_document_status(document_path, 'error')
-                    continue
-
-                # Download the file to memory
-                print(f"Downloading file: {document_path} from bucket: {source_bucket}")
-                response = s3_client.get_object(Bucket=source_bucket, Key=document_path)
-                file_content = response['Body'].read()
-
-                # Read PDF content
-                pdf_file = io.BytesIO(file_content)
-                pdf_reader = PdfReader(pdf_file)
-                
-                if len(pdf_reader.pages) > 0:
-                    # Extract text from all pages
-                    text = extract_text_from_pdf(pdf_reader)
-                    
-                    # Split text into chunks
-                    chunks = create_chunks(text)
-                    print(f"Created {len(chunks)} chunks from PDF {document_path}")
-                    
-                    if chunks:
-                        # Store document chunks with embeddings
-                        vectorstore = store_document_embeddings(source_bucket, document_path, chunks)
-                        
-                        # Update document status to 'processed'
-                        update_document_status(document_path, 'processed')
-                    else:
-                        print("No chunks were created (empty document)")
-                        # Update status to 'error' for empty documents
-                        update_document_status(document_path, 'error')
-                else:
-                    print(f"PDF {document_path} has no pages")
-                    # Update status to 'error' for empty PDFs
-                    update_document_status(document_path, 'error')
-                
-            except Exception as e:
-                print(f"Error processing {document_path}: {e}")
-                # Update status to 'error' on exception
-                try:
-                    update_document_status(document_path, 'error')
-                except Exception as update_error:
-                    print(f"Failed to update document status: {update_error}")
-                # Let the message go to DLQ after max retries
-                raise e
-                
+            document_event = parse_document_event(record)
         except json.JSONDecodeError as e:
             print(f"Error parsing message: {e}")
             continue  # Skip malformed messages
         except Exception as e:
             print(f"Error processing record: {e}")
-            raise e  # Let the message go to DLQ after max retries
\ No newline at end of file
+            failed_message_ids.append(record['messageId'])
+            continue
+        if not document_event:
+            continue
+
+        event_type, document_path = document_event
+        try:
+            user_id = get_user_id_from_key(document_path)
+        except ValueError as e:
+            print(f"Error processing record: {e}")
+            failed_message_ids.append(record['messageId'])
+            continue
+        documents_by_user.setdefault(user_id, []).append((record['messageId'], event_type, document_path))
+        records_by_id[record['messageId']] = record
+
+    owner = str(uuid.uuid4())
+    scheduled, slots, deferred = schedule_user_documents(documents_by_user, owner)
+    if deferred:
+        failed_message_ids.extend(defer_documents(deferred, records_by_id))
+
+    # Different users are processed concurrently, each user's documents sequentially,
+    # users with the fewest documents are started first
+    unstarted: List[Tuple[str, str, str]] = []
+    try:
+        if scheduled:
+            workers = min(DOCUMENT_CONCURRENCY, len(scheduled))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for failed, not_started in executor.map(
+                    lambda documents: process_user_documents(source_bucket, documents, out_of_time),
+                    scheduled.values()
+                ):
+                    failed_message_ids.extend(failed)
+                    unstarted.extend(not_started)
+    finally:
+        release_user_slots(slots, owner)
+    # Sent back to the queue like deferred uploads, a timeout would redeliver the whole batch
+    if unstarted:
+        print(f"Close to the timeout, deferring {len(unstarted)} documents not started")
+        metrics.count('DeadlineDeferredRecords', len(unstarted))
+        failed_message_ids.extend(defer_documents(unstarted, records_by_id))
+
+    # Only failed messages are returned to the queue and retried (then sent to the DLQ)
+    metrics.count('Records', len(event['Records']))
+    metrics.count('FailedRecords', len(failed_message_ids))
+    print(f"Processed {len(event['Records'])} records, {len(failed_message_ids)} failed")
+    return {
+        "batchItemFailures": [{"itemIdentifier": message_id} for message_id in failed_message_ids]
+    }
+
+def list_user_ids(bucket: Optional[str] = None, prefix: str = 'embeddings/') -> List[str]:
+    """User IDs that have a folder under `prefix`, by default an embeddings folder in the embeddings bucket"""
+    user_ids = []
+    paginator = get_s3_client().get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket or get_embeddings_bucket(), Prefix=prefix, Delimiter='/'):
+        for prefix in page.get('CommonPrefixes', []):
+            user_ids.append(prefix['Prefix'].split('/')[1])
+    return user_ids
+
+def compact_user_table(user_id: str, force: bool) -> Dict[str, Any]:
+    try:
+        table = connect_to_user_db(user_id).open_table(TABLE_NAME)
+    except Exception as e:
+        return {'userId': user_id, 'status': 'skipped', 'reason': str(e)}
+
+    try:
+        if force:
+            with metrics.timer('Compaction'):
+                report = compact_table(table, COMPACTION_CLEANUP_OLDER_THAN)
+        else:
+            report = compact_if_fragmented(table, user_id)
+        if report is None:
+            return {'userId': user_id, 'status': 'not_needed'}
+        return {'userId': user_id, 'status': 'compacted', **report}
+    except Exception as e:
+        print(f"Error compacting table for user {user_id}: {e}")
+        return {'userId': user_id, 'status': 'error', 'reason': str(e)}
+
+def compaction_handler(event, context):
+    """
+    Scheduled maintenance: compact fragmented per-user tables and prune old versions.
+    The event may name specific users ({"userIds": [...]}) and force compaction ({"force": true}).
+    """
+    print(f"Function: {context.function_name}, RequestId: {context.aws_request_id}")
+    metrics.start(context.aws_request_id, functionName=context.function_name)
+    event = event or {}
+    try:
+        user_ids = event.get('userIds') or list_user_ids()
+        force = bool(event.get('force', False))
+        print(f"Checking {len(user_ids)} user tables for compaction")
+
+        with ThreadPoolExecutor(max_workers=max(1, min(DOCUMENT_CONCURRENCY, len(user_ids)))) as executor:
+            reports = list(executor.map(lambda user_id: compact_user_table(user_id, force), user_ids))
+
+        for report in reports:
+            print(json.dumps(report))
+        compacted = sum(1 for report in reports if report['status'] == 'compacted')
+        metrics.count('TablesChecked', len(reports))
+        metrics.count('TablesCompacted', compacted)
+        print(f"Compacted {compacted} of {len(reports)} user tables")
+        return {'reports': reports}
+    finally:
+        metrics.flush()
+
+def list_source_documents(source_bucket: str, user_id: str) -> Dict[str, datetime]:
+    """The user's PDFs in the source bucket with their last-modified times"""
+    documents = {}
+    paginator = get_s3_client().get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=source_bucket, Prefix=f"{SOURCE_DOCUMENTS_PREFIX}{user_id}/"):
+        for item in page.get('Contents', []):
+            if is_pdf(item['Key']):
+                documents[item['Key']] = item['LastModified']
+    return documents
+
+def backfill_options(event: Dict[str, Any]) -> Dict[str, Any]:
+    """Embedding profile and chunking of a backfill run, kept in every user's checkpoint"""
+    profile = EmbeddingProfile(**event['embeddingProfile']) if event.get('embeddingProfile') else EMBEDDING_PROFILE
+    if profile.dimension not in TITAN_V2_DIMENSIONS:
+        raise ValueError(f"dimension must be one of {TITAN_V2_DIMENSIONS}, got {profile.dimension}")
+    return {
+        'embeddingProfile': profile.to_dict(),
+        'chunkSize': int(event.get('chunkSize', CHUNK_SIZE)),
+        'chunkOverlap': int(event.get('chunkOverlap', CHUNK_OVERLAP)),
+    }
+
+def embed_backfill_document(source_bucket: str, document_key: str, table_name: str, options: Dict[str, Any],
+                            uploaded_at: datetime) -> bool:
+    """
+    Embed one document into the staging table, False if it failed and has to be retried.
+    Rows keep the document's upload time (its LastModified in the source bucket) so upload
+    date filters still hold after the switch-over. A document removed from the source bucket
+    in the meantime is not a failure, deletions are reconciled at the switch-over.
+    """
+    try:
+        embed_document_file(
+            source_bucket,
+            document_key,
+            table_name,
+            EmbeddingProfile(**options['embeddingProfile']),
+            get_text_splitter(options['chunkSize'], options['chunkOverlap']),
+            uploaded_at
+        )
+        metrics.count('BackfillDocuments')
+        return True
+    except Exception as e:
+        if isinstance(e, get_s3_client().exceptions.ClientError) and e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+            print(f"Skipping {document_key}, it was deleted from the source bucket")
+            return True
+        print(f"Error backfilling {document_key}: {e}")
+        metrics.count('BackfillDocumentErrors')
+        return False
+
+def embed_backfill_documents(source_bucket: str, document_keys: Iterable[str], table_name: str,
+                             checkpoint: Dict[str, Any], uploaded: Dict[str, datetime],
+                             out_of_time: Callable[[], bool],
+                             on_document: Optional[Callable[[str], None]] = None) -> bool:
+    """
+    Embed documents into the staging table, keeping the checkpoint's failedDocuments up to date.
+    `uploaded` is the current listing of the user's source documents with their upload times.
+    No document is started once `out_of_time`, returns False when stopped early. `on_document`
+    is called after each document, e.g. to checkpoint.
+    """
+    failed = checkpoint.setdefault('failedDocuments', [])
+    for document_key in document_keys:
+        if out_of_time():
+            return False
+        if document_key not in uploaded:
+            print(f"Skipping {document_key}, it was deleted from the source bucket")
+            succeeded = True
+        else:
+            succeeded = embed_backfill_document(
+                source_bucket, document_key, table_name, checkpoint['options'], uploaded[document_key]
+            )
+        if succeeded and document_key in failed:
+            failed.remove(document_key)
+        elif not succeeded and document_key not in failed:
+            failed.append(document_key)
+        if on_document:
+            on_document(document_key)
+    return True
+
+def hold_user_slots(user_id: str, owner: str, out_of_time: Callable[[], bool]) -> Optional[List[int]]:
+    """
+    Take all of the user's ingestion slots so no upload is written to the live table during the
+    switch-over, waiting for running invocations to finish. None if they are still busy at the deadline.
+    """
+    held: List[int] = []
+    while True:
+        slot = acquire_user_slot(
+            get_dynamodb_client(), INGESTION_SLOTS_TABLE_NAME, user_id, owner,
+            USER_MAX_IN_FLIGHT, INGESTION_SLOT_LEASE_SECONDS
+        )
+        if slot is not None:
+            held.append(slot)
+            if len(held) == USER_MAX_IN_FLIGHT:
+                return held
+        elif out_of_time():
+            for slot in held:
+                release_user_slot(get_dynamodb_client(), INGESTION_SLOTS_TABLE_NAME, user_id, slot, owner)
+            return None
+        else:
+            time.sleep(5)
+
+def remove_deleted_sources(table, current: Dict[str, datetime]) -> int:
+    """Drop the rows of documents that are no longer in the source bucket, returns how many documents"""
+    sources = set()
+    for batch in table.search().select(['source']).limit(None).to_batches(10000):
+        sources.update(batch.column(0).to_pylist())
+    removed = [source for source in sources if source not in current]
+    for source in removed:
+        delete_document_rows(table, source)
+    return len(removed)
+
+def switch_over(user_id: str, source_bucket: str, checkpoint: Dict[str, Any],
+                out_of_time: Callable[[], bool]) -> Dict[str, Any]:
+    """
+    Catch the staging table up with the source bucket, then make it the user's live table in one
+    commit: the live table is overwritten with the staging rows as a new version, so readers move
+    over on their next version check and the previous version can still be restored.
+    The live table is left untouched when a document could not be caught up (status "failed")
+    or the invocation ran out of time doing so (status "incomplete").
+    """
+    from table_schema import scan_batches
+
+    staging_name = staging_table_name(TABLE_NAME, checkpoint['version'])
+    planned_at = datetime.fromisoformat(checkpoint['plannedAt'])
+    planned = {key for shard in checkpoint['shards'] for key in shard}
+    # Listed with all of the user's ingestion slots held, no upload is written to the live table meanwhile
+    current = list_source_documents(source_bucket, user_id)
+
+    # Documents uploaded or replaced since the plan was made
+    changed = [
+        document_key for document_key, last_modified in current.items()
+        if document_key not in planned or last_modified > planned_at
+    ]
+    if not embed_backfill_documents(source_bucket, changed, staging_name, checkpoint, current, out_of_time):
+        return {'status': 'incomplete'}
+    if checkpoint['failedDocuments']:
+        return {'status': 'failed', 'failedDocuments': checkpoint['failedDocuments']}
+
+    db = connect_to_user_db(user_id)
+    staging = open_document_table(db, staging_name)
+    if staging is None:
+        return {'status': 'switched', 'rows': 0, 'removedDocuments': 0}
+    # Deletes are processed without an ingestion slot, so the bucket is listed again right
+    # before the overwrite, and once more after it for a delete that landed in between
+    removed = remove_deleted_sources(staging, list_source_documents(source_bucket, user_id))
+
+    with metrics.timer('BackfillSwitchOver'):
+        live = db.create_table(TABLE_NAME, data=scan_batches(staging), schema=staging.schema, mode="overwrite")
+    removed += remove_deleted_sources(live, list_source_documents(source_bucket, user_id))
+    rebuild_indexes(live, TABLE_NAME)
+    rows = live.count_rows()
+    db.drop_table(staging_name)
+    return {'status': 'switched', 'rows': rows, 'removedDocuments': removed}
+
+def backfill_user(user_id: str, source_bucket: str, version: str, options: Dict[str, Any],
+                  shard_size: int, out_of_time: Callable[[], bool]) -> Dict[str, Any]:
+    """Run the user's pending shards into the staging table, then switch over. Resumes from the checkpoint"""
+    embeddings_bucket = get_embeddings_bucket()
+    checkpoint = load_checkpoint(get_s3_client(), embeddings_bucket, version, user_id)
+    if checkpoint is not None and checkpoint['switchedAt']:
+        return {'userId': user_id, 'shards': len(checkpoint['shards']), 'status': 'done'}
+    # Upload times of the user's documents, also tells which planned documents were deleted since
+    uploaded = list_source_documents(source_bucket, user_id)
+    if checkpoint is None:
+        documents = list(uploaded)
+        checkpoint = new_checkpoint(version, user_id, plan_shards(documents, shard_size), options)
+        save_checkpoint(get_s3_client(), embeddings_bucket, checkpoint)
+        print(f"Planned {len(checkpoint['shards'])} shards for {len(documents)} documents of user {user_id}")
+
+    report = {'userId': user_id, 'shards': len(checkpoint['shards'])}
+    if checkpoint['options'] != options:
+        print(f"Backfill {version} of user {user_id} continues with its original options {json.dumps(checkpoint['options'])}")
+
+    staging_name = staging_table_name(TABLE_NAME, version)
+    incomplete = {**report, 'status': 'incomplete'}
+
+    def document_done(document_key: str) -> None:
+        # A document interrupted before this point is redone, re-embedding replaces its rows
+        checkpoint['currentShard']['completedDocuments'].append(document_key)
+        save_checkpoint(get_s3_client(), embeddings_bucket, checkpoint)
+
+    for number in pending_shards(checkpoint):
+        current_shard = checkpoint.get('currentShard') or {}
+        done = current_shard.get('completedDocuments', []) if current_shard.get('number') == number else []
+        checkpoint['currentShard'] = {'number': number, 'completedDocuments': list(done)}
+        remaining = [document_key for document_key in checkpoint['shards'][number] if document_key not in done]
+        with metrics.timer('BackfillShard'):
+            finished = embed_backfill_documents(
+                source_bucket, remaining, staging_name, checkpoint, uploaded, out_of_time, document_done
+            )
+        if not finished:
+            return {**incomplete, 'completedShards': len(checkpoint['completedShards'])}
+        checkpoint['completedShards'].append(number)
+        checkpoint['currentShard'] = None
+        save_checkpoint(get_s3_client(), embeddings_bucket, checkpoint)
+        metrics.count('BackfillShards')
+        print(f"Backfill {version} of user {user_id}: shard {number + 1}/{len(checkpoint['shards'])} done")
+
+    # Documents that failed in earlier shards or runs get another attempt, the live table must
+    # not be replaced by a staging table that lacks them
+    if checkpoint.get('failedDocuments'):
+        finished = embed_backfill_documents(
+            source_bucket, list(checkpoint['failedDocuments']), staging_name, checkpoint, uploaded, out_of_time
+        )
+        save_checkpoint(get_s3_client(), embeddings_bucket, checkpoint)
+        if not finished:
+            return {**incomplete, 'completedShards': len(checkpoint['completedShards'])}
+        if checkpoint['failedDocuments']:
+            return {**report, 'status': 'failed', 'failedDocuments': checkpoint['failedDocuments']}
+
+    owner = str(uuid.uuid4())
+    slots = hold_user_slots(user_id, owner, out_of_time) if INGESTION_SLOTS_TABLE_NAME else []
+    if slots is None:
+        return {**incomplete, 'completedShards': len(checkpoint['completedShards'])}
+    try:
+        switched = switch_over(user_id, source_bucket, checkpoint, out_of_time)
+    finally:
+        for slot in slots:
+            release_user_slot(get_dynamodb_client(), INGESTION_SLOTS_TABLE_NAME, user_id, slot, owner)
+    if switched['status'] != 'switched':
+        save_checkpoint(get_s3_client(), embeddings_bucket, checkpoint)
+        print(f"Not switching user {user_id} yet: {json.dumps(switched)}")
+        return {**report, **switched}
+    checkpoint['switchedAt'] = datetime.now(timezone.utc).isoformat()
+    save_checkpoint(get_s3_client(), embeddings_bucket, checkpoint)
+    metrics.count('BackfillUsersSwitched')
+    print(f"Switched user {user_id} to backfill {version}: {json.dumps(switched)}")
+    return {**report, **switched}
+
+def continue_backfill(event: Dict[str, Any], context, user_ids: List[str]) -> None:
+    """Hand the unfinished users to a new invocation of this function"""
+    get_shared('lambda', lambda: boto3.client('lambda')).invoke(
+        FunctionName=context.function_name,
+        InvocationType='Event',
+        Payload=json.dumps({**event, 'userIds': user_ids}).encode('utf-8')
+    )
+
+def backfill_handler(event, context):
+    """
+    Re-embed the whole corpus, e.g. after changing the embedding profile or chunking, without
+    re-uploading documents. Event: {"version": "v2", "userIds": [...], "embeddingProfile":
+    {"dimension": 256, "storage": "binary", "rerank_factor": 4}, "chunkSize": 1000,
+    "chunkOverlap": 200, "shardSize": 20}, only the version is required.
+
+    Each user's documents are planned into shards and embedded into a versioned staging table,
+    with a checkpoint in the embeddings bucket after every shard. When all shards of a user are
+    done, and every document of the user was embedded, the staging table replaces the live one
+    in a single commit. A user with failed documents keeps the live table and reports them
+    (status "failed"), they are retried by the next run. Users run in parallel, an
+    invocation that runs out of time passes the unfinished users on to a new one, and invoking
+    again with the same version resumes from the checkpoints.
+    """
+    print(f"Function: {context.function_name}, RequestId: {context.aws_request_id}")
+    metrics.start(context.aws_request_id, functionName=context.function_name)
+    event = event or {}
+    try:
+        version = event.get('version')
+        if not version:
+            raise ValueError("A backfill needs a version, e.g. {\"version\": \"v2\"}")
+        staging_table_name(TABLE_NAME, version)
+        source_bucket = os.environ.get('SOURCE_BUCKET_NAME')
+        if not source_bucket:
+            raise ValueError("SOURCE_BUCKET_NAME environment variable not set")
+        options = backfill_options(event)
+        shard_size = int(event.get('shardSize', BACKFILL_SHARD_SIZE))
+        user_ids = event.get('userIds') or list_user_ids(source_bucket, SOURCE_DOCUMENTS_PREFIX)
+        print(f"Backfill {version} of {len(user_ids)} users with {json.dumps(options)}")
+
+        def out_of_time() -> bool:
+            return context.get_remaining_time_in_millis() < BACKFILL_TIME_MARGIN_SECONDS * 1000
+
+        def run(user_id: str) -> Dict[str, Any]:
+            try:
+                return backfill_user(user_id, source_bucket, version, options, shard_size, out_of_time)
+            except Exception as e:
+                print(f"Error backfilling user {user_id}: {e}")
+                return {'userId': user_id, 'status': 'error', 'reason': str(e)}
+
+        with ThreadPoolExecutor(max_workers=max(1, min(BACKFILL_CONCURRENCY, len(user_ids)))) as executor:
+            reports = list(executor.map(run, user_ids))
+
+        for report in reports:
+            print(json.dumps(report))
+        # Users that failed are left to a later run, their checkpoints keep the finished shards
+        # and the documents to retry
+        unfinished = [report['userId'] for report in reports if report['status'] == 'incomplete']
+        if unfinished and event.get('continue', True):
+            continue_backfill(event, context, unfinished)
+            print(f"Continuing backfill {version} of {len(unfinished)} users in a new invocation")
+        return {'version': version, 'reports': reports, 'continued': unfinished}
+    finally:
+        metrics.flush()
@@ -0,0 +1,112 @@
+import multiprocessing
+import os
+from collections import deque
+from typing import Iterator, List, Tuple
+
+from PyPDF2 import PdfReader
+
+MIN_PAGES_PER_TASK = 16
+
+# Lambda has no /dev/shm, so multiprocessing.Pool and ProcessPoolExecutor fail there.
+# Workers are plain Processes that hand their results back over a Pipe instead.
+# The handler processes several documents on threads, so workers are forked from a
+# single-threaded fork server rather than from the (multi-threaded) handler process.
+mp_context = multiprocessing.get_context('forkserver')
+mp_context.set_forkserver_preload(['parallel_extraction'])
+
+def get_cpu_count() -> int:
+    """CPUs this process may run on, which can be fewer than the machine has"""
+    try:
+        return max(len(os.sched_getaffinity(0)), 1)
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def get_worker_count(requested: int = 0) -> int:
+    """requested <= 0 means one worker per available CPU"""
+    if requested > 0:
+        return requested
+    return get_cpu_count()
+
+def get_pages_per_task(num_pages: int, workers: int, requested: int = 0) -> int:
+    """
+    requested <= 0 picks about four ranges per worker. Every range re-parses
+    the PDF cross-reference table, so ranges should not be too small.
+    """
+    if requested > 0:
+        return requested
+    return max(MIN_PAGES_PER_TASK, -(-num_pages // (workers * 4)))
+
+def uses_workers(num_pages: int, pages_per_task: int) -> bool:
+    """Worker processes only pay off with at least two CPUs and more than one page range"""
+    return get_cpu_count() >= 2 and num_pages > pages_per_task
+
+def split_page_ranges(num_pages: int, pages_per_task: int) -> List[Tuple[int, int]]:
+    """Split [0, num_pages) into contiguous (start, end) ranges"""
+    return [(start, min(start + pages_per_task, num_pages)) for start in range(0, num_pages, pages_per_task)]
+
+def _extract_page_range(pdf_path: str, start: int, end: int, conn) -> None:
+    try:
+        reader = PdfReader(pdf_path)
+        texts = [reader.pages[i].extract_text() or "" for i in range(start, end)]
+        conn.send((True, texts))
+    except Exception as e:
+        conn.send((False, f"{type(e).__name__}: {e}"))
+    finally:
+        conn.close()
+
+def _start_worker(pdf_path: str, page_range: Tuple[int, int]):
+    parent_conn, child_conn = mp_context.Pipe(duplex=False)
+    process = mp_context.Process(
+        target=_extract_page_range,
+        args=(pdf_path, page_range[0], page_range[1], child_conn),
+        daemon=True
+    )
+    process.start()
+    child_conn.close()
+    return page_range, process, parent_conn
+
+def iter_pdf_pages_parallel(pdf_path: str, num_pages: int, workers: int = 0, pages_per_task: int = 0) -> Iterator[Tuple[int, str]]:
+    """
+    Extract pages across worker processes, yielding (page_number, text) in page order.
+    Falls back to extracting in this process when uses_workers is false.
+
+    At most `workers` page ranges are in flight. Ranges are collected strictly
+    in order, so output is deterministic and downstream chunking can start as
+    soon as the first range is done.
+    """
+    workers = get_worker_count(workers)
+    pages_per_task = get_pages_per_task(num_pages, workers, pages_per_task)
+    if not uses_workers(num_pages, pages_per_task):
+        # A single CPU or a single range, starting processes would only add their overhead
+        reader = PdfReader(pdf_path)
+        for page_number in range(num_pages):
+            yield page_number + 1, reader.pages[page_number].extract_text() or ""
+        return
+    ranges = deque(split_page_ranges(num_pages, pages_per_task))
+    in_flight = deque()
+
+    try:
+        while ranges or in_flight:
+            while ranges and len(in_flight) < workers:
+                in_flight.append(_start_worker(pdf_path, ranges.popleft()))
+
+            (start, end), process, conn = in_flight.popleft()
+            try:
+                ok, payload = conn.recv()
+            except EOFError:
+                ok, payload = False, f"worker exited with code {process.exitcode}"
+            finally:
+                conn.close()
+                process.join()
+
+            if not ok:
+                raise RuntimeError(f"Failed to extract pages {start + 1}-{end} from {pdf_path}: {payload}")
+
+            for offset, text in enumerate(payload):
+                yield start + offset + 1, text
+    finally:
+        # Abandoned generator or failure: do not leave workers behind
+        for _, process, conn in in_flight:
+            conn.close()
+            process.terminate()
+            process.join()
@@ -0,0 +1,71 @@
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+def count_prunable_versions(versions: List[Dict[str, Any]], cleanup_older_than: timedelta) -> int:
+    """Versions a cleanup would remove: all but the latest that are older than `cleanup_older_than`"""
+    if not versions:
+        return 0
+    latest = max(version['version'] for version in versions)
+    count = 0
+    for version in versions:
+        timestamp = version['timestamp']
+        if version['version'] != latest and timestamp < datetime.now(timestamp.tzinfo) - cleanup_older_than:
+            count += 1
+    return count
+
+def get_table_layout(table, cleanup_older_than: timedelta) -> Dict[str, int]:
+    """Fragment and version counts of a table, the numbers compaction is meant to bring down"""
+    stats = table.stats()
+    fragment_stats = stats.get('fragment_stats', {})
+    versions = table.list_versions()
+    return {
+        'num_rows': stats.get('num_rows', 0),
+        'num_fragments': fragment_stats.get('num_fragments', 0),
+        'num_small_fragments': fragment_stats.get('num_small_fragments', 0),
+        'num_versions': len(versions),
+        'num_prunable_versions': count_prunable_versions(versions, cleanup_older_than),
+        'total_bytes': stats.get('total_bytes', 0),
+    }
+
+def needs_compaction(layout: Dict[str, int], min_small_fragments: int, max_versions: int) -> bool:
+    """
+    Versions younger than the cleanup window survive a compaction, so only prunable ones count:
+    otherwise a burst of appends would trigger a compaction on every append for the whole window.
+    """
+    return layout['num_small_fragments'] >= min_small_fragments or layout['num_prunable_versions'] >= max_versions
+
+def measure_query_latency(table, num_queries: int = 5, top_k: int = 3) -> Optional[float]:
+    """Median latency in milliseconds of vector searches that use rows of the table as queries"""
+    probes = table.search().select(['vector']).limit(num_queries).to_arrow()
+    if probes.num_rows == 0:
+        return None
+    latencies = []
+    for vector in probes.column('vector').to_pylist():
+        start = time.perf_counter()
+        table.search(vector, vector_column_name='vector').limit(top_k).select(['text']).to_arrow()
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return round(latencies[len(latencies) // 2], 2)
+
+def compact_table(table, cleanup_older_than: timedelta, measure_latency: bool = True) -> Dict[str, Any]:
+    """
+    Merge small fragments, fold unindexed rows into indices and prune versions older
+    than `cleanup_older_than`. Readers may still hold a recent version (the chat
+    processor re-checks every LANCEDB_VERSION_CHECK_SECONDS), so the cleanup window
+    must be comfortably longer than that.
+
+    Returns a report with the table layout and query latency before and after.
+    """
+    report = {'before': get_table_layout(table, cleanup_older_than)}
+    if measure_latency:
+        report['before']['query_ms'] = measure_query_latency(table)
+
+    start = time.perf_counter()
+    table.optimize(cleanup_older_than=cleanup_older_than)
+    report['optimize_ms'] = round((time.perf_counter() - start) * 1000, 2)
+
+    report['after'] = get_table_layout(table, cleanup_older_than)
+    if measure_latency:
+        report['after']['query_ms'] = measure_query_latency(table)
+    return report
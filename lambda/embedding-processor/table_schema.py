@@ -0,0 +1,82 @@
+from typing import Dict, List
+
+import pyarrow as pa
+
+from embedding_profile import EmbeddingProfile
+
+# Scalar indexes for prefiltered search and per-document deletes. BITMAP suits the
+# low-cardinality source column, BTREE the high-cardinality hash and timestamp.
+SCALAR_INDEXES: Dict[str, str] = {
+    "source": "BITMAP",
+    "hash": "BTREE",
+    "uploaded_at": "BTREE",
+}
+
+def document_schema(profile: EmbeddingProfile) -> pa.Schema:
+    """Chunk table layout, the vector columns and schema metadata come from the embedding profile"""
+    vector_fields = [pa.field(name, vector_type) for name, vector_type in profile.vector_types().items()]
+    return pa.schema(vector_fields[:1] + [
+        pa.field("id", pa.string(), nullable=False),
+        pa.field("text", pa.string()),
+        pa.field("source", pa.string(), nullable=False),
+        pa.field("page", pa.int32()),
+        pa.field("chunk_index", pa.int32()),
+        pa.field("hash", pa.string()),
+        pa.field("uploaded_at", pa.timestamp("us", tz="UTC")),
+    ] + vector_fields[1:], metadata=profile.schema_metadata())
+
+def is_legacy_table(table) -> bool:
+    """Tables written through the langchain layout keep source and chunk_index in a metadata struct"""
+    return "source" not in table.schema.names and "metadata" in table.schema.names
+
+def scan_batches(table, batch_size: int = 10000) -> pa.RecordBatchReader:
+    """Stream every row of a table, a whole table is never loaded into memory at once"""
+    return table.search().limit(None).to_batches(batch_size)
+
+def migrate_legacy_table(db, table_name: str, table):
+    """
+    Rewrite a metadata-struct table into the typed schema as a new version of the same
+    table, so readers switch over in one commit. Rows are converted batch by batch while
+    the new version is written. Missing page, hash and upload time stay null. The new
+    version has no indexes, the caller rebuilds them.
+    """
+    # Legacy tables hold full-precision Titan vectors
+    profile = EmbeddingProfile(dimension=table.schema.field("vector").type.list_size)
+    schema = document_schema(profile)
+
+    def migrate(legacy: pa.RecordBatch) -> pa.RecordBatch:
+        metadata = legacy.column(legacy.schema.get_field_index("metadata"))
+        metadata_type = metadata.type
+
+        def metadata_field(name: str, arrow_type: pa.DataType) -> pa.Array:
+            if metadata_type.get_field_index(name) < 0:
+                return pa.nulls(legacy.num_rows, arrow_type)
+            return metadata.field(name).cast(arrow_type)
+
+        def column(name: str) -> pa.Array:
+            return legacy.column(legacy.schema.get_field_index(name))
+
+        return pa.RecordBatch.from_arrays([
+            column("vector").cast(profile.vector_types()["vector"]),
+            column("id").cast(pa.string()),
+            column("text").cast(pa.string()),
+            metadata_field("source", pa.string()),
+            metadata_field("page", pa.int32()),
+            metadata_field("chunk_index", pa.int32()),
+            metadata_field("hash", pa.string()),
+            pa.nulls(legacy.num_rows, pa.timestamp("us", tz="UTC")),
+        ], schema=schema)
+
+    print(f"Migrating {table.count_rows()} rows of {table_name} to the typed schema")
+    migrated = pa.RecordBatchReader.from_batches(schema, (migrate(batch) for batch in scan_batches(table)))
+    return db.create_table(table_name, data=migrated, schema=schema, mode="overwrite")
+
+def ensure_scalar_indexes(table) -> List[str]:
+    """Create the scalar indexes the table does not have yet, returns the columns indexed"""
+    indexed_columns = {column for index in table.list_indices() for column in index.columns}
+    created = []
+    for column, index_type in SCALAR_INDEXES.items():
+        if column not in indexed_columns:
+            table.create_scalar_index(column, index_type=index_type)
+            created.append(column)
+    return created
@@ -0,0 +1,106 @@
+import math
+from typing import Any, Optional, Tuple
+
+from embedding_profile import EmbeddingProfile
+
+VECTOR_COLUMN = "vector"
+
+def find_vector_index(table, vector_column: str = VECTOR_COLUMN) -> Optional[Any]:
+    """Return the index config of the ANN index on the vector column, if there is one"""
+    for index in table.list_indices():
+        if list(index.columns) == [vector_column]:
+            return index
+    return None
+
+def get_vector_dimension(table, vector_column: str = VECTOR_COLUMN) -> int:
+    return table.schema.field(vector_column).type.list_size
+
+def is_binary_vector(table) -> bool:
+    """
+    Binary embeddings are stored as packed uint8 bits. Read from the table's embedding profile,
+    which keeps pyarrow out of the handler's import (cold start).
+    """
+    return EmbeddingProfile.from_schema(table.schema).storage == 'binary'
+
+def plan_ivf_pq(num_rows: int, dimension: int) -> Tuple[int, int]:
+    """
+    Pick (num_partitions, num_sub_vectors) for an IVF-PQ index.
+
+    About sqrt(rows) partitions keeps each probe small, with at least 256 rows per
+    partition so k-means has enough data to train. Sub-vectors of 16 dimensions
+    (8 if that does not divide the dimension) keep PQ codes compact.
+    """
+    num_partitions = max(1, min(int(math.sqrt(num_rows)), num_rows // 256))
+    for sub_vector_dims in (16, 8, 4, 2, 1):
+        if dimension % sub_vector_dims == 0:
+            return num_partitions, dimension // sub_vector_dims
+    return num_partitions, 1
+
+def build_vector_index(table, num_rows: int, metric: str = "l2") -> None:
+    if is_binary_vector(table):
+        # PQ does not apply to bit vectors, IVF_FLAT keeps the codes and compares them by hamming distance
+        num_partitions, _ = plan_ivf_pq(num_rows, 1)
+        print(f"Building IVF_FLAT hamming index on {num_rows} rows: {num_partitions} partitions")
+        table.create_index(
+            metric="hamming",
+            num_partitions=num_partitions,
+            vector_column_name=VECTOR_COLUMN,
+            index_type="IVF_FLAT",
+            replace=True
+        )
+        return
+    num_partitions, num_sub_vectors = plan_ivf_pq(num_rows, get_vector_dimension(table))
+    print(f"Building IVF_PQ index on {num_rows} rows: {num_partitions} partitions, {num_sub_vectors} sub-vectors")
+    table.create_index(
+        metric=metric,
+        num_partitions=num_partitions,
+        num_sub_vectors=num_sub_vectors,
+        vector_column_name=VECTOR_COLUMN,
+        index_type="IVF_PQ",
+        replace=True
+    )
+
+def maintain_vector_index(
+    table,
+    min_rows: int,
+    rebuild_fraction: float = 1.0,
+    optimize_min_unindexed: int = 1000,
+    metric: str = "l2",
+) -> str:
+    """
+    Keep the ANN index of a table in step with its data after an append.
+
+    - Below `min_rows` brute force search is fast enough and no index is built.
+    - The first time the table reaches `min_rows` an IVF-PQ index is built (IVF_FLAT
+      with hamming distance for binary vectors).
+    - After a large append, when unindexed rows reach `rebuild_fraction` of the indexed
+      rows, the index is rebuilt so partitions are retrained for the new data.
+    - Otherwise, when at least `optimize_min_unindexed` rows are not yet indexed, they
+      are added to the existing index incrementally with optimize(). Fewer unindexed
+      rows are searched by brute force alongside the index.
+
+    Returns the action that was taken.
+    """
+    num_rows = table.count_rows()
+    index = find_vector_index(table)
+
+    if index is None:
+        if num_rows < min_rows:
+            return "none"
+        build_vector_index(table, num_rows, metric)
+        return "created"
+
+    stats = table.index_stats(index.name)
+    num_indexed = stats.num_indexed_rows if stats else 0
+    num_unindexed = stats.num_unindexed_rows if stats else num_rows
+
+    if num_indexed == 0 or num_unindexed >= num_indexed * rebuild_fraction:
+        build_vector_index(table, num_rows, metric)
+        return "rebuilt"
+
+    if num_unindexed >= optimize_min_unindexed:
+        print(f"Adding {num_unindexed} unindexed rows to index {index.name}")
+        table.optimize()
+        return "optimized"
+
+    return "none"
@@ -1,27 +1,75 @@
 import * as lambda from 'aws-cdk-lib/aws-lambda';
 import * as ecr_assets from 'aws-cdk-lib/aws-ecr-assets';
 import * as iam from 'aws-cdk-lib/aws-iam';
-import { Duration } from 'aws-cdk-lib';
+import * as dynamodb from 'aws-cdk-lib/aws-dynamodb';
+import { Duration, RemovalPolicy } from 'aws-cdk-lib';
 import { Construct } from 'constructs';
 import * as path from 'path';
 
 export interface ChatConstructProps {
     chatHistoryTableName: string;
     embedingsBucketName?: string; // Optional bucket name for embeddings
+    streamingGraphqlUrl?: string; // Optional AppSync endpoint partial responses are published to
+    streamingGraphqlApiArn?: string; // ARN of that AppSync API, required with streamingGraphqlUrl
 }
 
 export class ChatConstruct extends Construct {
     public readonly processingFunction: lambda.Function;
+    public readonly embeddingCacheTable: dynamodb.Table;
+    public readonly conversationSummaryTable: dynamodb.Table;
+    public readonly summaryFunction: lambda.Function;
 
     constructor(scope: Construct, id: string, props: ChatConstructProps) {
         super(scope, id);
 
+        // Persistent tier of the query embedding cache, entries expire through DynamoDB TTL
+        this.embeddingCacheTable = new dynamodb.Table(this, 'QueryEmbeddingCache', {
+            partitionKey: { name: 'cacheKey', type: dynamodb.AttributeType.STRING },
+            billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+            timeToLiveAttribute: 'expiresAt',
+            removalPolicy: RemovalPolicy.DESTROY, // Only holds derived data
+        });
+
         // Create Docker image asset
         const dockerImageAsset = new ecr_assets.DockerImageAsset(this, 'ChatProcessorImage', {
             directory: path.join(__dirname, '../lambda/chat-processor'),
             platform: ecr_assets.Platform.LINUX_AMD64,
         });
 
+        // Rolling per-user conversation summary, kept next to the chat history table
+        this.conversationSummaryTable = new dynamodb.Table(this, 'ConversationSummary', {
+            partitionKey: { name: 'userName', type: dynamodb.AttributeType.STRING },
+            billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+            removalPolicy: RemovalPolicy.RETAIN,
+        });
+
+        // Updates summaries off the response path, same image with a different entry point
+        this.summaryFunction = new lambda.DockerImageFunction(this, 'ConversationSummarizer', {
+            code: lambda.DockerImageCode.fromEcr(dockerImageAsset.repository, {
+                tagOrDigest: dockerImageAsset.imageTag,
+                cmd: ['index.summary_handler']
+            }),
+            timeout: Duration.minutes(2),
+            memorySize: 1024,
+            environment: {
+                CHAT_HISTORY_TABLE_NAME: props.chatHistoryTableName,
+                CONVERSATION_SUMMARY_TABLE_NAME: this.conversationSummaryTable.tableName,
+            },
+        });
+        this.conversationSummaryTable.grantReadWriteData(this.summaryFunction);
+        this.summaryFunction.addToRolePolicy(
+            new iam.PolicyStatement({
+                actions: ['bedrock:InvokeModel'],
+                resources: ['*']
+            })
+        );
+        this.summaryFunction.addToRolePolicy(
+            new iam.PolicyStatement({
+                actions: ['dynamodb:Query'],
+                resources: ['*'] // restrict this to specific table ARN
+            })
+        );
+
         // Create a Lambda function using container image
         this.processingFunction = new lambda.DockerImageFunction(this, 'ChatProcessor', {
             functionName: 'DoraemoCdkStack-ChatProcessor',
@@ -33,9 +81,23 @@ export class ChatConstruct extends Construct {
             environment: {
                 CHAT_HISTORY_TABLE_NAME: props.chatHistoryTableName,
                 S3_BUCKET_NAME: props.embedingsBucketName || 'doraemo-embeddings',
+                EMBEDDING_CACHE_TABLE_NAME: this.embeddingCacheTable.tableName,
+                CONVERSATION_SUMMARY_TABLE_NAME: this.conversationSummaryTable.tableName,
+                SUMMARY_FUNCTION_NAME: this.summaryFunction.functionName,
+                ...(props.streamingGraphqlUrl ? { STREAMING_GRAPHQL_URL: props.streamingGraphqlUrl } : {}),
             },
         });
 
+        // Allow publishing partial responses through the AppSync streaming mutation
+        if (props.streamingGraphqlUrl && props.streamingGraphqlApiArn) {
+            this.processingFunction.addToRolePolicy(
+                new iam.PolicyStatement({
+                    actions: ['appsync:GraphQL'],
+                    resources: [`${props.streamingGraphqlApiArn}/types/Mutation/*`]
+                })
+            );
+        }
+
         // Add Bedrock permissions
         this.processingFunction.addToRolePolicy(
             new iam.PolicyStatement({
@@ -47,6 +109,12 @@ export class ChatConstruct extends Construct {
             })
         );
 
+        this.embeddingCacheTable.grantReadWriteData(this.processingFunction);
+        this.conversationSummaryTable.grantReadData(this.processingFunction);
+        // Claims a summary update before invoking the summary function
+        this.conversationSummaryTable.grant(this.processingFunction, 'dynamodb:UpdateItem');
+        this.summaryFunction.grantInvoke(this.processingFunction);
+
         // Add DynamoDB permissions
         this.processingFunction.addToRolePolicy(
             new iam.PolicyStatement({
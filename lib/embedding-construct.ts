@@ -4,9 +4,12 @@ import * as ecr_assets from 'aws-cdk-lib/aws-ecr-assets';
 import * as iam from 'aws-cdk-lib/aws-iam';
 import * as sns from 'aws-cdk-lib/aws-sns';
 import * as sqs from 'aws-cdk-lib/aws-sqs';
+import * as dynamodb from 'aws-cdk-lib/aws-dynamodb';
 import * as sns_subscriptions from 'aws-cdk-lib/aws-sns-subscriptions';
 import * as lambda_event_sources from 'aws-cdk-lib/aws-lambda-event-sources';
-import { Duration, RemovalPolicy } from 'aws-cdk-lib';
+import * as events from 'aws-cdk-lib/aws-events';
+import * as events_targets from 'aws-cdk-lib/aws-events-targets';
+import { Duration, RemovalPolicy, Size, Stack } from 'aws-cdk-lib';
 import { Construct } from 'constructs';
 import * as path from 'path';
 
@@ -16,7 +19,10 @@ export interface EmbeddingConstructProps {
 
 export class EmbeddingConstruct extends Construct {
     public readonly processingFunction: lambda.Function;
+    public readonly compactionFunction: lambda.Function;
+    public readonly backfillFunction: lambda.Function;
     public readonly processingQueue: sqs.Queue;
+    public readonly ingestionSlotsTable: dynamodb.Table;
     public readonly embeddingsBucket: s3.Bucket;
 
     constructor(scope: Construct, id: string, props: EmbeddingConstructProps) {
@@ -40,7 +46,7 @@ export class EmbeddingConstruct extends Construct {
 
         // Create SQS queue for buffering document processing
         this.processingQueue = new sqs.Queue(this, 'EmbeddingProcessingQueue', {
-            visibilityTimeout: Duration.minutes(5), // Match Lambda timeout
+            visibilityTimeout: Duration.minutes(15), // Match Lambda timeout
             retentionPeriod: Duration.days(14),
             deadLetterQueue: {
                 queue: new sqs.Queue(this, 'EmbeddingDLQ', {
@@ -50,6 +56,15 @@ export class EmbeddingConstruct extends Construct {
             }
         });
 
+        // Per-user ingestion slots shared by concurrent invocations, leases expire through DynamoDB TTL
+        this.ingestionSlotsTable = new dynamodb.Table(this, 'IngestionSlots', {
+            partitionKey: { name: 'userId', type: dynamodb.AttributeType.STRING },
+            sortKey: { name: 'slot', type: dynamodb.AttributeType.NUMBER },
+            billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+            timeToLiveAttribute: 'expiresAt',
+            removalPolicy: RemovalPolicy.DESTROY, // Only holds short-lived leases
+        });
+
         // Create Docker image asset
         const dockerImageAsset = new ecr_assets.DockerImageAsset(this, 'EmbeddingProcessorImage', {
             directory: path.join(__dirname, '../lambda/embedding-processor'),
@@ -61,15 +76,25 @@ export class EmbeddingConstruct extends Construct {
             code: lambda.DockerImageCode.fromEcr(dockerImageAsset.repository, {
                 tagOrDigest: dockerImageAsset.imageTag
             }),
-            timeout: Duration.minutes(5),
+            timeout: Duration.minutes(15), // A batch may hold several documents of one user
             memorySize: 4096,
+            ephemeralStorageSize: Size.gibibytes(2), // Source PDFs are streamed to /tmp
             environment: {
                 SOURCE_BUCKET_NAME: sourceDocumentsBucket.bucketName,
                 EMBEDDINGS_BUCKET_NAME: this.embeddingsBucket.bucketName,
-                USER_DOCUMENT_TABLE_NAME: 'UserDocument-jku623bccfdvziracnh673rzwe-NONE'
+                USER_DOCUMENT_TABLE_NAME: 'UserDocument-jku623bccfdvziracnh673rzwe-NONE',
+                EMBEDDING_CONCURRENCY: '8',
+                DOCUMENT_CONCURRENCY: '4',
+                INGESTION_SLOTS_TABLE_NAME: this.ingestionSlotsTable.tableName,
+                USER_BATCH_QUOTA: '3', // Uploads of one user per batch, the rest is deferred
+                USER_MAX_IN_FLIGHT: '2' // Invocations working on one user at once
             },
         });
 
+        // Fair share between users: slot leases, and deferred uploads sent back to the queue
+        this.ingestionSlotsTable.grantReadWriteData(this.processingFunction);
+        this.processingQueue.grantSendMessages(this.processingFunction);
+
         // Add Bedrock permissions
         this.processingFunction.addToRolePolicy(
             new iam.PolicyStatement({
@@ -138,9 +163,112 @@ export class EmbeddingConstruct extends Construct {
         // Add SQS queue as event source for Lambda
         this.processingFunction.addEventSource(
             new lambda_event_sources.SqsEventSource(this.processingQueue, {
-                batchSize: 1, // Process one message at a time
-                maxBatchingWindow: Duration.seconds(10)
+                batchSize: 10, // Documents of different users are processed concurrently
+                maxBatchingWindow: Duration.seconds(10),
+                reportBatchItemFailures: true // Only failed documents are redelivered
+            })
+        );
+
+        // Scheduled compaction of per-user tables, same image with a different entry point
+        this.compactionFunction = new lambda.DockerImageFunction(this, 'EmbeddingCompaction', {
+            code: lambda.DockerImageCode.fromEcr(dockerImageAsset.repository, {
+                tagOrDigest: dockerImageAsset.imageTag,
+                cmd: ['index.compaction_handler']
+            }),
+            timeout: Duration.minutes(15),
+            memorySize: 4096,
+            environment: {
+                EMBEDDINGS_BUCKET_NAME: this.embeddingsBucket.bucketName,
+            },
+        });
+
+        this.compactionFunction.addToRolePolicy(
+            new iam.PolicyStatement({
+                actions: [
+                    's3:GetObject',
+                    's3:HeadObject',
+                    's3:PutObject',
+                    's3:DeleteObject',
+                    's3:ListBucket'
+                ],
+                resources: [
+                    this.embeddingsBucket.bucketArn,
+                    `${this.embeddingsBucket.bucketArn}/*`
+                ]
+            })
+        );
+
+        new events.Rule(this, 'EmbeddingCompactionSchedule', {
+            schedule: events.Schedule.rate(Duration.days(1)),
+            targets: [new events_targets.LambdaFunction(this.compactionFunction)]
+        });
+
+        // On-demand re-embedding of all documents into a new table version, same image with a different entry point
+        this.backfillFunction = new lambda.DockerImageFunction(this, 'EmbeddingBackfill', {
+            functionName: 'DoraemoCdkStack-EmbeddingBackfill',
+            code: lambda.DockerImageCode.fromEcr(dockerImageAsset.repository, {
+                tagOrDigest: dockerImageAsset.imageTag,
+                cmd: ['index.backfill_handler']
+            }),
+            timeout: Duration.minutes(15), // Unfinished users are handed to a new invocation
+            memorySize: 4096,
+            ephemeralStorageSize: Size.gibibytes(2),
+            environment: {
+                SOURCE_BUCKET_NAME: sourceDocumentsBucket.bucketName,
+                EMBEDDINGS_BUCKET_NAME: this.embeddingsBucket.bucketName,
+                EMBEDDING_CONCURRENCY: '8',
+                INGESTION_SLOTS_TABLE_NAME: this.ingestionSlotsTable.tableName,
+                USER_MAX_IN_FLIGHT: '2', // Must match the processing function, all slots are held during a switch-over
+                BACKFILL_SHARD_SIZE: '20',
+                BACKFILL_CONCURRENCY: '4'
+            },
+        });
+
+        this.ingestionSlotsTable.grantReadWriteData(this.backfillFunction);
+
+        this.backfillFunction.addToRolePolicy(
+            new iam.PolicyStatement({
+                actions: ['bedrock:InvokeModel'],
+                resources: ['*']
+            })
+        );
+
+        this.backfillFunction.addToRolePolicy(
+            new iam.PolicyStatement({
+                actions: [
+                    's3:GetObject',
+                    's3:HeadObject',
+                    's3:ListBucket'
+                ],
+                resources: [
+                    sourceDocumentsBucket.bucketArn,
+                    `${sourceDocumentsBucket.bucketArn}/*`
+                ]
+            })
+        );
+
+        this.backfillFunction.addToRolePolicy(
+            new iam.PolicyStatement({
+                actions: [
+                    's3:GetObject',
+                    's3:HeadObject',
+                    's3:PutObject',
+                    's3:DeleteObject',
+                    's3:ListBucket'
+                ],
+                resources: [
+                    this.embeddingsBucket.bucketArn,
+                    `${this.embeddingsBucket.bucketArn}/*`
+                ]
+            })
+        );
+
+        // Continuation invocations, the ARN is built from the name to avoid a self-reference
+        this.backfillFunction.addToRolePolicy(
+            new iam.PolicyStatement({
+                actions: ['lambda:InvokeFunction'],
+                resources: [`arn:aws:lambda:${Stack.of(this).region}:${Stack.of(this).account}:function:DoraemoCdkStack-EmbeddingBackfill`]
             })
         );
     }
-} 
\ No newline at end of file
+}
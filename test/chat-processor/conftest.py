@@ -0,0 +1,16 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+LAMBDA_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'lambda', 'chat-processor')
+sys.path.insert(0, LAMBDA_DIR)
+
+@pytest.fixture(scope='session')
+def chat_index():
+    """The chat handler module, loaded as chat_index since the embedding-processor tests import their own index"""
+    spec = importlib.util.spec_from_file_location('chat_index', os.path.join(LAMBDA_DIR, 'index.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,53 @@
+class ConditionalCheckFailedException(Exception):
+    pass
+
+class FakeChatHistoryTable:
+    """put_item and query of the chat history table, for one user"""
+
+    class exceptions:
+        ConditionalCheckFailedException = ConditionalCheckFailedException
+
+    def __init__(self, idxs=()):
+        self.items = {idx: {'idx': {'N': str(idx)}} for idx in idxs}
+        self.puts = 0
+        self.queries = 0
+
+    def put_item(self, TableName, Item, ConditionExpression):
+        self.puts += 1
+        idx = int(Item['idx']['N'])
+        if idx in self.items:
+            raise ConditionalCheckFailedException()
+        self.items[idx] = Item
+
+    def query(self, **params):
+        self.queries += 1
+        return {'Items': [self.items[idx] for idx in sorted(self.items, reverse=True)][:params['Limit']]}
+
+def use_table(monkeypatch, chat_index, table):
+    monkeypatch.setattr(chat_index, 'get_client', lambda service_name: table)
+
+def test_next_idx_from_history(chat_index):
+    assert chat_index.next_idx_from_history(None) is None
+    assert chat_index.next_idx_from_history([]) == 1
+    assert chat_index.next_idx_from_history([{'idx': {'N': '7'}}, {'idx': {'N': '6'}}]) == 8
+
+def test_expected_idx_is_one_put(monkeypatch, chat_index):
+    table = FakeChatHistoryTable(idxs=[1, 2])
+    use_table(monkeypatch, chat_index, table)
+    assert chat_index.update_chat_history('id', 'user', 'hi  there', 'hello', True, expected_idx=3) == 3
+    assert (table.puts, table.queries) == (1, 0)
+    assert table.items[3]['prompt'] == {'S': 'hi there'}
+
+def test_taken_idx_is_re_read_and_retried(monkeypatch, chat_index):
+    # A concurrent request of the same user already wrote idx 3
+    table = FakeChatHistoryTable(idxs=[1, 2, 3])
+    use_table(monkeypatch, chat_index, table)
+    assert chat_index.update_chat_history('id', 'user', 'hi', 'hello', True, expected_idx=3) == 4
+    assert (table.puts, table.queries) == (2, 1)
+    assert table.items[3] == {'idx': {'N': '3'}}
+
+def test_missing_history_queries_the_idx_first(monkeypatch, chat_index):
+    table = FakeChatHistoryTable()
+    use_table(monkeypatch, chat_index, table)
+    assert chat_index.update_chat_history('id', 'user', 'hi', 'hello', True) == 1
+    assert (table.puts, table.queries) == (1, 1)
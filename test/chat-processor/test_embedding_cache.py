@@ -0,0 +1,56 @@
+from embedding_cache import EmbeddingCache, make_cache_key
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class DictStore:
+    def __init__(self, fail=False):
+        self.items = {}
+        self.fail = fail
+
+    def get(self, key):
+        if self.fail:
+            raise RuntimeError('throttled')
+        return self.items.get(key)
+
+    def put(self, key, embedding, ttl_seconds):
+        if self.fail:
+            raise RuntimeError('throttled')
+        self.items[key] = embedding
+
+def test_key_ignores_case_and_whitespace_but_not_model():
+    assert make_cache_key('  What is   LanceDB?\n', 'titan') == make_cache_key('what is lancedb?', 'titan')
+    assert make_cache_key('what is lancedb?', 'titan') != make_cache_key('what is lancedb?', 'titan:512')
+
+def test_memory_tier_evicts_least_recently_used_and_expires():
+    clock = FakeClock()
+    cache = EmbeddingCache(max_entries=2, ttl_seconds=60, clock=clock)
+    cache.put('a', 'm', [1.0])
+    cache.put('b', 'm', [2.0])
+    assert cache.get('a', 'm') == [1.0]
+    cache.put('c', 'm', [3.0])
+    assert cache.get('b', 'm') is None
+    assert cache.get('a', 'm') == [1.0]
+    clock.now += 61
+    assert cache.get('a', 'm') is None
+    assert cache.stats()['entries'] == 1
+
+def test_persistent_hit_fills_memory_tier():
+    store = DictStore()
+    EmbeddingCache(persistent_store=store).put('hello', 'm', [0.5])
+    cache = EmbeddingCache(persistent_store=store)
+    assert cache.get('Hello', 'm') == [0.5]
+    assert cache.get('hello', 'm') == [0.5]
+    assert cache.counters['persistent_hits'] == 1
+    assert cache.counters['memory_hits'] == 1
+
+def test_persistent_errors_are_misses():
+    cache = EmbeddingCache(persistent_store=DictStore(fail=True))
+    cache.put('hello', 'm', [0.5])
+    assert cache.get('other', 'm') is None
+    assert cache.counters['persistent_errors'] == 2
+    assert cache.get('hello', 'm') == [0.5]
@@ -0,0 +1,57 @@
+from prompt_builder import TRUNCATION_MARKER, build_prompt, estimate_tokens, truncate_to_tokens
+
+def turn(idx, prompt, response):
+    return {'idx': {'N': str(idx)}, 'prompt': {'S': prompt}, 'response': {'S': response}}
+
+def result(text, score, filename='doc.pdf'):
+    return {'text': text, 'score': score, 'metadata': {'filename': filename, 'page': 1}}
+
+def message_texts(prompt):
+    return [message['content'][0]['text'] for message in prompt.messages]
+
+def test_truncate_prefers_a_word_boundary():
+    text = 'word ' * 100
+    truncated = truncate_to_tokens(text, 10)
+    assert truncated.endswith(TRUNCATION_MARKER)
+    assert estimate_tokens(truncated) <= 10
+    assert truncated[:-len(TRUNCATION_MARKER)].endswith('word')
+    assert truncate_to_tokens('short', 10) == 'short'
+
+def test_everything_fits_in_chronological_order():
+    history = [turn(2, 'second', 'answer 2'), turn(1, 'first', 'answer 1')]
+    prompt = build_prompt('question', history, [result('far', 0.9), result('near', 0.1)], token_budget=1000)
+    texts = message_texts(prompt)
+    assert texts[:4] == ['first', 'answer 1', 'second', 'answer 2']
+    assert texts[-1].startswith('question')
+    # Best score first
+    assert texts[-1].index('near') < texts[-1].index('far')
+    assert prompt.report['turns'] == 2
+    assert prompt.report['search_results'] == 2
+    assert prompt.report['tokens'] <= 1000
+
+def test_search_results_come_before_older_turns():
+    history = [turn(idx, f"p{idx}".ljust(40, '.'), f"r{idx}".ljust(40, '.')) for idx in range(5, 0, -1)]
+    results = [result('x' * 200, 0.1)]
+    prompt = build_prompt('question', history, results, token_budget=140, recent_turns=1)
+    assert prompt.report['search_results'] == 1
+    assert prompt.report['tokens'] <= 140
+    # Older turns fill what is left, newest first
+    assert prompt.report['turns'] == 3
+    assert [text[:2] for text in message_texts(prompt)[:-1]] == ['p3', 'r3', 'p4', 'r4', 'p5', 'r5']
+
+def test_last_search_result_is_truncated_to_the_remaining_budget():
+    results = [result('a ' * 100, 0.1), result('b ' * 400, 0.2), result('c ' * 100, 0.3)]
+    prompt = build_prompt('question', [], results, token_budget=250, min_chunk_tokens=20)
+    assert prompt.report['search_results'] == 2
+    assert prompt.report['truncated_search_results'] == 1
+    assert prompt.report['dropped_search_results'] == 1
+    assert prompt.search_results[1]['text'].endswith(TRUNCATION_MARKER)
+    assert prompt.report['tokens'] <= 250
+
+def test_summary_is_the_leading_exchange():
+    prompt = build_prompt('question', [turn(9, 'latest', 'reply')], [], token_budget=1000, summary='They like cats.')
+    texts = message_texts(prompt)
+    assert prompt.messages[0]['role'] == 'user'
+    assert 'They like cats.' in texts[0]
+    assert texts[2:4] == ['latest', 'reply']
+    assert prompt.report['summary'] == 1
@@ -0,0 +1,97 @@
+import json
+
+import pytest
+
+import response_streaming
+from response_streaming import AppSyncPublisherSink, TokenSink, consume_converse_stream
+
+class RecordingSink(TokenSink):
+    def __init__(self):
+        self.calls = []
+
+    def on_token(self, text):
+        self.calls.append(('token', text))
+
+    def on_complete(self, full_text):
+        self.calls.append(('complete', full_text))
+
+    def on_error(self, error):
+        self.calls.append(('error', str(error)))
+
+def delta(text):
+    return {'contentBlockDelta': {'delta': {'text': text}, 'contentBlockIndex': 0}}
+
+def test_accumulates_text_and_calls_sink_in_order():
+    usage = []
+    events = [
+        {'messageStart': {'role': 'assistant'}},
+        delta('Hello'),
+        delta(', '),
+        {'contentBlockDelta': {'delta': {}}},
+        delta('world'),
+        {'contentBlockStop': {'contentBlockIndex': 0}},
+        {'messageStop': {'stopReason': 'end_turn'}},
+        {'metadata': {'usage': {'inputTokens': 12, 'outputTokens': 3}}},
+    ]
+    sink = RecordingSink()
+    assert consume_converse_stream(events, sink, on_usage=usage.append) == 'Hello, world'
+    assert sink.calls == [('token', 'Hello'), ('token', ', '), ('token', 'world'), ('complete', 'Hello, world')]
+    assert usage == [{'inputTokens': 12, 'outputTokens': 3}]
+
+def test_stream_error_event_raises_without_completing():
+    events = [delta('Partial'), {'throttlingException': {'message': 'Too many requests'}}, delta('never')]
+    sink = RecordingSink()
+    with pytest.raises(Exception, match='throttlingException: Too many requests'):
+        consume_converse_stream(events, sink)
+    assert sink.calls == [('token', 'Partial')]
+
+class FakeResponse:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def read(self):
+        return b'{}'
+
+@pytest.fixture
+def published(monkeypatch):
+    """Variables of every mutation the AppSync sink sends"""
+    sent = []
+
+    class NoAuth:
+        def __init__(self, *args):
+            pass
+
+        def add_auth(self, request):
+            pass
+
+    def urlopen(request, timeout):
+        sent.append(json.loads(request.data)['variables'])
+        return FakeResponse()
+
+    monkeypatch.setattr(response_streaming, 'SigV4Auth', NoAuth)
+    monkeypatch.setattr(response_streaming.urllib.request, 'urlopen', urlopen)
+    return sent
+
+def make_sink():
+    return AppSyncPublisherSink(
+        'https://example.appsync-api.us-east-1.amazonaws.com/graphql', 'mutation', {'requestId': 'r'},
+        'us-east-1', flush_chars=5, flush_seconds=60
+    )
+
+def test_appsync_sink_marks_completion(published):
+    sink = make_sink()
+    consume_converse_stream([delta('Hello'), delta(' world')], sink)
+    assert [(chunk['chunk'], chunk['sequence'], chunk['done'], chunk['error']) for chunk in published] == [
+        ('Hello', 0, False, None), (' world', 1, False, None), ('', 2, True, None)
+    ]
+
+def test_appsync_sink_reports_errors(published):
+    sink = make_sink()
+    sink.on_token('Hi')
+    sink.on_error(Exception('modelStreamErrorException: boom'))
+    assert [(chunk['chunk'], chunk['done'], chunk['error']) for chunk in published] == [
+        ('Hi', True, 'modelStreamErrorException: boom')
+    ]
@@ -0,0 +1,32 @@
+def test_sql_timestamp_is_utc(chat_index):
+    assert chat_index.sql_timestamp('2026-03-01T10:00:00Z') == "timestamp '2026-03-01 10:00:00.000000'"
+    assert chat_index.sql_timestamp('2026-03-01T12:30:00+02:00') == "timestamp '2026-03-01 10:30:00.000000'"
+    # Naive values are taken as UTC
+    assert chat_index.sql_timestamp('2026-03-01') == "timestamp '2026-03-01 00:00:00.000000'"
+
+def test_sql_timestamp_of_malformed_values(chat_index):
+    assert chat_index.sql_timestamp('last tuesday') is None
+    assert chat_index.sql_timestamp(20260301) is None
+
+def test_no_filter(chat_index):
+    assert chat_index.build_search_filter() is None
+    assert chat_index.build_search_filter([], '', None) is None
+
+def test_documents_and_date_range(chat_index):
+    where = chat_index.build_search_filter(
+        ["user-documents/u/a.pdf", "user-documents/u/it's.pdf"],
+        '2026-01-01T00:00:00Z',
+        '2026-02-01T00:00:00Z'
+    )
+    assert where == (
+        "source IN ('user-documents/u/a.pdf', 'user-documents/u/it''s.pdf')"
+        " AND uploaded_at >= timestamp '2026-01-01 00:00:00.000000'"
+        " AND uploaded_at < timestamp '2026-02-01 00:00:00.000000'"
+    )
+
+def test_malformed_bound_is_dropped(monkeypatch, chat_index):
+    counts = []
+    monkeypatch.setattr(chat_index.metrics, 'count', lambda name, value=1: counts.append(name))
+    where = chat_index.build_search_filter(None, 'yesterday', '2026-02-01T00:00:00Z')
+    assert where == "uploaded_at < timestamp '2026-02-01 00:00:00.000000'"
+    assert counts == ['InvalidSearchFilters']
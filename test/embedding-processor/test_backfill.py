@@ -0,0 +1,57 @@
+import io
+
+import pytest
+from botocore.exceptions import ClientError
+
+from backfill import checkpoint_key, load_checkpoint, new_checkpoint, pending_shards, plan_shards, save_checkpoint, staging_table_name
+
+class FakeS3:
+    class exceptions:
+        ClientError = ClientError
+
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, ContentType):
+        self.objects[(Bucket, Key)] = Body
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'Not Found'}}, 'GetObject')
+        return {'Body': io.BytesIO(self.objects[(Bucket, Key)])}
+
+def test_plan_shards_is_sorted_and_bounded():
+    keys = [f"user-documents/u/{name}.pdf" for name in 'edcba']
+    assert plan_shards(keys, 2) == [
+        ['user-documents/u/a.pdf', 'user-documents/u/b.pdf'],
+        ['user-documents/u/c.pdf', 'user-documents/u/d.pdf'],
+        ['user-documents/u/e.pdf'],
+    ]
+    assert plan_shards([], 2) == []
+
+def test_staging_table_name_rejects_unsafe_versions():
+    assert staging_table_name('document_embeddings', 'v2') == 'document_embeddings_v2'
+    with pytest.raises(ValueError):
+        staging_table_name('document_embeddings', '../v2')
+
+def test_checkpoint_round_trip():
+    s3 = FakeS3()
+    assert load_checkpoint(s3, 'bucket', 'v2', 'u') is None
+    checkpoint = new_checkpoint('v2', 'u', plan_shards(['a', 'b', 'c'], 2), {'dimension': 512})
+    checkpoint['completedShards'].append(0)
+    checkpoint['currentShard'] = {'number': 1, 'completedDocuments': ['c']}
+    checkpoint['failedDocuments'].append('b')
+    save_checkpoint(s3, 'bucket', checkpoint)
+    assert ('bucket', checkpoint_key('v2', 'u')) in s3.objects
+    loaded = load_checkpoint(s3, 'bucket', 'v2', 'u')
+    assert loaded == checkpoint
+    assert pending_shards(loaded) == [1]
+
+def test_load_checkpoint_raises_other_errors():
+    s3 = FakeS3()
+
+    def denied(Bucket, Key):
+        raise ClientError({'Error': {'Code': 'AccessDenied', 'Message': 'Access Denied'}}, 'GetObject')
+    s3.get_object = denied
+    with pytest.raises(ClientError):
+        load_checkpoint(s3, 'bucket', 'v2', 'u')
@@ -0,0 +1,64 @@
+import io
+import json
+
+import pytest
+from botocore.exceptions import ClientError
+
+from bedrock_embeddings import ConcurrentBedrockEmbeddings
+
+def throttling_error() -> ClientError:
+    return ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}, 'InvokeModel')
+
+class StubBedrock:
+    """Returns [len(text), position of the text] and fails the first `failures[text]` calls of a text"""
+
+    def __init__(self, texts, failures=None, error=throttling_error):
+        self.positions = {text: position for position, text in enumerate(texts)}
+        self.failures = dict(failures or {})
+        self.error = error
+        self.calls = []
+
+    def invoke_model(self, modelId, body, **kwargs):
+        request = json.loads(body)
+        text = request['inputText']
+        self.calls.append(request)
+        if self.failures.get(text, 0) > 0:
+            self.failures[text] -= 1
+            raise self.error()
+        return {'body': io.BytesIO(json.dumps({'embedding': [len(text), self.positions[text]]}).encode())}
+
+def make_embeddings(client, **kwargs) -> ConcurrentBedrockEmbeddings:
+    return ConcurrentBedrockEmbeddings(client, 'amazon.titan-embed-text-v2:0', sleep=lambda delay: None, **kwargs)
+
+def test_keeps_chunk_order():
+    texts = [f"chunk {number}" * (number % 7 + 1) for number in range(50)]
+    # Early chunks are throttled, so they finish after later ones
+    client = StubBedrock(texts, failures={text: 2 for text in texts[:10]})
+    vectors = make_embeddings(client, max_concurrency=8).embed_documents(texts)
+    assert [vector[1] for vector in vectors] == list(range(len(texts)))
+
+def test_retries_throttling():
+    retries = []
+    client = StubBedrock(['a'], failures={'a': 3})
+    embeddings = make_embeddings(client, max_retries=6, on_retry=lambda: retries.append(1))
+    assert embeddings.embed_query('a') == [1, 0]
+    assert len(client.calls) == 4
+    assert len(retries) == 3
+
+def test_gives_up_after_max_retries():
+    client = StubBedrock(['a'], failures={'a': 10})
+    with pytest.raises(ClientError):
+        make_embeddings(client, max_retries=2).embed_query('a')
+    assert len(client.calls) == 3
+
+def test_does_not_retry_other_errors():
+    error = lambda: ClientError({'Error': {'Code': 'ValidationException', 'Message': 'Bad input'}}, 'InvokeModel')
+    client = StubBedrock(['a'], failures={'a': 1}, error=error)
+    with pytest.raises(ClientError):
+        make_embeddings(client).embed_query('a')
+    assert len(client.calls) == 1
+
+def test_sends_request_options():
+    client = StubBedrock(['a'])
+    make_embeddings(client, request_options={'dimensions': 256, 'normalize': True}).embed_documents(['a'])
+    assert client.calls == [{'inputText': 'a', 'dimensions': 256, 'normalize': True}]
@@ -0,0 +1,65 @@
+import lancedb
+
+import index
+from embedding_profile import EmbeddingProfile
+
+DOCUMENT_KEY = 'user-documents/u/doc.pdf'
+
+def row(text, chunk_index, page=1):
+    return {'hash': index.hash_chunk(text), 'chunk_index': chunk_index, 'page': page}
+
+def chunk(text, chunk_index, page=1):
+    return {'text': text, **row(text, chunk_index, page)}
+
+def test_match_stored_prefix_stops_at_first_difference():
+    existing = [row('a', 0), row('b', 1), row('c', 2)]
+    matched, rest = index.match_stored_prefix(existing, iter([chunk('a', 0), chunk('b', 1), chunk('x', 2), chunk('c', 3)]))
+    assert matched == 2
+    assert [item['text'] for item in rest] == ['x', 'c']
+
+def test_match_stored_prefix_of_unchanged_and_longer_documents():
+    existing = [row('a', 0), row('b', 1)]
+    assert index.match_stored_prefix(existing, iter([chunk('a', 0), chunk('b', 1)])) == (2, None)
+    matched, rest = index.match_stored_prefix(existing, iter([chunk('a', 0), chunk('b', 1), chunk('c', 2)]))
+    assert matched == 2
+    assert [item['text'] for item in rest] == ['c']
+    # Same text on another page is a different chunk
+    matched, rest = index.match_stored_prefix(existing, iter([chunk('a', 0, page=2)]))
+    assert matched == 0
+
+class CountingEmbeddings:
+    def __init__(self, dimension):
+        self.dimension = dimension
+        self.texts = []
+
+    def embed_documents(self, texts):
+        self.texts.extend(texts)
+        return [[float(len(text))] * self.dimension for text in texts]
+
+def test_reupload_embeds_only_new_text(monkeypatch, tmp_path):
+    profile = EmbeddingProfile(dimension=256)
+    embeddings = CountingEmbeddings(profile.dimension)
+    monkeypatch.setattr(index, 'connect_to_user_db', lambda user_id: lancedb.connect(str(tmp_path / user_id)))
+    monkeypatch.setattr(index, 'get_embeddings', lambda profile=None: embeddings)
+    monkeypatch.setattr(index, 'compact_after_ingestion', lambda table, user_id: None)
+    monkeypatch.setattr(index, 'EMBEDDING_BATCH_SIZE', 2)
+    monkeypatch.setattr(index.metrics, 'sink', lambda record: None)
+
+    def store(texts):
+        embeddings.texts.clear()
+        chunks = (chunk(text, position) for position, text in enumerate(texts))
+        return index.store_document_embeddings('bucket', DOCUMENT_KEY, chunks, new_table_profile=profile)
+
+    assert store(['a', 'a', 'b', 'c']) == 4
+    # Repeated text within a batch goes to Bedrock once
+    assert embeddings.texts == ['a', 'b', 'c']
+    assert store(['a', 'a', 'b', 'c']) == 4
+    assert embeddings.texts == []
+    # Shifted chunks reuse their stored vectors, only the new text is embedded
+    assert store(['new', 'a', 'b', 'c']) == 4
+    assert embeddings.texts == ['new']
+
+    table = index.connect_to_user_db('u').open_table('document_embeddings')
+    rows = sorted(table.to_arrow().to_pylist(), key=lambda item: item['chunk_index'])
+    assert [item['text'] for item in rows] == ['new', 'a', 'b', 'c']
+    assert len({item['uploaded_at'] for item in rows}) == 1
@@ -0,0 +1,37 @@
+import pyarrow as pa
+
+from embedding_profile import FULL_VECTOR_COLUMN, EmbeddingProfile, pack_sign_bits, rerank
+
+def test_pack_sign_bits_most_significant_bit_first():
+    assert pack_sign_bits([1, -1, 1, 1, -1, -1, -1, 0.5]) == [0b10110001]
+    # Zero is not positive
+    assert pack_sign_bits([0.0] * 8 + [0.1] * 8) == [0, 255]
+
+def test_pack_sign_bits_pads_a_short_last_byte():
+    assert pack_sign_bits([1, 1, 1, 1, 1, 1, 1, 1, 1, -1, 1]) == [255, 0b10100000]
+    assert len(pack_sign_bits([0.1] * 1020)) == 128
+
+def test_rerank_orders_by_exact_distance():
+    query = [1.0, 0.0]
+    candidates = [[0.0, 1.0], [0.9, 0.1], [1.0, 0.0], [-1.0, 0.0]]
+    ranked = rerank(candidates, query, top_k=3)
+    assert [position for position, _ in ranked] == [2, 1, 0]
+    assert ranked[0][1] == 0.0
+    assert abs(ranked[1][1] - 0.02) < 1e-9
+    assert len(rerank(candidates, query, top_k=10)) == 4
+
+def test_binary_profile_columns_and_schema_round_trip():
+    profile = EmbeddingProfile(dimension=256, storage='binary', rerank_factor=4)
+    columns = profile.vector_columns([0.5, -0.5] * 128)
+    assert columns['vector'] == [0b10101010] * 32
+    assert len(columns[FULL_VECTOR_COLUMN]) == 256
+    schema = pa.schema(
+        [pa.field(name, vector_type) for name, vector_type in profile.vector_types().items()],
+        metadata=profile.schema_metadata()
+    )
+    assert EmbeddingProfile.from_schema(schema) == profile
+    assert profile.distance_type == 'hamming'
+    assert profile.name == '256-binary-rerank4'
+
+def test_float32_profile_has_no_rerank():
+    assert EmbeddingProfile(storage='float32', rerank_factor=4).stores_full_vector is False
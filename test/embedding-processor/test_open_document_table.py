@@ -0,0 +1,20 @@
+import pytest
+
+import index
+
+class FakeDb:
+    def __init__(self, error):
+        self.error = error
+
+    def open_table(self, name):
+        raise self.error
+
+def test_missing_table_is_none():
+    assert index.open_document_table(FakeDb(ValueError("Table 'document_embeddings' was not found"))) is None
+    assert index.open_document_table(FakeDb(FileNotFoundError('document_embeddings.lance'))) is None
+
+def test_other_errors_are_raised():
+    with pytest.raises(OSError):
+        index.open_document_table(FakeDb(OSError('Generic S3 error: connection reset')))
+    with pytest.raises(ValueError):
+        index.open_document_table(FakeDb(ValueError('Invalid user input')))
@@ -0,0 +1,14 @@
+import parallel_extraction
+from parallel_extraction import get_pages_per_task, split_page_ranges, uses_workers
+
+def test_page_ranges_cover_every_page_once():
+    assert split_page_ranges(40, 16) == [(0, 16), (16, 32), (32, 40)]
+    assert get_pages_per_task(1000, 4) == 63
+    assert get_pages_per_task(10, 4) == parallel_extraction.MIN_PAGES_PER_TASK
+
+def test_workers_need_two_cpus_and_more_than_one_range(monkeypatch):
+    monkeypatch.setattr(parallel_extraction, 'get_cpu_count', lambda: 4)
+    assert uses_workers(100, 25)
+    assert not uses_workers(16, 16)
+    monkeypatch.setattr(parallel_extraction, 'get_cpu_count', lambda: 1)
+    assert not uses_workers(100, 25)
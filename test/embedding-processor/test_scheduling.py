@@ -0,0 +1,64 @@
+import json
+
+import index
+
+def uploads(user_id, count):
+    return [(f"{user_id}-{number}", 'DOCUMENT_UPLOADED', f"user-documents/{user_id}/{number}.pdf") for number in range(count)]
+
+def test_lone_user_batch_is_processed_whole(monkeypatch):
+    monkeypatch.setattr(index, 'INGESTION_SLOTS_TABLE_NAME', None)
+    monkeypatch.setattr(index, 'USER_BATCH_QUOTA', 3)
+    scheduled, slots, deferred = index.schedule_user_documents({'bulk': uploads('bulk', 10)}, 'owner')
+    assert len(scheduled['bulk']) == 10
+    assert deferred == []
+
+def test_quota_applies_when_users_share_the_batch(monkeypatch):
+    monkeypatch.setattr(index, 'INGESTION_SLOTS_TABLE_NAME', None)
+    monkeypatch.setattr(index, 'USER_BATCH_QUOTA', 3)
+    scheduled, slots, deferred = index.schedule_user_documents(
+        {'bulk': uploads('bulk', 9), 'small': uploads('small', 1)}, 'owner'
+    )
+    assert list(scheduled) == ['small', 'bulk']
+    assert len(scheduled['bulk']) == 3
+    assert [document[0] for document in deferred] == [f"bulk-{number}" for number in range(3, 9)]
+
+def test_quota_applies_when_another_invocation_holds_a_slot(monkeypatch):
+    monkeypatch.setattr(index, 'INGESTION_SLOTS_TABLE_NAME', 'slots')
+    monkeypatch.setattr(index, 'USER_BATCH_QUOTA', 3)
+    monkeypatch.setattr(index, 'get_dynamodb_client', lambda: None)
+    monkeypatch.setattr(index, 'acquire_user_slot', lambda *args: 1)
+    scheduled, slots, deferred = index.schedule_user_documents({'bulk': uploads('bulk', 10)}, 'owner')
+    assert slots == {'bulk': 1}
+    assert len(scheduled['bulk']) == 3
+    assert len(deferred) == 7
+
+def test_busy_user_keeps_only_deletes(monkeypatch):
+    monkeypatch.setattr(index, 'INGESTION_SLOTS_TABLE_NAME', 'slots')
+    monkeypatch.setattr(index, 'get_dynamodb_client', lambda: None)
+    monkeypatch.setattr(index, 'acquire_user_slot', lambda *args: None)
+    documents = uploads('bulk', 2) + [('delete', 'DOCUMENT_DELETED', 'user-documents/bulk/old.pdf')]
+    scheduled, slots, deferred = index.schedule_user_documents({'bulk': documents}, 'owner')
+    assert scheduled == {'bulk': [documents[2]]}
+    assert deferred == documents[:2]
+
+def upload_record(message_id, document_path):
+    message = {'eventType': 'DOCUMENT_UPLOADED', 'documentPath': document_path}
+    return {
+        'messageId': message_id,
+        'body': json.dumps({'Type': 'Notification', 'Message': json.dumps(message)}),
+        'eventSourceARN': 'arn:aws:sqs:us-east-1:000000000000:EmbeddingProcessingQueue',
+    }
+
+def test_documents_not_started_before_the_deadline_are_deferred(monkeypatch):
+    processed, sent = [], []
+    monkeypatch.setenv('SOURCE_BUCKET_NAME', 'source')
+    monkeypatch.setattr(index, 'INGESTION_SLOTS_TABLE_NAME', None)
+    monkeypatch.setattr(index, 'process_document', lambda bucket, path: processed.append(path))
+    monkeypatch.setattr(index, 'get_sqs_client', lambda: type('SQS', (), {'send_message': lambda self, **kwargs: sent.append(kwargs)})())
+    records = [upload_record(f"m{number}", f"user-documents/bulk/{number}.pdf") for number in range(5)]
+
+    result = index.process_records({'Records': records}, out_of_time=lambda: len(processed) >= 2)
+
+    assert processed == ['user-documents/bulk/0.pdf', 'user-documents/bulk/1.pdf']
+    assert [json.loads(message['MessageBody'])['deferrals'] for message in sent] == [1, 1, 1]
+    assert result == {'batchItemFailures': []}
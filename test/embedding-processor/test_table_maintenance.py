@@ -0,0 +1,25 @@
+from datetime import datetime, timedelta
+
+from table_maintenance import count_prunable_versions, needs_compaction
+
+WINDOW = timedelta(minutes=60)
+
+def versions_aged(*minutes_ago):
+    now = datetime.now()
+    return [{'version': number + 1, 'timestamp': now - timedelta(minutes=age)} for number, age in enumerate(minutes_ago)]
+
+def layout(small_fragments=0, prunable_versions=0, versions=0):
+    return {'num_small_fragments': small_fragments, 'num_prunable_versions': prunable_versions, 'num_versions': versions}
+
+def test_only_old_versions_are_prunable():
+    assert count_prunable_versions(versions_aged(120, 90, 30, 5), WINDOW) == 2
+
+def test_latest_version_is_never_prunable():
+    assert count_prunable_versions(versions_aged(300), WINDOW) == 0
+    assert count_prunable_versions([], WINDOW) == 0
+
+def test_recent_versions_do_not_trigger_compaction():
+    # Right after a compaction during a bulk load: one fragment, many versions inside the cleanup window
+    assert not needs_compaction(layout(small_fragments=1, versions=150), 32, 100)
+    assert needs_compaction(layout(small_fragments=1, prunable_versions=100, versions=150), 32, 100)
+    assert needs_compaction(layout(small_fragments=32), 32, 100)
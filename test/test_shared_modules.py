@@ -0,0 +1,13 @@
+import filecmp
+import os
+
+import pytest
+
+LAMBDA_DIR = os.path.join(os.path.dirname(__file__), '..', 'lambda')
+
+# Each Docker image is built from its own Lambda directory, so these modules are copied into both
+@pytest.mark.parametrize('module', ['embedding_profile.py', 'metrics.py'])
+def test_shared_module_copies_are_identical(module):
+    embedding_copy = os.path.join(LAMBDA_DIR, 'embedding-processor', module)
+    chat_copy = os.path.join(LAMBDA_DIR, 'chat-processor', module)
+    assert filecmp.cmp(embedding_copy, chat_copy, shallow=False), f"lambda/*/{module} differ, edit both copies"